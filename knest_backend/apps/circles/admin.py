@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Category, Circle, CircleMembership, CirclePost, CircleEvent, CircleChat, CircleSearchHistory, CircleChatRead, CircleInterest
+from .models import Category, Circle, CircleMembership, CirclePost, CircleEvent, CircleChat, CircleSearchHistory, CircleChatRead, CircleInterest, CircleChatArchive
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -112,6 +112,14 @@ class CircleChatReadAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'circle__name')
     readonly_fields = ('id', 'last_read')
 
+@admin.register(CircleChatArchive)
+class CircleChatArchiveAdmin(admin.ModelAdmin):
+    list_display = ('circle', 'period', 'message_count', 'archived_at')
+    list_filter = ('period',)
+    search_fields = ('circle__name',)
+    readonly_fields = ('id', 'message_count', 'first_created_at', 'last_created_at', 'archived_at')
+    exclude = ('payload',)
+
 @admin.register(CircleInterest)
 class CircleInterestAdmin(admin.ModelAdmin):
     list_display = ('circle', 'interest', 'relevance_score', 'added_at')
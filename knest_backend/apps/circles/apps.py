@@ -4,4 +4,11 @@ from django.apps import AppConfig
 class CirclesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'knest_backend.apps.circles'
-    verbose_name = 'サークル管理' 
\ No newline at end of file
+    verbose_name = 'サークル管理'
+
+    def ready(self):
+        """
+        アプリケーションの初期化時に実行される処理
+        """
+        # シグナルの登録
+        from . import signals
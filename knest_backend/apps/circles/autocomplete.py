@@ -0,0 +1,321 @@
+"""
+サークル・興味関心タグのオートコンプリート
+サークル名とInterestTag名の前方一致を、ワーカー内のソート済み配列（bisect）で引く
+
+- 正規化はチャット検索と同じ（NFKC・小文字化）に加え、ひらがなをカタカナに揃える
+- 名前全体に加えて、空白で区切られた2語目以降の先頭からも一致する
+- 候補はサークルはメンバー数、タグは使用回数の多い順（非公開サークルは対象外）
+- 初回の問い合わせ時に構築する
+- 同じワーカーでの保存・削除はシグナルで即時に反映する。他のワーカーでの変更は
+  一定間隔ごとのサークルの差分取り込み（updated_at）と、定期的な再構築で反映する
+- 定期的な再構築はバックグラウンドのスレッドで新しいインデックスを作り、完成後に差し替える
+  （構築中もそれまでのインデックスで応答し、構築中のシグナルによる変更は差し替え時に再適用する）
+"""
+import bisect
+import heapq
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from knest_backend.apps.interests.models import InterestTag
+from .chat_search import split_words
+from .models import Circle
+
+
+# 差分取り込みで、取り込み時点までにコミットされていなかった保存を拾うための重複幅
+SYNC_MARGIN = timedelta(seconds=10)
+
+# 一致件数がこれ以上の前方一致の結果はメモ化する（短い入力で大量の候補を毎回並べ替えないため）
+MEMO_MIN_MATCHES = 200
+MEMO_MAX_SIZE = 10000
+
+_KEY_END = '\U0010ffff'
+
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in range(0x3041, 0x3097)}
+
+
+def normalize_prefix(text):
+    """入力・名前を索引のキーの形式にする"""
+    return ' '.join(split_words(text)).translate(_HIRAGANA_TO_KATAKANA)
+
+
+def prefix_keys(label):
+    """名前全体と2語目以降の各語から始まる部分を索引キーとする"""
+    words = normalize_prefix(label).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixIndex:
+    """ソート済み配列による前方一致インデックス"""
+
+    def __init__(self):
+        # (キー, ID) の昇順
+        self._entries = []
+        # ID -> (表示名, 重み, キー)
+        self._items = {}
+        self._memo = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def load(self, rows):
+        """(ID, 表示名, 重み) の列から作り直す"""
+        items = {}
+        entries = []
+        for item_id, label, weight in rows:
+            keys = prefix_keys(label)
+            items[item_id] = (label, weight, keys)
+            entries.extend((key, item_id) for key in keys)
+        entries.sort()
+        self._entries = entries
+        self._items = items
+        self._memo = {}
+
+    def upsert(self, item_id, label, weight):
+        current = self._items.get(item_id)
+        if current is not None and current[:2] == (label, weight):
+            return
+        self.remove(item_id)
+        keys = prefix_keys(label)
+        self._items[item_id] = (label, weight, keys)
+        for key in keys:
+            bisect.insort(self._entries, (key, item_id))
+        self._memo.clear()
+
+    def remove(self, item_id):
+        item = self._items.pop(item_id, None)
+        if item is None:
+            return
+        for key in item[2]:
+            index = bisect.bisect_left(self._entries, (key, item_id))
+            if index < len(self._entries) and self._entries[index] == (key, item_id):
+                del self._entries[index]
+        self._memo.clear()
+
+    def lookup(self, prefix, limit):
+        """
+        前方一致する項目を重みの大きい順に返す
+
+        Returns:
+            list: [(ID, 表示名, 重み), ...]
+        """
+        memo = self._memo.get((prefix, limit))
+        if memo is not None:
+            return memo
+
+        start = bisect.bisect_left(self._entries, (prefix,))
+        end = bisect.bisect_left(self._entries, (prefix + _KEY_END,), start)
+        matched = {item_id for _, item_id in self._entries[start:end]}
+        results = [
+            (item_id, self._items[item_id][0], self._items[item_id][1])
+            for item_id in heapq.nlargest(
+                limit,
+                matched,
+                key=lambda item_id: (self._items[item_id][1], item_id)
+            )
+        ]
+        if len(matched) >= MEMO_MIN_MATCHES:
+            if len(self._memo) >= MEMO_MAX_SIZE:
+                self._memo.clear()
+            self._memo[(prefix, limit)] = results
+        return results
+
+
+class CircleAutocomplete:
+    """サークル・タグのオートコンプリート（ワーカー内で共有）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.circles = PrefixIndex()
+        self.tags = PrefixIndex()
+        self._loaded = False
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        # 次回の差分取り込みの起点（DBの更新日時）
+        self._synced_until = None
+        # 再構築中のシグナルによる変更（差し替え後のインデックスに再適用する）
+        self._pending = None
+        self._rebuilder = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def suggest(self, query, limit=10):
+        """
+        入力中の文字列に前方一致するサークルとタグを返す
+
+        Returns:
+            dict: {'circles': [{'id', 'name', 'member_count'}, ...],
+                   'interests': [{'id', 'name', 'usage_count'}, ...]}
+        """
+        prefix = normalize_prefix(query)
+        if not prefix:
+            return {'circles': [], 'interests': []}
+        self.ensure_fresh()
+        with self._lock:
+            circles = self.circles.lookup(prefix, limit)
+            tags = self.tags.lookup(prefix, limit)
+        return {
+            'circles': [
+                {'id': circle_id, 'name': name, 'member_count': weight}
+                for circle_id, name, weight in circles
+            ],
+            'interests': [
+                {'id': tag_id, 'name': name, 'usage_count': weight}
+                for tag_id, name, weight in tags
+            ],
+        }
+
+    def ensure_fresh(self):
+        """
+        再構築・差分取り込みの時期に達していれば行う（他のスレッドが実行中なら現状のまま返す）
+
+        初回の構築のみ問い合わせのスレッドで行い、以降の再構築はバックグラウンドで行う
+        """
+        now = time.monotonic()
+        rebuild = now - self._built_at >= getattr(settings, 'CIRCLE_AUTOCOMPLETE_REBUILD_INTERVAL', 600)
+        refresh = now - self._refreshed_at >= getattr(settings, 'CIRCLE_AUTOCOMPLETE_REFRESH_INTERVAL', 30)
+        if self._loaded and not rebuild and not refresh:
+            return
+        if self._loaded and rebuild:
+            self.start_rebuild()
+            if not refresh:
+                return
+        if not self._refresh_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            if not self._loaded:
+                self.rebuild()
+            else:
+                self.refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def start_rebuild(self):
+        """バックグラウンドのスレッドで再構築する（実行中なら何もしない）"""
+        with self._lock:
+            if self._rebuilder is not None:
+                return
+            self._rebuilder = threading.Thread(
+                target=self._rebuild_in_background,
+                name='circle-autocomplete-rebuild',
+                daemon=True
+            )
+        self._rebuilder.start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception:
+            # 失敗した場合は次の問い合わせで再度試みる（それまでは現在のインデックスで応答する）
+            pass
+        finally:
+            connections.close_all()
+            with self._lock:
+                self._rebuilder = None
+
+    def rebuild(self):
+        """DBから作り直し、完成したインデックスに差し替える"""
+        started = timezone.now()
+        with self._lock:
+            self._pending = []
+        try:
+            circles = PrefixIndex()
+            circles.load(
+                (str(pk), name, member_count)
+                for pk, name, member_count in Circle.objects.filter(
+                    is_private=False
+                ).order_by().values_list('id', 'name', 'member_count').iterator()
+            )
+            tags = PrefixIndex()
+            tags.load(
+                (str(pk), name, usage_count)
+                for pk, name, usage_count in InterestTag.objects.order_by().values_list(
+                    'id', 'name', 'usage_count'
+                ).iterator()
+            )
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            # 構築中に反映されたシグナルの変更は、読み込んだ時点の内容より新しい場合がある
+            for apply in self._pending or ():
+                apply(circles, tags)
+            self._pending = None
+            self.circles = circles
+            self.tags = tags
+            self._synced_until = started - SYNC_MARGIN
+            self._loaded = True
+            self._built_at = self._refreshed_at = time.monotonic()
+
+    def refresh(self):
+        """前回以降に更新されたサークルを取り込む"""
+        started = timezone.now()
+        changed = list(
+            Circle.objects.filter(
+                updated_at__gte=self._synced_until
+            ).order_by().values_list('id', 'name', 'member_count', 'is_private')
+        )
+        with self._lock:
+            for pk, name, member_count, is_private in changed:
+                if is_private:
+                    self.circles.remove(str(pk))
+                else:
+                    self.circles.upsert(str(pk), name, member_count)
+            self._synced_until = started - SYNC_MARGIN
+            self._refreshed_at = time.monotonic()
+
+    # シグナルからの即時反映（未構築の場合は何もしない）
+
+    def _apply(self, apply):
+        with self._lock:
+            if self._loaded:
+                apply(self.circles, self.tags)
+            if self._pending is not None:
+                self._pending.append(apply)
+
+    def note_circle(self, circle):
+        if not self._loaded and self._pending is None:
+            return
+        circle_id = str(circle.pk)
+        if circle.is_private:
+            self._apply(lambda circles, tags: circles.remove(circle_id))
+        else:
+            name, member_count = circle.name, circle.member_count
+            self._apply(lambda circles, tags: circles.upsert(circle_id, name, member_count))
+
+    def forget_circle(self, circle_id):
+        if not self._loaded and self._pending is None:
+            return
+        circle_id = str(circle_id)
+        self._apply(lambda circles, tags: circles.remove(circle_id))
+
+    def note_tag(self, tag):
+        if not self._loaded and self._pending is None:
+            return
+        tag_id, name, usage_count = str(tag.pk), tag.name, tag.usage_count
+        self._apply(lambda circles, tags: tags.upsert(tag_id, name, usage_count))
+
+    def forget_tag(self, tag_id):
+        if not self._loaded and self._pending is None:
+            return
+        tag_id = str(tag_id)
+        self._apply(lambda circles, tags: tags.remove(tag_id))
+
+    def clear(self):
+        """インデックスを破棄する（次回の問い合わせで再構築）"""
+        with self._lock:
+            self.circles = PrefixIndex()
+            self.tags = PrefixIndex()
+            self._loaded = False
+            self._built_at = self._refreshed_at = 0.0
+
+
+circle_autocomplete = CircleAutocomplete()
@@ -0,0 +1,239 @@
+"""
+チャット履歴のアーカイブ
+一定期間を過ぎたメッセージをサークル・月ごとの圧縮データへ移し、
+CircleChatテーブルには直近のメッセージのみを残す
+"""
+import json
+import logging
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import CircleChat, CircleChatArchive
+
+
+logger = logging.getLogger(__name__)
+
+
+class ArchivedChat:
+    """アーカイブから復元したメッセージ（シリアライズ済みデータを保持）"""
+
+    def __init__(self, data):
+        self.data = data
+        self.id = uuid.UUID(data['id'])
+        self.created_at = parse_datetime(data['created_at'])
+
+    @property
+    def key(self):
+        return self.created_at, self.id
+
+
+def encode_payload(messages):
+    return zlib.compress(json.dumps(messages, cls=DjangoJSONEncoder).encode())
+
+
+def decode_payload(payload):
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def _boundary_cache_key(circle_id):
+    return f'circle_chat_{circle_id}_archive_boundary'
+
+
+def archive_boundary(circle_id):
+    """アーカイブ済みメッセージのうち最新の作成日時（アーカイブがなければNone）"""
+    key = _boundary_cache_key(circle_id)
+    boundary = cache.get(key)
+    if boundary is None:
+        boundary = CircleChatArchive.objects.filter(
+            circle_id=circle_id
+        ).aggregate(last=Max('last_created_at'))['last'] or ''
+        cache.set(key, boundary, timeout=None)
+    return boundary or None
+
+
+def archived_messages(circle_id, before=None, after=None, limit=50):
+    """
+    アーカイブ済みメッセージを取得する
+
+    Args:
+        before: (created_at, id) より古いメッセージを新しい順に返す
+        after: (created_at, id) より新しいメッセージを古い順に返す
+    """
+    archives = CircleChatArchive.objects.filter(circle_id=circle_id)
+    if after is not None:
+        archives = archives.filter(last_created_at__gte=after[0]).order_by('period')
+    else:
+        if before is not None:
+            archives = archives.filter(first_created_at__lte=before[0])
+        archives = archives.order_by('-period')
+
+    results = []
+    for archive in archives.iterator():
+        messages = [ArchivedChat(data) for data in decode_payload(archive.payload)]
+        if after is not None:
+            results.extend(m for m in messages if m.key > after)
+        else:
+            results.extend(m for m in reversed(messages) if before is None or m.key < before)
+        if len(results) >= limit:
+            break
+    return results[:limit]
+
+
+def latest_archived_messages(circle_ids):
+    """
+    複数サークルのアーカイブ済みメッセージのうち最新の1件（サークル数によらずクエリ1回）
+
+    アーカイブがないことがキャッシュ済みのサークルは問い合わせない
+
+    Returns:
+        dict: サークルID -> ArchivedChat（アーカイブのないサークルは含まない）
+    """
+    keys = {_boundary_cache_key(circle_id): circle_id for circle_id in circle_ids}
+    known_empty = {keys[key] for key, boundary in cache.get_many(list(keys)).items() if boundary == ''}
+    circle_ids = [circle_id for circle_id in circle_ids if circle_id not in known_empty]
+    if not circle_ids:
+        return {}
+
+    latest_period = CircleChatArchive.objects.filter(
+        circle_id=OuterRef('circle_id')
+    ).order_by('-period').values('period')[:1]
+    archives = CircleChatArchive.objects.filter(
+        circle_id__in=circle_ids,
+        period=Subquery(latest_period)
+    ).only('circle_id', 'payload')
+    return {
+        str(archive.circle_id): ArchivedChat(decode_payload(archive.payload)[-1])
+        for archive in archives
+    }
+
+
+def archive_messages(older_than_days=None, batch_size=None):
+    """
+    古いメッセージをアーカイブへ移す
+
+    直近のメッセージから返信先として参照されているものは対象外とする。
+    古い返信が残るメッセージは、返信をアーカイブした後に改めて対象とする
+
+    Returns:
+        int: アーカイブしたメッセージ数
+    """
+    from .chat_history import chat_tail
+
+    older_than_days = older_than_days or getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 90)
+    batch_size = batch_size or getattr(settings, 'CHAT_ARCHIVE_BATCH_SIZE', 1000)
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+
+    candidates = CircleChat.objects.filter(
+        created_at__lt=cutoff
+    ).exclude(
+        replies__created_at__gte=cutoff
+    )
+    circle_ids = list(candidates.order_by().values_list('circle_id', flat=True).distinct())
+
+    archived = 0
+    for circle_id in circle_ids:
+        # 返信が残るためアーカイブしなかったメッセージ（返信をアーカイブした後に改めて対象とする）
+        deferred = set()
+        last = None
+        while True:
+            batch = candidates.filter(circle_id=circle_id)
+            if last is not None:
+                batch = batch.filter(Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1]))
+            messages = list(batch.select_related(
+                'sender', 'reply_to', 'reply_to__sender'
+            ).order_by('created_at', 'id')[:batch_size])
+            if not messages:
+                break
+
+            count, skipped = _archive_batch(circle_id, messages)
+            archived += count
+            deferred |= skipped
+            last = (messages[-1].created_at, messages[-1].id)
+            if len(messages) < batch_size:
+                break
+
+        while deferred:
+            messages = list(candidates.filter(id__in=deferred).select_related(
+                'sender', 'reply_to', 'reply_to__sender'
+            ).order_by('created_at', 'id'))
+            count, skipped = _archive_batch(circle_id, messages)
+            if not count:
+                break
+            archived += count
+            deferred = skipped
+
+        cache.delete(_boundary_cache_key(circle_id))
+        chat_tail.invalidate(circle_id)
+        logger.info('チャットをアーカイブしました: circle=%s', circle_id)
+
+    return archived
+
+
+def _archive_batch(circle_id, messages):
+    """
+    メッセージをアーカイブへ移して削除する
+
+    同じバッチでアーカイブしない返信があるメッセージは対象から外し、直近テーブルに残す
+    （削除すると返信の返信先が消え、アーカイブにも移すと直近テーブルと重複するため）
+
+    Returns:
+        tuple: (アーカイブしたメッセージ数, 対象から外したメッセージIDの集合)
+    """
+    from .chat_history import serialize_message
+
+    ids = {message.id for message in messages}
+    replies = list(CircleChat.objects.filter(reply_to_id__in=ids).values_list('id', 'reply_to_id'))
+    targets = set(ids)
+    while True:
+        blocked = {parent for reply, parent in replies if reply not in targets and parent in targets}
+        if not blocked:
+            break
+        targets -= blocked
+
+    by_period = {}
+    for message in messages:
+        if message.id in targets:
+            period = message.created_at.date().replace(day=1)
+            by_period.setdefault(period, []).append(message)
+
+    with transaction.atomic():
+        for period, period_messages in by_period.items():
+            _merge_into_archive(
+                circle_id,
+                period,
+                [serialize_message(message)[2] for message in period_messages]
+            )
+        CircleChat.objects.filter(id__in=targets).delete()
+    return len(targets), ids - targets
+
+
+def _merge_into_archive(circle_id, period, new_messages):
+    new_messages = json.loads(json.dumps(new_messages, cls=DjangoJSONEncoder))
+    archive = CircleChatArchive.objects.select_for_update().filter(
+        circle_id=circle_id,
+        period=period
+    ).first()
+
+    merged = {data['id']: data for data in decode_payload(archive.payload)} if archive else {}
+    merged.update((data['id'], data) for data in new_messages)
+    messages = sorted(
+        merged.values(),
+        key=lambda data: (parse_datetime(data['created_at']), uuid.UUID(data['id']))
+    )
+
+    if archive is None:
+        archive = CircleChatArchive(circle_id=circle_id, period=period)
+    archive.message_count = len(messages)
+    archive.first_created_at = parse_datetime(messages[0]['created_at'])
+    archive.last_created_at = parse_datetime(messages[-1]['created_at'])
+    archive.payload = encode_payload(messages)
+    archive.save()
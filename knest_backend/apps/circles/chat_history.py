@@ -0,0 +1,128 @@
+"""
+チャット履歴の末尾キャッシュ
+サークルごとに直近N件のシリアライズ済みメッセージをリングバッファで保持する
+
+- バッファはプロセス内に保持し、ワーカー間の整合性はキャッシュ上のバージョン番号で判定する
+- 他ワーカーで書き込みがあった場合はバージョンが一致しなくなり、次回参照時にDBから再構築する
+"""
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .chat_archive import ArchivedChat
+
+
+def serialize_message(message):
+    """キャッシュ用にメッセージをシリアライズする（read_byは参照時に付与）"""
+    from .serializers import CircleChatSerializer
+
+    if isinstance(message, ArchivedChat):
+        return message.created_at, message.id, dict(message.data)
+    data = dict(CircleChatSerializer(message, context={'chat_reads': ()}).data)
+    data.pop('read_by', None)
+    return message.created_at, message.id, data
+
+
+class _Tail:
+    def __init__(self, entries, size, has_more, version):
+        self.entries = deque(entries, maxlen=size)
+        self.has_more = has_more
+        self.version = version
+
+
+class ChatTailCache:
+    """サークルごとの直近メッセージのリングバッファ"""
+
+    def __init__(self, size=None):
+        self.size = size or getattr(settings, 'CHAT_TAIL_CACHE_SIZE', 50)
+        self._lock = threading.Lock()
+        self._tails = {}
+        # circle_id -> プロセス内の書き込み回数
+        self._local_versions = {}
+
+    @staticmethod
+    def _version_key(circle_id):
+        return f'circle_chat_{circle_id}_version'
+
+    def version(self, circle_id):
+        """
+        現在のバージョン（共有, プロセス内）を返す
+
+        DBから履歴を取得する前に呼び出し、その値をstore()に渡すこと
+        """
+        circle_id = str(circle_id)
+        shared = cache.get(self._version_key(circle_id))
+        with self._lock:
+            return shared, self._local_versions.get(circle_id, 0)
+
+    def _bump_version(self, circle_id):
+        key = self._version_key(circle_id)
+        try:
+            shared = cache.incr(key)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            try:
+                shared = cache.incr(key)
+            except ValueError:
+                # 共有キャッシュが無効な環境ではプロセス内の状態のみで判定する
+                shared = None
+        with self._lock:
+            local = self._local_versions.get(circle_id, 0) + 1
+            self._local_versions[circle_id] = local
+        return shared, local
+
+    def get(self, circle_id):
+        """
+        直近メッセージを返す
+
+        Returns:
+            tuple: ([(created_at, id, data), ...], 古いメッセージが残っているか)
+                   キャッシュがないか古い場合はNone
+        """
+        circle_id = str(circle_id)
+        current = self.version(circle_id)
+        with self._lock:
+            tail = self._tails.get(circle_id)
+            if tail is None:
+                return None
+            if tail.version != current:
+                del self._tails[circle_id]
+                return None
+            return list(tail.entries), tail.has_more
+
+    def store(self, circle_id, entries, has_more, version):
+        """DBから取得した直近メッセージを保存する"""
+        circle_id = str(circle_id)
+        with self._lock:
+            self._tails[circle_id] = _Tail(entries[-self.size:], self.size, has_more, version)
+
+    def append(self, circle_id, message):
+        """新規メッセージを末尾に追加する"""
+        circle_id = str(circle_id)
+        shared, local = self._bump_version(circle_id)
+        entry = serialize_message(message)
+        with self._lock:
+            tail = self._tails.get(circle_id)
+            if tail is None:
+                return
+            expected = (shared - 1 if shared is not None else None, local - 1)
+            if tail.version != expected:
+                # 他の書き込みを取りこぼしている
+                del self._tails[circle_id]
+                return
+            if len(tail.entries) == tail.entries.maxlen:
+                tail.has_more = True
+            tail.entries.append(entry)
+            tail.version = (shared, local)
+
+    def invalidate(self, circle_id):
+        """編集・削除時にキャッシュを破棄する"""
+        circle_id = str(circle_id)
+        self._bump_version(circle_id)
+        with self._lock:
+            self._tails.pop(circle_id, None)
+
+
+chat_tail = ChatTailCache()
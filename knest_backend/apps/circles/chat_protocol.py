@@ -0,0 +1,95 @@
+"""
+チャットWebSocketのコンパクト形式
+WebSocketのサブプロトコルで交渉し、フレームをMessagePackのバイナリで送受信する
+
+- 送信者などのユーザー情報はセッション内で1回だけ "profile" フレームとして送り、
+  以降のフレームでは小さな整数の参照に置き換える
+- msgpackが未インストールの場合はサブプロトコルを受け入れず、通常のJSON形式で通信する
+"""
+import json
+from functools import lru_cache
+
+try:
+    import msgpack
+except ImportError:  # msgpackが未インストールの場合はコンパクト形式を提供しない
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+COMPACT_SUBPROTOCOL = 'knest.compact.v1'
+
+
+def negotiate(scope):
+    """クライアントが要求したサブプロトコルからコンパクト形式を使うか判定する"""
+    return msgpack is not None and COMPACT_SUBPROTOCOL in scope.get('subprotocols', ())
+
+
+def decode_frame(text):
+    """シリアライズ済みJSONフレームを復元する"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+@lru_cache(maxsize=256)
+def decode_broadcast_frame(text):
+    """
+    グループイベントのシリアライズ済みフレームを復元する
+
+    同じワーカーの受信者は同じフレームを受け取るため、直近の復元結果を共有する
+    （共有するため、戻り値は変更しないこと）
+    """
+    return decode_frame(text)
+
+
+def decode_client_frame(data):
+    """クライアントから受信したバイナリフレームを復元する"""
+    return msgpack.unpackb(data, raw=False)
+
+
+class CompactFrameEncoder:
+    """セッション単位のコンパクト形式エンコーダー"""
+
+    def __init__(self):
+        # user_id -> 参照番号
+        self._refs = {}
+        # user_id -> 送信済みのユーザー情報
+        self._sent = {}
+
+    def _ref(self, user, profiles):
+        """ユーザー情報を参照番号に置き換え、未送信の情報があればprofileフレームを積む"""
+        user_id = user['id']
+        ref = self._refs.get(user_id)
+        if ref is None:
+            ref = self._refs[user_id] = len(self._refs) + 1
+        sent = self._sent.get(user_id, {})
+        if any(sent.get(key) != value for key, value in user.items()):
+            sent = self._sent[user_id] = {**sent, **user}
+            profiles.append({'type': 'profile', 'ref': ref, 'user': sent})
+        return ref
+
+    def encode(self, frame):
+        """
+        フレームをエンコードする
+
+        Returns:
+            list: 送信するバイナリフレーム（profileフレームが先行する場合がある）
+        """
+        profiles = []
+        frame = dict(frame)
+        if isinstance(frame.get('user'), dict):
+            frame['user'] = self._ref(frame['user'], profiles)
+        message = frame.get('message')
+        if isinstance(message, dict):
+            message = frame['message'] = dict(message)
+            if isinstance(message.get('sender'), dict):
+                message['sender'] = self._ref(message['sender'], profiles)
+            reply_to = message.get('reply_to')
+            if isinstance(reply_to, dict) and isinstance(reply_to.get('sender'), dict):
+                reply_to = message['reply_to'] = dict(reply_to)
+                reply_to['sender'] = self._ref(reply_to['sender'], profiles)
+        return [msgpack.packb(f, use_bin_type=True) for f in profiles + [frame]]
@@ -0,0 +1,136 @@
+"""
+チャットの全文検索
+メッセージ本文をbi-gramに分割した転置インデックス（CircleChatSearchToken）で検索する
+
+- 日本語は単語の区切りがないため、形態素解析の代わりに文字bi-gramを用いる
+- インデックスはサークル単位で、メッセージの保存時に更新する（signals.py）
+- bi-gramで絞り込んだ候補を正規化した本文で照合し、語順の異なる誤検出を除く
+- アーカイブ済みのメッセージは検索対象外
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import CircleChat, CircleChatSearchToken
+
+
+NGRAM_SIZE = 2
+
+_SEPARATOR = re.compile(r'\s+')
+
+
+def normalize(text):
+    """全角・半角や大文字・小文字の違いを吸収する"""
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def split_words(text):
+    """正規化したテキストを空白で語に分割する"""
+    return [word for word in _SEPARATOR.split(normalize(text)) if word]
+
+
+def tokenize(text):
+    """
+    テキストをbi-gramの集合に分割する
+
+    1文字の語はそのまま1トークンとする
+    """
+    tokens = set()
+    for word in split_words(text):
+        if len(word) < NGRAM_SIZE:
+            tokens.add(word)
+            continue
+        tokens.update(word[i:i + NGRAM_SIZE] for i in range(len(word) - NGRAM_SIZE + 1))
+    return tokens
+
+
+def index_message(message, created=False):
+    """メッセージの検索トークンを作り直す（新規作成時は既存トークンの削除を省く）"""
+    with transaction.atomic():
+        if not created:
+            CircleChatSearchToken.objects.filter(message_id=message.id).delete()
+        CircleChatSearchToken.objects.bulk_create([
+            CircleChatSearchToken(circle_id=message.circle_id, message_id=message.id, token=token)
+            for token in tokenize(message.content)
+        ])
+
+
+def rebuild_index(circle_id=None, batch_size=1000):
+    """
+    検索インデックスを再構築する
+
+    Returns:
+        int: インデックスしたメッセージ数
+    """
+    messages = CircleChat.objects.order_by('created_at', 'id').only('id', 'circle_id', 'content')
+    tokens = CircleChatSearchToken.objects.all()
+    if circle_id is not None:
+        messages = messages.filter(circle_id=circle_id)
+        tokens = tokens.filter(circle_id=circle_id)
+    tokens.delete()
+
+    indexed = 0
+    batch = []
+    for message in messages.iterator(chunk_size=batch_size):
+        batch.extend(
+            CircleChatSearchToken(circle_id=message.circle_id, message_id=message.id, token=token)
+            for token in tokenize(message.content)
+        )
+        indexed += 1
+        if len(batch) >= batch_size:
+            CircleChatSearchToken.objects.bulk_create(batch)
+            batch = []
+    CircleChatSearchToken.objects.bulk_create(batch)
+    return indexed
+
+
+def search_messages(circle_id, query, limit=50, before=None):
+    """
+    サークル内のメッセージを検索する
+
+    Args:
+        before: (created_at, id) より古いメッセージのみを対象とする（ページング用）
+
+    Returns:
+        tuple: (一致したメッセージのリスト（新しい順）, さらに古い一致があるか)
+    """
+    words = split_words(query)
+    if not words:
+        return [], False
+
+    queryset = CircleChat.objects.filter(circle_id=circle_id)
+    if before is not None:
+        created_at, pk = before
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+    for word in words:
+        if len(word) < NGRAM_SIZE:
+            # 1文字の検索語はその文字を含むトークンで絞り込む
+            candidates = CircleChatSearchToken.objects.filter(
+                circle_id=circle_id,
+                token__contains=word
+            ).values('message_id')
+        else:
+            grams = tokenize(word)
+            candidates = CircleChatSearchToken.objects.filter(
+                circle_id=circle_id,
+                token__in=grams
+            ).values('message_id').annotate(
+                matched=Count('token', distinct=True)
+            ).filter(matched=len(grams)).values('message_id')
+        queryset = queryset.filter(id__in=candidates)
+
+    # 候補を正規化した本文で照合する
+    results = []
+    for message in queryset.select_related(
+        'sender', 'reply_to', 'reply_to__sender'
+    ).order_by('-created_at', '-id').iterator(chunk_size=limit + 1):
+        content = normalize(message.content)
+        if all(word in content for word in words):
+            if len(results) == limit:
+                return results, True
+            results.append(message)
+    return results, False
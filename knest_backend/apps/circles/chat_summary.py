@@ -0,0 +1,97 @@
+"""
+チャット一覧用のサマリー
+参加中の全サークルについて最新メッセージ・未読数・最終既読時刻をまとめて取得する
+
+クエリ数はサークル数によらず一定（最新メッセージ・アーカイブ済みの最新メッセージ・既読・未読数で各1回）
+"""
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .chat_archive import latest_archived_messages
+from .chat_history import serialize_message
+from .membership_cache import get_active_circle_ids
+from .models import CircleChat, CircleChatRead
+from .read_status import read_watermarks
+
+
+def build_chat_summaries(user):
+    """
+    参加中の全サークルのチャットサマリーを返す
+
+    Returns:
+        list: 最新メッセージの新しい順
+              [{'circle': id, 'last_message': dict|None, 'unread_count': int, 'last_read': datetime|None}, ...]
+    """
+    circle_ids = sorted(get_active_circle_ids(user.id))
+    if not circle_ids:
+        return []
+
+    # 最新メッセージ（サークルごとに1件）
+    last_messages = {
+        str(message.circle_id): message
+        for message in CircleChat.objects.filter(
+            circle_id__in=circle_ids
+        ).select_related(
+            'sender', 'reply_to', 'reply_to__sender'
+        ).annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=[F('circle_id')],
+                order_by=[F('created_at').desc(), F('id').desc()]
+            )
+        ).filter(row_number=1).order_by()
+    }
+    # 直近のメッセージがすべてアーカイブ済みのサークル（まとめて1回で取得）
+    last_messages.update(latest_archived_messages(
+        [circle_id for circle_id in circle_ids if circle_id not in last_messages]
+    ))
+
+    # 最終既読（未反映の既読も考慮）
+    stored = {
+        str(circle_id): last_read
+        for circle_id, last_read in CircleChatRead.objects.filter(
+            user=user,
+            circle_id__in=circle_ids
+        ).values_list('circle_id', 'last_read')
+    }
+    last_reads = {
+        circle_id: read_watermarks.last_read(user.id, circle_id, stored.get(circle_id))
+        for circle_id in circle_ids
+    }
+
+    # 未読数（既読時刻以降の他ユーザーのメッセージ）
+    condition = Q()
+    for circle_id in circle_ids:
+        if circle_id in last_messages:
+            condition |= Q(
+                circle_id=circle_id,
+                created_at__gt=last_reads[circle_id] or user.date_joined
+            )
+    unread_counts = {}
+    if condition:
+        unread_counts = {
+            str(row['circle_id']): row['unread_count']
+            for row in CircleChat.objects.filter(condition).exclude(
+                sender=user
+            ).order_by().values('circle_id').annotate(unread_count=Count('id'))
+        }
+
+    # 最新メッセージの新しい順（メッセージのないサークルは末尾）
+    ordered = sorted(
+        (circle_id for circle_id in circle_ids if circle_id in last_messages),
+        key=lambda circle_id: (last_messages[circle_id].created_at, last_messages[circle_id].id),
+        reverse=True
+    ) + [circle_id for circle_id in circle_ids if circle_id not in last_messages]
+
+    return [
+        {
+            'circle': circle_id,
+            'last_message': (
+                serialize_message(last_messages[circle_id])[2]
+                if circle_id in last_messages else None
+            ),
+            'unread_count': unread_counts.get(circle_id, 0),
+            'last_read': last_reads[circle_id],
+        }
+        for circle_id in ordered
+    ]
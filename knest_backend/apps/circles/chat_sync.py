@@ -0,0 +1,121 @@
+"""
+チャットの差分同期
+クライアントが最後に受信したメッセージIDを基に、参加中の全サークルの
+新着メッセージ・編集・既読の変化を1回のレスポンスで返す
+"""
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .chat_history import serialize_message
+from .membership_cache import get_active_circle_ids
+from .models import CircleChat, CircleChatRead
+
+
+def build_chat_delta(user, last_seen=None, since=None, limit=None):
+    """
+    差分を構築する
+
+    Args:
+        last_seen: {circle_id: 最後に受信したメッセージID}
+        since: 前回同期日時（編集・既読の変化の基準）
+        limit: サークルごとの新着メッセージの最大件数
+    """
+    limit = limit or getattr(settings, 'CHAT_SYNC_MAX_MESSAGES_PER_CIRCLE', 100)
+    synced_at = timezone.now()
+    last_seen = {str(circle_id): message_id for circle_id, message_id in (last_seen or {}).items()}
+    circle_ids = sorted(get_active_circle_ids(user.id))
+    if not circle_ids:
+        return {'synced_at': synced_at, 'circles': {}}
+
+    # 最終受信メッセージの位置 (created_at, id)
+    seen_ids = [message_id for circle_id, message_id in last_seen.items() if message_id and circle_id in circle_ids]
+    positions = {
+        str(row['circle_id']): (row['created_at'], row['id'])
+        for row in CircleChat.objects.filter(id__in=seen_ids).values('id', 'circle_id', 'created_at')
+    }
+
+    # 新着メッセージ（サークルごとに古い順でlimit+1件まで）
+    condition = Q()
+    for circle_id in circle_ids:
+        position = positions.get(circle_id)
+        if position is None:
+            condition |= Q(circle_id=circle_id)
+        else:
+            created_at, pk = position
+            condition |= Q(circle_id=circle_id) & (
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            )
+    new_messages = CircleChat.objects.filter(condition).select_related(
+        'sender', 'reply_to', 'reply_to__sender'
+    ).annotate(
+        row_number=Window(
+            RowNumber(),
+            partition_by=[F('circle_id')],
+            order_by=[F('created_at').desc(), F('id').desc()]
+        )
+    ).filter(row_number__lte=limit + 1)
+
+    delta = {}
+
+    def circle_delta(circle_id):
+        return delta.setdefault(circle_id, {
+            'messages': [],
+            'has_more': False,
+            'edited': [],
+            'reads': [],
+        })
+
+    new_ids = set()
+    grouped = {}
+    for message in new_messages:
+        grouped.setdefault(str(message.circle_id), []).append(message)
+    for circle_id, messages in grouped.items():
+        messages.sort(key=lambda m: (m.created_at, m.id))
+        entry = circle_delta(circle_id)
+        # 上限を超えた場合は最新のlimit件を返し、古い分はページ取得に任せる
+        entry['has_more'] = len(messages) > limit
+        for message in messages[-limit:]:
+            new_ids.add(message.id)
+            entry['messages'].append(serialize_message(message)[2])
+
+    # 編集・既読の変化（基準日時がある場合のみ）
+    def baseline(circle_id):
+        if since is not None:
+            return since
+        position = positions.get(circle_id)
+        return position[0] if position else None
+
+    edit_condition = Q()
+    read_condition = Q()
+    for circle_id in circle_ids:
+        changed_after = baseline(circle_id)
+        if changed_after is None:
+            continue
+        edit_condition |= Q(circle_id=circle_id, updated_at__gt=changed_after)
+        read_condition |= Q(circle_id=circle_id, last_read__gt=changed_after)
+
+    if edit_condition:
+        edited = CircleChat.objects.filter(
+            edit_condition,
+            is_edited=True
+        ).exclude(id__in=new_ids).select_related('sender', 'reply_to', 'reply_to__sender')
+        for message in edited:
+            circle_delta(str(message.circle_id))['edited'].append(serialize_message(message)[2])
+
+    if read_condition:
+        reads = CircleChatRead.objects.filter(read_condition).values(
+            'circle_id', 'user__id', 'user__username', 'user__display_name', 'last_read'
+        )
+        for read in reads:
+            circle_delta(str(read['circle_id']))['reads'].append({
+                'user': {
+                    'id': read['user__id'],
+                    'username': read['user__username'],
+                    'display_name': read['user__display_name'],
+                },
+                'last_read': read['last_read'],
+            })
+
+    return {'synced_at': synced_at, 'circles': delta}
@@ -0,0 +1,265 @@
+"""
+サークル検索
+サークル名・説明・タグ・興味関心タグ名をbi-gramに分割した転置インデックス（CircleSearchToken）で検索する
+
+- トークン化はチャット検索（chat_search.py）と共通
+- トークンごとに出現した項目の重みの合計を保持し、一致したトークンの重みの合計を関連度とする
+- bi-gramの一致は候補とし、一致したすべてのトークンの関連度で並べた上位の候補
+  （最大 CIRCLE_SEARCH_MAX_CANDIDATES 件）を正規化した各項目で照合する（各検索語がいずれかの項目に含まれること）
+- 候補が上限を超えた場合は、結果が打ち切られたこと（truncated）を返す
+- インデックスはサークル・興味関心の保存時に差分で更新する（signals.py）
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Prefetch, Sum, Value, When
+
+from knest_backend.apps.interests.models import InterestTag
+from .chat_search import NGRAM_SIZE, normalize, split_words, tokenize
+from .models import Circle, CircleInterest, CircleSearchToken
+
+
+# 項目ごとの重み（サークル名での一致を最も高く評価する）
+FIELD_WEIGHTS = {
+    'name': 4,
+    'tags': 2,
+    'interests': 2,
+    'description': 1,
+}
+
+# 候補の絞り込みで、索引の1件の参照を走査の何件分とみなすか
+SEEK_COST = 8
+
+
+def circle_fields(circle, interest_names):
+    """
+    検索対象の項目
+
+    Returns:
+        tuple: (項目名, テキスト) のタプル
+    """
+    tags = circle.tags if isinstance(circle.tags, list) else []
+    return (
+        ('name', circle.name),
+        ('description', circle.description),
+        ('tags', ' '.join(str(tag) for tag in tags)),
+        ('interests', ' '.join(interest_names)),
+    )
+
+
+def circle_tokens(circle, interest_names):
+    """
+    サークルの検索トークンと重みを求める
+
+    Returns:
+        Counter: トークン -> 重み
+    """
+    weights = Counter()
+    for field, text in circle_fields(circle, interest_names):
+        for token in tokenize(text):
+            weights[token] += FIELD_WEIGHTS[field]
+    return weights
+
+
+def index_circle(circle):
+    """
+    サークルの検索トークンを更新する（変化したトークンのみ書き込む）
+
+    Returns:
+        tuple: (変更前, 変更後) の {トークン: 重み}
+    """
+    interest_names = CircleInterest.objects.filter(
+        circle_id=circle.pk
+    ).values_list('interest__name', flat=True)
+    tokens = circle_tokens(circle, interest_names)
+
+    with transaction.atomic():
+        existing = dict(
+            CircleSearchToken.objects.filter(circle_id=circle.pk).values_list('token', 'weight')
+        )
+        stale = [token for token, weight in existing.items() if tokens.get(token) != weight]
+        if stale:
+            CircleSearchToken.objects.filter(circle_id=circle.pk, token__in=stale).delete()
+        # 同じサークルを同時に更新した場合は後から書き込んだ重みを残す
+        CircleSearchToken.objects.bulk_create([
+            CircleSearchToken(circle_id=circle.pk, token=token, weight=weight)
+            for token, weight in tokens.items()
+            if existing.get(token) != weight
+        ], update_conflicts=True, unique_fields=['circle', 'token'], update_fields=['weight'])
+    return existing, tokens
+
+
+def rebuild_index(batch_size=1000):
+    """
+    検索インデックスを再構築する
+
+    Returns:
+        int: インデックスしたサークル数
+    """
+    CircleSearchToken.objects.all().delete()
+    circles = Circle.objects.order_by('pk').only(
+        'id', 'name', 'description', 'tags'
+    ).prefetch_related(
+        Prefetch('interests', queryset=InterestTag.objects.only('id', 'name'))
+    )
+
+    indexed = 0
+    batch = []
+    for circle in circles.iterator(chunk_size=batch_size):
+        tokens = circle_tokens(circle, [interest.name for interest in circle.interests.all()])
+        batch.extend(
+            CircleSearchToken(circle_id=circle.pk, token=token, weight=weight)
+            for token, weight in tokens.items()
+        )
+        indexed += 1
+        if len(batch) >= batch_size:
+            CircleSearchToken.objects.bulk_create(batch)
+            batch = []
+    CircleSearchToken.objects.bulk_create(batch)
+    return indexed
+
+
+def _frequency_key(token):
+    return f'circle_search_df_{token.encode().hex()}'
+
+
+def token_frequencies(tokens):
+    """
+    トークンごとの出現サークル数
+
+    絞り込みの順序を決めるためだけに使うため、キャッシュした値が古くても検索結果は変わらない
+
+    Returns:
+        dict: トークン -> サークル数
+    """
+    keys = {_frequency_key(token): token for token in tokens}
+    frequencies = {keys[key]: count for key, count in cache.get_many(list(keys)).items()}
+    missing = [token for token in tokens if token not in frequencies]
+    if missing:
+        counted = dict(
+            CircleSearchToken.objects.filter(token__in=missing).order_by().values('token').annotate(
+                count=Count('id')
+            ).values_list('token', 'count')
+        )
+        counted = {token: counted.get(token, 0) for token in missing}
+        cache.set_many(
+            {_frequency_key(token): count for token, count in counted.items()},
+            timeout=getattr(settings, 'CIRCLE_SEARCH_FREQUENCY_CACHE_TIMEOUT', 60 * 60)
+        )
+        frequencies.update(counted)
+    return frequencies
+
+
+def matching_circles(query):
+    """
+    検索語のすべてのトークンを持つサークルと関連度のクエリ
+
+    トークンの一致のみで判定するため、検索語を含まないサークルも含まれうる（照合は ranked_matches）
+
+    Returns:
+        QuerySet: values('circle_id', 'search_rank')。検索語が空の場合はNone
+    """
+    words = split_words(query)
+    if not words:
+        return None
+    grams = set()
+    for word in words:
+        if len(word) >= NGRAM_SIZE:
+            grams.update(tokenize(word))
+    singles = [word for word in words if len(word) < NGRAM_SIZE]
+
+    tokens = CircleSearchToken.objects.order_by()
+    # 1文字の検索語はその文字を含むトークンを持つサークルに絞り込む
+    for char in singles:
+        tokens = tokens.filter(
+            circle_id__in=CircleSearchToken.objects.filter(token__contains=char).values('circle_id')
+        )
+    if grams:
+        frequencies = token_frequencies(grams)
+        rarest = min(grams, key=lambda token: (frequencies[token], token))
+        if len(grams) > 1:
+            # 出現数の最も少ないトークンを持つサークルに候補を絞ってから照合する
+            # 候補ごとの索引参照は走査より高くつくため、十分に読み込み量が減る場合のみ行う
+            if frequencies[rarest] * len(grams) * SEEK_COST < sum(frequencies.values()):
+                tokens = tokens.filter(
+                    circle_id__in=CircleSearchToken.objects.filter(token=rarest).values('circle_id')
+                )
+        return tokens.filter(token__in=grams).values('circle_id').annotate(
+            matched=Count('token', distinct=True),
+            search_rank=Sum('weight')
+        ).filter(matched=len(grams)).values('circle_id', 'search_rank')
+    return tokens.filter(token__contains=singles[0]).values('circle_id').annotate(
+        search_rank=Sum('weight')
+    ).values('circle_id', 'search_rank')
+
+
+class RankedMatches(dict):
+    """サークルID -> 関連度。truncated は候補が上限を超え、関連度の低い一致を照合しなかったかどうか"""
+
+    def __init__(self, ranks=(), truncated=False):
+        super().__init__(ranks)
+        self.truncated = truncated
+
+
+def ranked_matches(query):
+    """
+    検索語に一致するサークルの関連度
+
+    トークンで一致した候補のうち関連度の高いものから CIRCLE_SEARCH_MAX_CANDIDATES 件を、
+    正規化した項目で照合する（各検索語がいずれかの項目に含まれること）
+
+    Returns:
+        RankedMatches: サークルID -> 関連度。検索語が空の場合はNone
+    """
+    matches = matching_circles(query)
+    if matches is None:
+        return None
+    words = split_words(query)
+    limit = getattr(settings, 'CIRCLE_SEARCH_MAX_CANDIDATES', 1000)
+    candidates = dict(
+        matches.order_by('-search_rank', 'circle_id').values_list('circle_id', 'search_rank')[:limit + 1]
+    )
+    truncated = len(candidates) > limit
+    if truncated:
+        candidates.popitem()
+    circles = Circle.objects.filter(id__in=candidates).only(
+        'id', 'name', 'description', 'tags'
+    ).prefetch_related(
+        Prefetch('interests', queryset=InterestTag.objects.only('id', 'name'))
+    )
+
+    ranks = RankedMatches(truncated=truncated)
+    for circle in circles:
+        interest_names = [interest.name for interest in circle.interests.all()]
+        texts = [normalize(text) for _, text in circle_fields(circle, interest_names)]
+        if all(any(word in text for text in texts) for word in words):
+            ranks[circle.pk] = candidates[circle.pk]
+    return ranks
+
+
+def search_circles(queryset, query):
+    """
+    サークルを検索語で絞り込み、関連度（search_rank）を注釈する
+
+    検索語が空の場合はquerysetをそのまま返す
+    """
+    ranks = ranked_matches(query)
+    if ranks is None:
+        return queryset
+    return rank_circles(queryset, ranks)
+
+
+def rank_circles(queryset, ranks):
+    """querysetを ranked_matches の結果で絞り込み、関連度（search_rank）を注釈する"""
+    by_rank = {}
+    for pk, rank in ranks.items():
+        by_rank.setdefault(rank, []).append(pk)
+    return queryset.filter(id__in=list(ranks)).annotate(
+        search_rank=Case(
+            *[When(pk__in=pks, then=Value(rank)) for rank, pks in by_rank.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+    )
@@ -1,194 +1,274 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from .models import CircleChat, CircleMembership, CircleChatRead
+from .models import CircleChat
 from django.core.exceptions import ObjectDoesNotExist
+from .realtime import room_events, encode_frame
+from .read_status import read_watermarks
+from .membership_cache import is_active_member, get_active_circle_ids
+from .chat_history import chat_tail
+from .rate_limit import chat_limits
+from .chat_protocol import (
+    COMPACT_SUBPROTOCOL, CompactFrameEncoder, decode_broadcast_frame, decode_client_frame, negotiate
+)
 
-class CircleChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.circle_id = self.scope['url_route']['kwargs']['circle_id']
-        self.room_group_name = f'chat_{self.circle_id}'
-        self.user = self.scope['user']
 
-        # メンバーシップの確認
-        if not await self.is_circle_member():
-            await self.close()
-            return
+# チャットのDB処理用スレッドプール（DB接続数の上限に合わせて設定する）
+_db_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CHAT_DB_THREADS', 8),
+    thread_name_prefix='chat-db'
+)
 
-        # グループに参加
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
-        await self.accept()
-
-        # オンライン状態を通知
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_online',
-                'user': {
-                    'id': str(self.user.id),
-                    'username': self.user.username,
-                    'display_name': self.user.display_name,
-                }
-            }
-        )
 
-    async def disconnect(self, close_code):
-        if hasattr(self, 'room_group_name'):
-            # オフライン状態を通知
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_offline',
-                    'user': {
-                        'id': str(self.user.id),
-                        'username': self.user.username,
-                        'display_name': self.user.display_name,
-                    }
-                }
-            )
-            
-            # グループから離脱
-            await self.channel_layer.group_discard(
-                self.room_group_name,
-                self.channel_name
-            )
+class ChatDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """
+    チャット用のDB処理をスレッドプールで実行する
+
+    database_sync_to_async（thread_sensitive=True）では全コンシューマーのDB処理が
+    単一のスレッドに直列化されるため、専用のスレッドプールで並列に実行する
+    （Django 4.2の非同期ORM APIも内部では同じ単一スレッドで実行される）
+    """
+
+    def __init__(self, func):
+        super().__init__(func, thread_sensitive=False, executor=_db_executor)
+
+
+chat_db_sync_to_async = ChatDatabaseSyncToAsync
+
+
+def room_group_name(circle_id):
+    """サークルのチャットルーム（チャネルグループ）名"""
+    return f'chat_{circle_id}'
+
+
+class BaseChatConsumer(AsyncWebsocketConsumer):
+    """
+    チャットルームの共通処理
+    ルームへの参加・離脱と、クライアントからのフレーム処理をサークルIDを指定して行う
+    """
+    compact = None
+    rate_limit = None
+
+    # DB書き込みが混雑している場合に返す再送までの秒数
+    busy_retry_after = 1.0
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def accept_session(self):
+        """接続を受け入れる（サブプロトコルで要求された場合はコンパクト形式を使用）"""
+        self.rate_limit = chat_limits.connection_bucket()
+        if negotiate(self.scope):
+            self.compact = CompactFrameEncoder()
+            await self.accept(subprotocol=COMPACT_SUBPROTOCOL)
+        else:
+            await self.accept()
+
+    def parse_frame(self, text_data=None, bytes_data=None):
+        """クライアントからのフレームを復元"""
+        if bytes_data is not None and self.compact is not None:
+            return decode_client_frame(bytes_data)
+        return json.loads(text_data)
+
+    async def join_room(self, circle_id):
+        """ルームに参加"""
+        room = room_group_name(circle_id)
+        await self.channel_layer.group_add(room, self.channel_name)
+        # オンライン状態を登録（ルーム単位でまとめて配信）
+        room_events.user_connected(room, self.get_user_data())
+
+    async def leave_room(self, circle_id):
+        """ルームから離脱"""
+        room = room_group_name(circle_id)
+        # オフライン状態を登録（ルーム単位でまとめて配信）
+        room_events.user_disconnected(room, self.get_user_data())
+        await self.channel_layer.group_discard(room, self.channel_name)
+
+    async def handle_frame(self, circle_id, data):
+        """クライアントからのフレームを処理"""
+        room = room_group_name(circle_id)
         message_type = data.get('type', 'message')
 
+        # 接続単位のレート制限
+        if self.rate_limit is not None:
+            retry_after = self.rate_limit.consume()
+            if retry_after:
+                await self.send_backpressure(room, 'rate_limited', retry_after)
+                return
+
         if message_type == 'message':
-            # メッセージの保存と送信
-            message = await self.save_message(data['content'], data.get('reply_to'))
-            
+            # ルーム単位のレート制限
+            retry_after = await chat_limits.acheck_room(room)
+            if retry_after:
+                await self.send_backpressure(room, 'rate_limited', retry_after)
+                return
+            # DB書き込みが詰まっている場合は受け付けない
+            if not chat_limits.acquire_write(room):
+                await self.send_backpressure(room, 'busy', self.busy_retry_after)
+                return
+
+            # メッセージの保存と送信（返信先の情報も同じDB処理で取得する）
+            try:
+                message, reply_to = await self.save_message(circle_id, data['content'], data.get('reply_to'))
+            finally:
+                chat_limits.release_write(room)
+
+            # 送信側で一度だけシリアライズし、受信側はそのまま転送する
             await self.channel_layer.group_send(
-                self.room_group_name,
+                room,
                 {
                     'type': 'chat_message',
-                    'message': {
-                        'id': str(message.id),
-                        'content': message.content,
-                        'sender': {
-                            'id': str(message.sender.id),
-                            'username': message.sender.username,
-                            'display_name': message.sender.display_name,
-                            'avatar_url': message.sender.avatar_url,
-                        },
-                        'created_at': message.created_at.isoformat(),
-                        'is_system_message': message.is_system_message,
-                        'reply_to': await self.get_reply_to_data(message.reply_to) if message.reply_to else None,
-                    }
+                    'room': room,
+                    'text': encode_frame({
+                        'type': 'message',
+                        'message': {
+                            'id': str(message.id),
+                            'content': message.content,
+                            'sender': {
+                                'id': str(message.sender.id),
+                                'username': message.sender.username,
+                                'display_name': message.sender.display_name,
+                                'avatar_url': message.sender.avatar_url,
+                            },
+                            'created_at': message.created_at.isoformat(),
+                            'is_system_message': message.is_system_message,
+                            'reply_to': reply_to,
+                        }
+                    }),
                 }
             )
         elif message_type == 'typing':
-            # タイピング状態の通知
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_typing',
-                    'user': {
-                        'id': str(self.user.id),
-                        'username': self.user.username,
-                        'display_name': self.user.display_name,
-                    }
-                }
-            )
+            # タイピング状態を登録（間隔ごとにまとめて配信）
+            room_events.user_typing(room, self.get_user_data())
         elif message_type == 'read':
-            # 既読の更新
-            await self.update_read_status()
-            
+            # 既読の更新（ウォーターマークが前進した場合のみ通知）
+            if not await self.update_read_status(circle_id):
+                return
+
             await self.channel_layer.group_send(
-                self.room_group_name,
+                room,
                 {
                     'type': 'message_read',
-                    'user': {
-                        'id': str(self.user.id),
-                        'username': self.user.username,
-                        'display_name': self.user.display_name,
-                    }
+                    'room': room,
+                    'text': encode_frame({
+                        'type': 'read',
+                        'user': self.get_user_data(),
+                    }),
                 }
             )
 
+    def get_user_data(self):
+        """通知用のユーザー情報"""
+        return {
+            'id': str(self.user.id),
+            'username': self.user.username,
+            'display_name': self.user.display_name,
+        }
+
+    def frame_context(self, room):
+        """フレームに付与する項目"""
+        return {}
+
+    async def send_frame(self, room, text):
+        """
+        シリアライズ済みフレームをクライアントに送信
+
+        コンパクト形式では同じワーカーの受信者で復元結果を共有し、JSONの復元をイベントごとに1回にする
+        """
+        context = self.frame_context(room)
+        if self.compact is not None:
+            for data in self.compact.encode({**decode_broadcast_frame(text), **context}):
+                await self.send(bytes_data=data)
+        elif context:
+            # 再シリアライズせずに付与する項目を連結する
+            await self.send(text_data=f'{encode_frame(context)[:-1]},{text[1:]}')
+        else:
+            await self.send(text_data=text)
+
+    async def send_direct(self, frame):
+        """このクライアントのみにフレームを送信"""
+        if self.compact is not None:
+            for data in self.compact.encode(frame):
+                await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=encode_frame(frame))
+
+    async def send_backpressure(self, room, error, retry_after):
+        """送信を受け付けなかったことをクライアントに通知"""
+        await self.send_direct({
+            'type': 'error',
+            'error': error,
+            'retry_after': round(retry_after, 3),
+            **self.frame_context(room),
+        })
+
     async def chat_message(self, event):
         """メッセージをクライアントに送信"""
-        await self.send(text_data=json.dumps({
-            'type': 'message',
-            'message': event['message']
-        }))
-
-    async def user_typing(self, event):
-        """タイピング状態をクライアントに送信"""
-        await self.send(text_data=json.dumps({
-            'type': 'typing',
-            'user': event['user']
-        }))
+        await self.send_frame(event['room'], event['text'])
+
+    async def typing_batch(self, event):
+        """まとめられたタイピング状態をクライアントに送信"""
+        for frame in event['frames']:
+            await self.send_frame(event['room'], frame)
 
     async def message_read(self, event):
         """既読状態をクライアントに送信"""
-        await self.send(text_data=json.dumps({
-            'type': 'read',
-            'user': event['user']
-        }))
-
-    async def user_online(self, event):
-        """オンライン状態をクライアントに送信"""
-        await self.send(text_data=json.dumps({
-            'type': 'online',
-            'user': event['user']
-        }))
-
-    async def user_offline(self, event):
-        """オフライン状態をクライアントに送信"""
-        await self.send(text_data=json.dumps({
-            'type': 'offline',
-            'user': event['user']
-        }))
-
-    @database_sync_to_async
-    def is_circle_member(self):
-        """サークルのメンバーかどうかを確認"""
-        return CircleMembership.objects.filter(
-            user=self.user,
-            circle_id=self.circle_id,
-            status='active'
-        ).exists()
-
-    @database_sync_to_async
-    def save_message(self, content, reply_to_id=None):
-        """メッセージを保存"""
+        await self.send_frame(event['room'], event['text'])
+
+    async def membership_update(self, event):
+        """メンバーの承認・拒否・削除のまとめをクライアントに送信"""
+        await self.send_frame(event['room'], event['text'])
+
+    async def presence_update(self, event):
+        """オンライン状態の差分をクライアントに送信"""
+        for frame in event['frames']:
+            await self.send_frame(event['room'], frame)
+
+    @chat_db_sync_to_async
+    def save_message(self, circle_id, content, reply_to_id=None):
+        """
+        メッセージを保存
+
+        Returns:
+            tuple: (メッセージ, 返信先のデータ)
+        """
         reply_to = None
         if reply_to_id:
             try:
-                reply_to = CircleChat.objects.get(id=reply_to_id)
+                reply_to = CircleChat.objects.select_related('sender').get(id=reply_to_id)
             except ObjectDoesNotExist:
                 pass
 
-        return CircleChat.objects.create(
-            circle_id=self.circle_id,
-            sender=self.user,
-            content=content,
-            reply_to=reply_to
-        )
-
-    @database_sync_to_async
-    def update_read_status(self):
-        """既読状態を更新"""
-        CircleChatRead.objects.update_or_create(
-            user=self.user,
-            circle_id=self.circle_id,
-            defaults={'last_read': timezone.now()}
-        )
-
-    @database_sync_to_async
+        # 検索インデックスの更新と合わせて1回のコミットにまとめる
+        with transaction.atomic():
+            message = CircleChat.objects.create(
+                circle_id=circle_id,
+                sender=self.user,
+                content=content,
+                reply_to=reply_to
+            )
+        read_watermarks.note_message(circle_id, message.created_at)
+        chat_tail.append(circle_id, message)
+        return message, self.get_reply_to_data(reply_to)
+
+    @chat_db_sync_to_async
+    def update_read_status(self, circle_id):
+        """既読状態を更新（DBへはまとめて反映）"""
+        advanced = read_watermarks.mark_read(self.user.id, circle_id, timezone.now())
+        read_watermarks.flush_if_due()
+        return advanced
+
+    @chat_db_sync_to_async
+    def flush_read_status(self):
+        """保留中の既読状態をDBへ反映"""
+        read_watermarks.flush()
+
     def get_reply_to_data(self, reply_to):
         """返信先メッセージのデータを取得"""
         if not reply_to:
             return None
-            
+
         return {
             'id': str(reply_to.id),
             'content': reply_to.content[:100],
@@ -197,4 +277,128 @@ class CircleChatConsumer(AsyncWebsocketConsumer):
                 'username': reply_to.sender.username,
                 'display_name': reply_to.sender.display_name,
             }
-        } 
\ No newline at end of file
+        }
+
+
+class CircleChatConsumer(BaseChatConsumer):
+    """1サークル1接続のチャット"""
+
+    async def connect(self):
+        self.circle_id = self.scope['url_route']['kwargs']['circle_id']
+        self.room_group_name = room_group_name(self.circle_id)
+        self.user = self.scope['user']
+
+        # メンバーシップの確認
+        if not await self.is_circle_member():
+            await self.close()
+            return
+
+        # グループに参加
+        await self.accept_session()
+        await self.join_room(self.circle_id)
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'room_group_name'):
+            await self.leave_room(self.circle_id)
+
+            # 保留中の既読をDBへ反映
+            await self.flush_read_status()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.handle_frame(self.circle_id, self.parse_frame(text_data, bytes_data))
+
+    @chat_db_sync_to_async
+    def is_circle_member(self):
+        """サークルのメンバーかどうかを確認"""
+        if not self.user.is_authenticated:
+            return False
+        return is_active_member(self.user.id, self.circle_id)
+
+
+class UserChatConsumer(BaseChatConsumer):
+    """
+    ユーザー単位で多重化したチャット
+    1本の接続で参加中の全サークルのルームを購読する
+
+    - 接続時に参加中（active）の全サークルを購読する
+    - {"type": "subscribe" | "unsubscribe", "circle": "circle_id"} で購読を変更する
+    - 送受信するフレームには "circle" を付与する
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.subscriptions = set()
+
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        await self.accept_session()
+        for circle_id in sorted(await self.get_circle_ids()):
+            await self.subscribe(circle_id)
+
+    async def disconnect(self, close_code):
+        if not getattr(self, 'subscriptions', None):
+            return
+        for circle_id in list(self.subscriptions):
+            await self.unsubscribe(circle_id)
+
+        # 保留中の既読をDBへ反映
+        await self.flush_read_status()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.parse_frame(text_data, bytes_data)
+        circle_id = str(data.get('circle', ''))
+        message_type = data.get('type', 'message')
+
+        if message_type in ('subscribe', 'unsubscribe') and self.rate_limit is not None:
+            # 購読の変更も接続単位のレート制限の対象にする（メンバー確認・グループへの参加の連打を防ぐ）
+            retry_after = self.rate_limit.consume()
+            if retry_after:
+                await self.send_backpressure(room_group_name(circle_id), 'rate_limited', retry_after)
+                return
+
+        if message_type == 'subscribe':
+            if circle_id not in self.subscriptions:
+                if not await self.is_circle_member(circle_id):
+                    await self.send_error(circle_id, 'not_member')
+                    return
+                await self.subscribe(circle_id)
+            await self.send_direct({'type': 'subscribed', 'circle': circle_id})
+        elif message_type == 'unsubscribe':
+            if circle_id in self.subscriptions:
+                await self.unsubscribe(circle_id)
+            await self.send_direct({'type': 'unsubscribed', 'circle': circle_id})
+        elif circle_id in self.subscriptions:
+            await self.handle_frame(circle_id, data)
+        else:
+            await self.send_error(circle_id, 'not_subscribed')
+
+    async def subscribe(self, circle_id):
+        self.subscriptions.add(circle_id)
+        await self.join_room(circle_id)
+
+    async def unsubscribe(self, circle_id):
+        self.subscriptions.discard(circle_id)
+        await self.leave_room(circle_id)
+
+    def frame_context(self, room):
+        """フレームにサークルIDを付与する"""
+        return {'circle': room[len('chat_'):]}
+
+    async def send_error(self, circle_id, error):
+        await self.send_direct({
+            'type': 'error',
+            'circle': circle_id,
+            'error': error,
+        })
+
+    @chat_db_sync_to_async
+    def get_circle_ids(self):
+        """参加中のサークルID集合"""
+        return get_active_circle_ids(self.user.id)
+
+    @chat_db_sync_to_async
+    def is_circle_member(self, circle_id):
+        """サークルのメンバーかどうかを確認"""
+        return is_active_member(self.user.id, circle_id)
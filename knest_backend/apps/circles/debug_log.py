@@ -0,0 +1,56 @@
+"""
+エンドポイント単位のデバッグログ
+リクエストをサンプリングし、選ばれたリクエストについてのみ構造化したデバッグログを出力する
+
+- サンプリング率はエンドポイント名ごとに CIRCLE_DEBUG_LOG_SAMPLE_RATES で設定する（既定は全て無効）
+- 無効・非サンプルのリクエストでは debug_trace() が None を返すだけで、
+  ログ用のクエリやシリアライズは一切行わない
+- ログは 'knest_backend.apps.circles.debug_log' ロガーにJSONで出力する
+"""
+import json
+import logging
+import random
+import uuid
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointTrace:
+    """サンプリングされた1リクエスト分のデバッグログ"""
+    __slots__ = ('endpoint', 'trace_id')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.trace_id = uuid.uuid4().hex[:12]
+
+    def log(self, event, **fields):
+        logger.debug(json.dumps({
+            'endpoint': self.endpoint,
+            'trace': self.trace_id,
+            'event': event,
+            **fields,
+        }, ensure_ascii=False, default=str))
+
+
+def sample_rate(endpoint):
+    """エンドポイントのサンプリング率（0〜1）"""
+    rates = getattr(settings, 'CIRCLE_DEBUG_LOG_SAMPLE_RATES', None) or {}
+    return rates.get(endpoint, 0.0)
+
+
+def debug_trace(endpoint):
+    """
+    リクエストをサンプリングする
+
+    Returns:
+        EndpointTrace: サンプリングされた場合。されなかった場合はNone
+    """
+    rate = sample_rate(endpoint)
+    if rate <= 0 or not logger.isEnabledFor(logging.DEBUG):
+        return None
+    if rate < 1 and random.random() >= rate:
+        return None
+    return EndpointTrace(endpoint)
@@ -1,6 +1,8 @@
 from django_filters import rest_framework as filters
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
 from .models import Circle
-from django.db.models import Count
+from .circle_search import rank_circles, ranked_matches
 from knest_backend.apps.interests.models import InterestTag
 
 class CircleFilter(filters.FilterSet):
@@ -14,10 +16,7 @@ class CircleFilter(filters.FilterSet):
         to_field_name='id',
         queryset=InterestTag.objects.all()
     )
-    member_count = filters.RangeFilter(
-        field_name='memberships',
-        method='filter_member_count'
-    )
+    member_count = filters.RangeFilter()
     created_at = filters.DateTimeFromToRangeFilter()
     last_activity_at = filters.DateTimeFromToRangeFilter()
 
@@ -28,20 +27,25 @@ class CircleFilter(filters.FilterSet):
             'interests', 'member_count', 'created_at', 'last_activity_at'
         ]
 
-    def filter_member_count(self, queryset, name, value):
-        """メンバー数でフィルタリング"""
-        if value.start is not None:
-            queryset = queryset.filter(
-                memberships__status='active'
-            ).annotate(
-                active_members=Count('memberships')
-            ).filter(active_members__gte=value.start)
 
-        if value.stop is not None:
-            queryset = queryset.filter(
-                memberships__status='active'
-            ).annotate(
-                active_members=Count('memberships')
-            ).filter(active_members__lte=value.stop)
+class CircleSearchFilter(BaseFilterBackend):
+    """
+    サークル検索インデックスによるキーワード検索（?search=）
+
+    ordering の指定がない場合は関連度順に並べる（OrderingFilterの後に適用すること）
+    照合する候補の上限で結果を打ち切った場合は view.search_truncated をTrueにする
+    """
+    search_param = api_settings.SEARCH_PARAM
 
-        return queryset 
\ No newline at end of file
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        ranks = ranked_matches(query)
+        if ranks is None:
+            return queryset
+        view.search_truncated = ranks.truncated
+        queryset = rank_circles(queryset, ranks)
+        if api_settings.ORDERING_PARAM not in request.query_params:
+            queryset = queryset.order_by('-search_rank', *queryset.query.order_by)
+        return queryset
@@ -0,0 +1,407 @@
+"""
+インデックスの監査
+テスト・ベンチマークの実行中に発行されたSELECTを記録し、実行計画からインデックスで賄えていない検索・並べ替えを報告する
+
+- 記録はDB接続のexecute_wrapperで行い、実行中に作られた別スレッドの接続にも取り付ける
+  実行計画はクエリの直後（同じデータがある状態）に取得し、同じSQLは最初の1回のみ取得する
+  取得にはDjangoのクエリログを経由しないカーソルを使い、テストのクエリ数の検証に影響しない
+- 対象はこのプロジェクトのモデルのテーブルのみ（Djangoの組み込みアプリのテーブルは除く）
+- SQLiteは EXPLAIN QUERY PLAN、PostgreSQLは EXPLAIN の結果から次を検出する
+  - scan: インデックスを使わない全件走査（SCAN / Seq Scan）
+  - sort: インデックスを使わない並べ替え（USE TEMP B-TREE FOR ORDER BY / Sort）
+  - partial: インデックスが等価条件の一部の列しか使っていない（SQLiteのみ）
+- 検出したテーブルについて、WHERE句の等価条件の列→範囲条件・並べ替えの列の順で複合インデックスの候補を作り、
+  モデルに宣言されたインデックスで賄えない場合に不足（missing）として報告する
+  OR でつないだ条件はインデックスで絞り込めないため候補に含めない
+- PostgreSQLは行数の少ないテーブルでは常に全件走査を選ぶため、件数のあるDBでベンチマークを実行して監査する
+"""
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+PLAN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+    'postgresql': 'EXPLAIN ',
+}
+
+_SQLITE_SCAN = re.compile(r'^SCAN (?P<alias>\w+)$')
+_SQLITE_SEARCH = re.compile(r'^SEARCH (?P<alias>\w+) USING (?P<index>.*?) ?\((?P<used>[^)]*)\)$')
+_SQLITE_SORT = re.compile(r'^USE TEMP B-TREE FOR (?:RIGHT PART OF |LAST \d+ TERMS OF )?ORDER BY')
+_POSTGRES_SCAN = re.compile(r'Seq Scan on (?P<table>\w+)(?: (?P<alias>\w+))?')
+_POSTGRES_SORT = re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort\b')
+
+_SQLITE_LOOP = re.compile(r'^(?:SCAN|SEARCH) (?P<alias>\w+)')
+_TABLE_REF = re.compile(r'(?:FROM|JOIN) "(?P<table>\w+)"(?: (?P<alias>[A-Z]\d+))?')
+_COLUMN = r'(?:{qualifier})\."(?P<column>\w+)"'
+_ORDER_BY = re.compile(r' ORDER BY (?P<terms>.+?)(?: LIMIT | OFFSET |$)')
+_SUBQUERY = re.compile(r'\(\s*SELECT\b')
+_GROUP = re.compile(r'(?P<negated>NOT )?\((?P<inner>[^()]*)\)')
+
+
+def project_tables():
+    """監査の対象にするテーブル名とモデル（自動作成の中間テーブルを含む）"""
+    package = __name__.split('.')[0]
+    return {
+        model._meta.db_table: model
+        for app_config in apps.get_app_configs()
+        if app_config.name.startswith(f'{package}.')
+        for model in app_config.get_models(include_auto_created=True)
+    }
+
+
+def declared_indexes(model):
+    """
+    モデルに宣言されたインデックスの列
+
+    Returns:
+        list: [(列名のタプル, ユニークか), ...]
+    """
+    opts = model._meta
+
+    def columns(field_names):
+        return tuple(opts.get_field(name).column for name in field_names)
+
+    indexes = []
+    for field in opts.local_fields:
+        if field.primary_key or field.unique:
+            indexes.append(((field.column,), True))
+        elif field.db_index:
+            indexes.append(((field.column,), False))
+    for fields in opts.unique_together:
+        indexes.append((columns(fields), True))
+    for constraint in opts.constraints:
+        if getattr(constraint, 'fields', None) and getattr(constraint, 'condition', None) is None:
+            indexes.append((columns(constraint.fields), True))
+    for index in opts.indexes:
+        if index.fields:
+            indexes.append((columns(name.lstrip('-') for name in index.fields), False))
+    return indexes
+
+
+def is_covered(candidate, equality, indexes):
+    """
+    候補の列をインデックスで賄えるか
+
+    既存のインデックスの先頭が候補と一致する（等価条件の列どうしは順不同）か、
+    ユニークなインデックスの列がすべて等価条件に含まれる（1行に絞り込める）場合に賄えるとする
+    """
+    equality = set(equality)
+    for columns, unique in indexes:
+        if unique and set(columns) <= equality:
+            return True
+        if len(columns) < len(candidate):
+            continue
+        head = len(equality)
+        if set(columns[:head]) == set(candidate[:head]) and columns[head:len(candidate)] == candidate[head:]:
+            return True
+    return False
+
+
+def split_scopes(sql):
+    """
+    SQLを入れ子のSELECTごとに分ける（各部分の内側のSELECTは「(…)」に置き換える）
+
+    Djangoはサブクエリごとに同じ別名（U0など）を使い直すため、別名と条件はSELECTごとに対応付ける
+
+    Returns:
+        list: [{'sql': SELECTのSQL, 'aliases': {別名: テーブル名}}, ...]（先頭が最も外側のクエリ）
+    """
+    done = []
+    stack = [[[], 0]]
+    for position, char in enumerate(sql):
+        scope = stack[-1]
+        if char == '(' and _SUBQUERY.match(sql, position):
+            scope[0].append('(…)')
+            stack.append([[], 0])
+        elif char == '(':
+            scope[0].append(char)
+            scope[1] += 1
+        elif char == ')' and scope[1] == 0 and len(stack) > 1:
+            done.append(''.join(stack.pop()[0]))
+        else:
+            if char == ')':
+                scope[1] -= 1
+            scope[0].append(char)
+    scopes = []
+    for text in [''.join(stack[0][0])] + done:
+        aliases = {}
+        for match in _TABLE_REF.finditer(text):
+            aliases[match.group('alias') or match.group('table')] = match.group('table')
+        scopes.append({'sql': text, 'aliases': aliases})
+    return scopes
+
+
+def _qualifier(alias, table):
+    return re.escape(alias) if alias != table else re.escape(f'"{table}"')
+
+
+def _flatten(sql):
+    """
+    括弧を「⟨⟩」に置き換え、ORでつないだ条件・NOTの条件は括弧ごと除く
+
+    残るのはANDでつないだ（インデックスで絞り込みに使える）条件と、括弧の外のORDER BYのみになる
+    """
+    def collapse(match):
+        if match.group('negated') or re.search(r'\bOR\b', match.group('inner')):
+            return ''
+        return f"⟨{match.group('inner')}⟩"
+
+    count = 1
+    while count:
+        sql, count = _GROUP.subn(collapse, sql)
+    return sql
+
+
+def _order_terms(sql):
+    """括弧の外のORDER BYの並べ替えの項目（ウィンドウ関数などのORDER BYは含めない）"""
+    sql, count = _flatten(sql), 1
+    while count:
+        sql, count = re.subn(r'⟨[^⟨⟩]*⟩', '', sql)
+    match = _ORDER_BY.search(sql)
+    return match.group('terms') if match else ''
+
+
+def _sort_alias(scope):
+    """ORDER BYの先頭の列の別名"""
+    match = re.match(r'\s*(?P<qualifier>"\w+"|\w+)\.', _order_terms(scope['sql']))
+    if match is None:
+        return None
+    qualifier = match.group('qualifier').strip('"')
+    return qualifier if qualifier in scope['aliases'] else None
+
+
+def candidate_columns(sql, alias, table, sort=False):
+    """
+    1つのSELECTでのテーブルへの検索を賄う複合インデックスの候補
+
+    Returns:
+        tuple: (候補の列のタプル, 等価条件の列のタプル)
+    """
+    head = sql.split(' ORDER BY ')[0]
+    where = _flatten(head[head.index(' WHERE '):]) if ' WHERE ' in head else ''
+    column = _COLUMN.format(qualifier=_qualifier(alias, table))
+    equality = list(dict.fromkeys(
+        match.group('column') for match in re.finditer(column + r' (?:= %s|= ⟨|IN ⟨)', where)
+    ))
+    ranges = [match.group('column') for match in re.finditer(column + r' (?:[<>]=? |BETWEEN )', where)]
+    # 複数の値のINで絞り込んだ行は、インデックスの順に読んでも値をまたいで並べ替えが必要になる
+    sortable = sort and not re.search(column + r' IN ⟨%s, ', where)
+    trailing = [match.group('column') for match in re.finditer(column, _order_terms(sql))] if sortable else []
+    if not trailing and ranges:
+        trailing = ranges[:1]
+    rest = [name for name in dict.fromkeys(trailing) if name not in equality]
+    return tuple(equality + rest), tuple(equality)
+
+
+class IndexAudit:
+    """記録したクエリと実行計画・検出結果"""
+
+    def __init__(self, tables=None):
+        self.tables = project_tables() if tables is None else tables
+        self.queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.record(context['connection'], sql, params)
+        return result
+
+    def record(self, connection, sql, params):
+        with self._lock:
+            entry = self.queries.get(sql)
+            if entry is not None:
+                entry['count'] += 1
+                return
+            entry = self.queries[sql] = {'sql': sql, 'count': 1, 'plan': [], 'findings': []}
+        if connection.vendor not in PLAN_PREFIXES:
+            return
+        if not any(f'"{table}"' in sql for table in self.tables):
+            return
+        entry['plan'] = self.explain(connection, sql, params)
+        entry['findings'] = self.findings(connection.vendor, sql, entry['plan'])
+
+    def explain(self, connection, sql, params):
+        """実行計画の各行（クエリログ・execute_wrapperを経由しないカーソルで取得する）"""
+        cursor = connection.create_cursor()
+        try:
+            cursor.execute(PLAN_PREFIXES[connection.vendor] + sql, params)
+            rows = cursor.fetchall()
+        except connection.Database.Error as exc:
+            return [f'EXPLAIN failed: {exc}']
+        finally:
+            cursor.close()
+        if connection.vendor != 'sqlite':
+            return [row[0] for row in rows]
+        # (id, parent, notused, detail) を親子関係に応じて字下げした行にする
+        depths = {}
+        lines = []
+        for node, parent, _notused, detail in rows:
+            depths[node] = depths.get(parent, -1) + 1
+            lines.append('  ' * depths[node] + detail)
+        return lines
+
+    def findings(self, vendor, sql, plan):
+        """
+        実行計画からインデックスで賄えていない検索・並べ替えを検出する
+
+        Returns:
+            list: [{'kind', 'table', 'columns', 'missing', 'detail'}, ...]
+        """
+        scopes = split_scopes(sql)
+        found = []
+
+        def add(kind, scope, alias, detail, used=None):
+            table = scope['aliases'][alias]
+            candidate, equality = candidate_columns(scope['sql'], alias, table, sort=kind == 'sort')
+            if used is not None and set(equality) <= set(used):
+                return
+            missing = bool(candidate) and not is_covered(candidate, equality, declared_indexes(self.tables[table]))
+            found.append({
+                'kind': kind,
+                'table': table,
+                'columns': list(candidate),
+                'missing': missing,
+                'detail': detail.strip(),
+            })
+
+        def add_sort(scope, detail):
+            alias = _sort_alias(scope) if scope is not None else None
+            if alias is not None and scope['aliases'][alias] in self.tables:
+                add('sort', scope, alias, detail)
+
+        for number, line in enumerate(plan):
+            detail = line.strip()
+            if vendor == 'sqlite':
+                scan = _SQLITE_SCAN.match(detail)
+                search = _SQLITE_SEARCH.match(detail)
+                if scan:
+                    scope, alias = self._resolve(scopes, scan.group('alias'))
+                    if scope is not None:
+                        add('scan', scope, alias, line)
+                elif search:
+                    used = re.findall(r'(\w+)[=<>]', search.group('used'))
+                    scope, alias = self._resolve(scopes, search.group('alias'), used)
+                    if scope is None:
+                        continue
+                    if 'AUTOMATIC' in search.group('index'):
+                        # 実行のたびに一時的なインデックスを作っている
+                        add('scan', scope, alias, line)
+                    else:
+                        add('partial', scope, alias, line, used)
+                elif _SQLITE_SORT.match(detail):
+                    add_sort(self._sqlite_sort_scope(scopes, plan, number), line)
+            else:
+                scan = _POSTGRES_SCAN.search(detail)
+                if scan:
+                    scope, alias = self._resolve(scopes, scan.group('alias') or scan.group('table'))
+                    if scope is not None:
+                        add('scan', scope, alias, line)
+                elif _POSTGRES_SORT.match(line):
+                    add_sort(next((scope for scope in scopes if _order_terms(scope['sql'])), None), line)
+
+        # 同じテーブルの走査と並べ替えは、並べ替えの列まで含めた1つのインデックスで賄う
+        for finding in found:
+            finding['missing'] = finding['missing'] and not any(
+                other is not finding and other['missing'] and other['table'] == finding['table']
+                and len(other['columns']) > len(finding['columns'])
+                and other['columns'][:len(finding['columns'])] == finding['columns']
+                for other in found
+            )
+        return found
+
+    def _resolve(self, scopes, alias, used=None):
+        """
+        実行計画の別名に対応するSELECTとSQL中の別名
+
+        同じ別名が複数のSELECTにある場合は、実行計画でインデックスに使った列から最も近いものを選ぶ
+        """
+        matches = [
+            (scope, name)
+            for scope in scopes
+            for name, table in scope['aliases'].items()
+            if name.lower() == alias.lower() and table in self.tables
+        ]
+        if used is not None and len(matches) > 1:
+            def distance(match):
+                scope, name = match
+                table = scope['aliases'][name]
+                columns = {field.column for field in self.tables[table]._meta.concrete_fields}
+                equality = candidate_columns(scope['sql'], name, table)[1]
+                return (not set(used) <= columns, len(set(equality) - set(used)))
+            matches.sort(key=distance)
+        return matches[0] if matches else (None, None)
+
+    def _sqlite_sort_scope(self, scopes, plan, number):
+        """並べ替えの行と同じ階層で直前に走査しているテーブルのSELECT（なければ最も外側のクエリ）"""
+        depth = len(plan[number]) - len(plan[number].lstrip())
+        for line in reversed(plan[:number]):
+            line_depth = len(line) - len(line.lstrip())
+            if line_depth < depth:
+                break
+            match = _SQLITE_LOOP.match(line.strip()) if line_depth == depth else None
+            if match:
+                scope, _alias = self._resolve(scopes, match.group('alias'))
+                if scope is not None:
+                    return scope
+        return scopes[0]
+
+    def missing_indexes(self):
+        """
+        不足しているインデックスの候補をテーブル・列ごとにまとめる
+
+        Returns:
+            list: [{'table', 'columns', 'kinds', 'queries', 'executions', 'example'}, ...]（実行回数の多い順）
+        """
+        summary = OrderedDict()
+        for entry in self.queries.values():
+            for finding in entry['findings']:
+                if not finding['missing']:
+                    continue
+                key = (finding['table'], tuple(finding['columns']))
+                item = summary.setdefault(key, {
+                    'table': finding['table'],
+                    'columns': finding['columns'],
+                    'kinds': [],
+                    'queries': 0,
+                    'executions': 0,
+                    'example': entry['sql'],
+                })
+                if finding['kind'] not in item['kinds']:
+                    item['kinds'].append(finding['kind'])
+                item['queries'] += 1
+                item['executions'] += entry['count']
+        return sorted(summary.values(), key=lambda item: -item['executions'])
+
+
+@contextmanager
+def audit_queries(audit=None):
+    """
+    ブロック内で発行されたSELECTを記録する
+
+    既存の接続と、ブロック内で作られた接続（別スレッドを含む）に取り付ける
+    """
+    audit = audit if audit is not None else IndexAudit()
+    attached = []
+
+    def attach(sender=None, connection=None, **kwargs):
+        if audit not in connection.execute_wrappers:
+            connection.execute_wrappers.append(audit)
+            attached.append(connection)
+
+    for connection in connections.all():
+        attach(connection=connection)
+    connection_created.connect(attach, weak=False)
+    try:
+        yield audit
+    finally:
+        connection_created.disconnect(attach)
+        for connection in attached:
+            if audit in connection.execute_wrappers:
+                connection.execute_wrappers.remove(audit)
@@ -0,0 +1,24 @@
+"""
+古いチャットメッセージをアーカイブへ移す（定期実行を想定）
+
+使用例:
+    python manage.py archive_chats --days 90
+"""
+from django.core.management.base import BaseCommand
+
+from ...chat_archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = '指定日数より古いチャットメッセージをサークル・月ごとの圧縮アーカイブへ移す'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='アーカイブ対象とする経過日数')
+        parser.add_argument('--batch-size', type=int, default=None, help='1トランザクションで移すメッセージ数')
+
+    def handle(self, *args, **options):
+        archived = archive_messages(
+            older_than_days=options['days'],
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(f'アーカイブしたメッセージ: {archived}件')
@@ -0,0 +1,91 @@
+"""
+テスト・ベンチマークの実行中に発行されたクエリの実行計画を調べ、不足しているインデックスを報告する
+
+テストのラベルを指定するとテストを実行し、--run を指定すると管理コマンド（ベンチマークなど）を
+設定中のDBに対して実行して、その間のSELECTを監査する（index_audit.py）
+
+使用例:
+    python manage.py audit_indexes knest_backend.apps.circles knest_backend.apps.users
+    python manage.py audit_indexes --run "chat_loadtest --connections 200 --circles 10"
+    python manage.py audit_indexes knest_backend.apps.circles --plans --output audit.json
+    python manage.py audit_indexes knest_backend.apps.circles --check
+"""
+import json
+import shlex
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import get_runner
+
+from ...index_audit import audit_queries
+
+
+class Command(BaseCommand):
+    help = 'テスト・ベンチマークのクエリの実行計画から不足しているインデックスを報告する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('test_labels', nargs='*', help='実行するテストのラベル')
+        parser.add_argument('--run', action='append', default=[],
+                            help='監査しながら実行する管理コマンド（引数を含めて1つの文字列で指定、複数可）')
+        parser.add_argument('--plans', action='store_true',
+                            help='インデックスで賄えていない検索・並べ替えを含むクエリの実行計画も表示する')
+        parser.add_argument('--output', help='結果をJSONで保存するファイル')
+        parser.add_argument('--check', action='store_true',
+                            help='不足しているインデックスがある場合に失敗する')
+
+    def handle(self, *args, **options):
+        if not options['test_labels'] and not options['run']:
+            raise CommandError('テストのラベルか --run を指定してください')
+
+        with audit_queries() as audit:
+            if options['test_labels']:
+                runner = get_runner(settings)(verbosity=0, interactive=False)
+                failures = runner.run_tests(options['test_labels'])
+                if failures:
+                    self.stderr.write(f'テストの失敗: {failures}件（監査は続行）')
+            for command in options['run']:
+                name, *command_args = shlex.split(command)
+                call_command(name, *command_args, stdout=self.stdout, stderr=self.stderr)
+
+        missing = audit.missing_indexes()
+        audited = [entry for entry in audit.queries.values() if entry['plan']]
+        self.stdout.write(
+            f'記録したクエリ: {len(audit.queries)}種類（実行計画を取得: {len(audited)}種類）'
+        )
+        if options['plans']:
+            self._write_plans(audited)
+        self._write_missing(missing)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'missing': missing, 'queries': audited}, f, ensure_ascii=False, indent=2)
+        if options['check'] and missing:
+            raise CommandError(f'不足しているインデックス: {len(missing)}件')
+
+    def _write_plans(self, entries):
+        for entry in entries:
+            if not entry['findings']:
+                continue
+            self.stdout.write('')
+            self.stdout.write(f"[{entry['count']}回] {entry['sql']}")
+            for line in entry['plan']:
+                self.stdout.write(f'    {line}')
+            for finding in entry['findings']:
+                state = '不足' if finding['missing'] else '既存で賄える' if finding['columns'] else '候補なし'
+                self.stdout.write(
+                    f"  -> {finding['kind']} {finding['table']} ({', '.join(finding['columns'])}) {state}"
+                )
+
+    def _write_missing(self, missing):
+        self.stdout.write('')
+        if not missing:
+            self.stdout.write(self.style.SUCCESS('不足しているインデックスはありません'))
+            return
+        self.stdout.write(self.style.WARNING(f'不足しているインデックスの候補: {len(missing)}件'))
+        for item in missing:
+            self.stdout.write(
+                f"  {item['table']} ({', '.join(item['columns'])}): "
+                f"{'/'.join(item['kinds'])} クエリ{item['queries']}種類・{item['executions']}回"
+            )
+            self.stdout.write(f"      例: {item['example'][:200]}")
@@ -0,0 +1,319 @@
+"""
+チャットWebSocketの負荷試験
+N本のCircleChatConsumer接続を複数サークルに分散して同時に張り、
+メッセージ/秒・配信遅延・DB書き込み/秒・接続あたりのメモリを計測する
+
+同じ条件で --repeat 回実行して中央値を報告する。--output で結果をJSONに保存し、
+--baseline で以前の結果と比較できる
+
+既定ではテスト用のDB（テストランナーと同じく作成・破棄する）とインメモリのチャネルレイヤーで実行する。
+設定中のDB・チャネルレイヤー（Redisなど）で計測する場合は --use-configured-db を指定する
+
+使用例:
+    python manage.py chat_loadtest --connections 2000 --circles 20 --senders 100 --messages 10
+    python manage.py chat_loadtest --repeat 3 --output before.json
+    python manage.py chat_loadtest --repeat 3 --baseline before.json
+    python manage.py chat_loadtest --use-configured-db --connections 500
+"""
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections as databases
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+from django.utils import timezone
+
+from ...models import Circle, CircleChat, CircleMembership
+from ...routing import websocket_urlpatterns
+
+
+User = get_user_model()
+
+
+# 比較する指標（名前, ラベル, 大きい方が良いか）
+METRICS = [
+    ('messages_per_sec', '送信メッセージ/秒', True),
+    ('frames_per_sec', '配信フレーム/秒', True),
+    ('db_writes_per_sec', 'DB書き込み/秒', True),
+    ('latency_p50_ms', '配信遅延p50(ms)', False),
+    ('latency_p95_ms', '配信遅延p95(ms)', False),
+    ('latency_p99_ms', '配信遅延p99(ms)', False),
+    ('memory_per_connection_kb', '接続あたりメモリ(KB)', False),
+]
+
+
+def percentile(values, ratio):
+    """ソート済みリストのパーセンタイル値"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(ratio * (len(values) - 1))))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = 'チャットWebSocketの負荷試験（メッセージ/秒・配信遅延・DB書き込み・メモリ）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=100, help='同時接続数')
+        parser.add_argument('--circles', type=int, default=1, help='接続を分散するサークル数')
+        parser.add_argument('--senders', type=int, default=10, help='送信する接続数')
+        parser.add_argument('--messages', type=int, default=10, help='送信者ごとのメッセージ数')
+        parser.add_argument('--timeout', type=float, default=30.0, help='受信待ちのタイムアウト（秒）')
+        parser.add_argument('--repeat', type=int, default=1, help='実行回数（中央値を報告）')
+        parser.add_argument('--output', help='結果を保存するJSONファイル')
+        parser.add_argument('--baseline', help='比較する以前の結果（JSONファイル）')
+        parser.add_argument(
+            '--rate-limit',
+            action='store_true',
+            help='送信のレート制限を有効にしたまま計測する（既定では無効化して処理性能を計測）'
+        )
+        parser.add_argument(
+            '--use-configured-db',
+            action='store_true',
+            help='テスト用のDB・インメモリのチャネルレイヤーではなく、設定中のDB・チャネルレイヤーで実行する'
+        )
+
+    def handle(self, *args, **options):
+        if options['use_configured_db']:
+            self.stdout.write(self.style.WARNING('設定中のDB・チャネルレイヤーで実行します'))
+            self._handle(options)
+            return
+
+        with tempfile.TemporaryDirectory() as directory:
+            self._handle_isolated(options, directory)
+
+    def _handle_isolated(self, options, directory):
+        """テスト用のDBとインメモリのチャネルレイヤーで実行する"""
+        # SQLiteのインメモリのテストDBは複数スレッドからの同時書き込みでロックされるため、一時ファイルに作成する
+        test_names = {}
+        for alias in databases:
+            settings_dict = databases[alias].settings_dict
+            if databases[alias].vendor == 'sqlite' and not settings_dict['TEST'].get('NAME'):
+                test_names[alias] = settings_dict['TEST'].get('NAME')
+                settings_dict['TEST']['NAME'] = os.path.join(directory, f'{alias}.sqlite3')
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            # 各接続のチャネルには同じサークルのすべてのメッセージが届くため、取りこぼさない容量にする
+            capacity = max(1000, options['senders'] * options['messages'])
+            with override_settings(CHANNEL_LAYERS={
+                'default': {
+                    'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                    'CONFIG': {'capacity': capacity},
+                },
+            }):
+                self._handle(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+            for alias, name in test_names.items():
+                databases[alias].settings_dict['TEST']['NAME'] = name
+
+    def _handle(self, options):
+        connections = options['connections']
+        circle_count = max(1, min(options['circles'], connections))
+        senders = min(options['senders'], connections)
+
+        runs = []
+        for i in range(options['repeat']):
+            circles, users = self._create_fixtures(connections, circle_count)
+            try:
+                with override_settings(CHAT_RATE_LIMIT_ENABLED=options['rate_limit']):
+                    result = async_to_sync(self._run)(
+                        circles, users, senders, options['messages'], options['timeout']
+                    )
+                result['db_writes'] = CircleChat.objects.filter(circle__in=circles).count()
+            finally:
+                self._delete_fixtures(circles, users)
+            metrics = self._metrics(connections, senders, options['messages'], result)
+            runs.append(metrics)
+            if options['repeat'] > 1:
+                self.stdout.write(f'--- {i + 1}/{options["repeat"]} 回目')
+            self._report(connections, circle_count, senders, options['messages'], result, metrics)
+
+        summary = {
+            'config': {
+                'connections': connections,
+                'circles': circle_count,
+                'senders': senders,
+                'messages': options['messages'],
+                'repeat': options['repeat'],
+            },
+            'metrics': {
+                name: statistics.median(run[name] for run in runs)
+                for name, _, _ in METRICS
+            },
+            'runs': runs,
+        }
+        if options['repeat'] > 1:
+            self.stdout.write('--- 中央値')
+            self._report_metrics(summary['metrics'])
+
+        if options['baseline']:
+            self._compare(summary, options['baseline'])
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'結果を保存しました: {options["output"]}')
+
+    def _create_fixtures(self, connections, circle_count):
+        """負荷試験用のユーザーとサークルを作成（接続をサークルに均等に割り当てる）"""
+        run_id = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create([
+            User(username=f'loadtest_{run_id}_{i}', display_name=f'loadtest {i}')
+            for i in range(connections)
+        ])
+        circles = [
+            Circle.objects.create(
+                name=f'loadtest {run_id} {i}',
+                creator=users[i],
+                owner=users[i],
+                member_limit=connections
+            )
+            for i in range(circle_count)
+        ]
+        CircleMembership.objects.bulk_create([
+            CircleMembership(
+                user=user,
+                circle=circles[i % circle_count],
+                status='active',
+                joined_at=timezone.now()
+            )
+            for i, user in enumerate(users)
+        ])
+        return circles, users
+
+    def _delete_fixtures(self, circles, users):
+        Circle.objects.filter(id__in=[circle.id for circle in circles]).delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    async def _run(self, circles, users, senders, messages, timeout):
+        application = URLRouter(websocket_urlpatterns)
+        communicators = []
+        for i, user in enumerate(users):
+            circle = circles[i % len(circles)]
+            communicator = WebsocketCommunicator(application, f'/ws/circle/{circle.id}/chat/')
+            communicator.scope['user'] = user
+            communicators.append(communicator)
+
+        # 接続確立で増えたメモリを接続数で割って接続あたりのメモリとする
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        connect_started = time.perf_counter()
+        results = await asyncio.gather(*(c.connect() for c in communicators))
+        connect_elapsed = time.perf_counter() - connect_started
+        memory_after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        if not all(connected for connected, _ in results):
+            raise CommandError('接続に失敗したクライアントがあります')
+
+        # 送信者はサークルに分散しているため、受信数はサークルごとに異なる
+        sender_circles = [i % len(circles) for i in range(senders)]
+        expected = {
+            index: sender_circles.count(index) * messages
+            for index in range(len(circles))
+        }
+        latencies = []
+
+        async def receive(communicator, count):
+            received = 0
+            while received < count:
+                frame = json.loads(await communicator.receive_from(timeout=timeout))
+                if frame.get('type') != 'message':
+                    continue
+                sent_at = float(frame['message']['content'].split(':', 1)[1])
+                latencies.append(time.perf_counter() - sent_at)
+                received += 1
+            return received
+
+        async def send(communicator):
+            for _ in range(messages):
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'message',
+                    'content': f'loadtest:{time.perf_counter()!r}',
+                }))
+
+        started = time.perf_counter()
+        receivers = [
+            asyncio.ensure_future(receive(c, expected[i % len(circles)]))
+            for i, c in enumerate(communicators)
+        ]
+        await asyncio.gather(*(send(c) for c in communicators[:senders]))
+        delivered = sum(await asyncio.gather(*receivers))
+        elapsed = time.perf_counter() - started
+
+        await asyncio.gather(*(c.disconnect() for c in communicators))
+
+        return {
+            'connect_elapsed': connect_elapsed,
+            'elapsed': elapsed,
+            'delivered': delivered,
+            'latencies': sorted(latencies),
+            'memory': memory_after - memory_before,
+        }
+
+    def _metrics(self, connections, senders, messages, result):
+        latencies = result['latencies']
+        elapsed = result['elapsed']
+        return {
+            'messages_per_sec': senders * messages / elapsed,
+            'frames_per_sec': result['delivered'] / elapsed,
+            'db_writes_per_sec': result['db_writes'] / elapsed,
+            'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+            'latency_p95_ms': percentile(latencies, 0.95) * 1000,
+            'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+            'memory_per_connection_kb': result['memory'] / connections / 1024,
+        }
+
+    def _report(self, connections, circle_count, senders, messages, result, metrics):
+        latencies = result['latencies']
+        self.stdout.write(
+            f'接続数: {connections} / サークル数: {circle_count} '
+            f'(接続所要 {result["connect_elapsed"]:.2f}s)'
+        )
+        self.stdout.write(f'送信: {senders}接続 x {messages}件 = {senders * messages}件')
+        self.stdout.write(f'配信: {result["delivered"]}件 / {result["elapsed"]:.2f}s')
+        self._report_metrics(metrics)
+        if latencies:
+            self.stdout.write(
+                '配信遅延(ms): '
+                f'平均 {statistics.mean(latencies) * 1000:.1f} / '
+                f'最大 {latencies[-1] * 1000:.1f}'
+            )
+
+    def _report_metrics(self, metrics):
+        for name, label, _ in METRICS:
+            self.stdout.write(f'{label}: {metrics[name]:.1f}')
+
+    def _compare(self, summary, path):
+        """以前の結果との比較を表示"""
+        with open(path) as f:
+            baseline = json.load(f)
+        conditions = ('connections', 'circles', 'senders', 'messages')
+        if any(baseline['config'].get(key) != summary['config'][key] for key in conditions):
+            self.stdout.write(self.style.WARNING('比較対象と試験条件が異なります'))
+
+        self.stdout.write(f'--- 比較 ({path})')
+        for name, label, higher_is_better in METRICS:
+            before = baseline['metrics'].get(name)
+            after = summary['metrics'][name]
+            if not before:
+                continue
+            change = (after - before) / before * 100
+            improved = change > 0 if higher_is_better else change < 0
+            style = self.style.SUCCESS if improved else self.style.WARNING
+            self.stdout.write(style(f'{label}: {before:.1f} -> {after:.1f} ({change:+.1f}%)'))
@@ -0,0 +1,25 @@
+"""
+チャット全文検索のインデックスを再構築する（導入時の既存メッセージの取り込みなど）
+
+使用例:
+    python manage.py rebuild_chat_search_index
+    python manage.py rebuild_chat_search_index --circle <circle_id>
+"""
+from django.core.management.base import BaseCommand
+
+from ...chat_search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'チャットメッセージの検索インデックス（bi-gram）を再構築する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--circle', default=None, help='対象サークルID（省略時は全サークル）')
+        parser.add_argument('--batch-size', type=int, default=1000, help='一括登録するトークン数')
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(
+            circle_id=options['circle'],
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(f'インデックスしたメッセージ: {indexed}件')
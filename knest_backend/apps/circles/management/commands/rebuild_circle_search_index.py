@@ -0,0 +1,20 @@
+"""
+サークル検索のインデックスを再構築する（導入時の既存サークルの取り込みなど）
+
+使用例:
+    python manage.py rebuild_circle_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from ...circle_search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'サークルの検索インデックス（bi-gram）を再構築する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='一括登録するトークン数')
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(f'インデックスしたサークル: {indexed}件')
@@ -0,0 +1,17 @@
+"""
+サークルのメンバー数を参加中のメンバーシップ数に合わせる（定期実行用）
+
+使用例:
+    python manage.py reconcile_member_counts
+"""
+from django.core.management.base import BaseCommand
+
+from ...member_counts import reconcile_member_counts
+
+
+class Command(BaseCommand):
+    help = 'サークルのメンバー数（member_count）を参加中のメンバーシップ数に合わせる'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_member_counts()
+        self.stdout.write(f'修正したサークル: {fixed}件')
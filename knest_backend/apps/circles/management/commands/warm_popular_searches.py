@@ -0,0 +1,26 @@
+"""
+人気の検索クエリを集計し直し、検索結果の1ページ目をキャッシュに載せる（定期実行用）
+
+使用例:
+    python manage.py warm_popular_searches
+"""
+from django.core.management.base import BaseCommand
+from rest_framework.settings import api_settings
+
+from ...search_cache import popular_searches
+
+
+class Command(BaseCommand):
+    help = '人気の検索クエリの検索結果1ページ目をキャッシュに載せる'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=api_settings.PAGE_SIZE,
+            help='1ページの件数（サークル一覧APIのページサイズ）'
+        )
+
+    def handle(self, *args, **options):
+        warmed = popular_searches.warm(options['page_size'])
+        self.stdout.write(f'キャッシュしたクエリ: {warmed}件')
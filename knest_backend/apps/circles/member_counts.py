@@ -0,0 +1,88 @@
+"""
+サークルのメンバー数（Circle.member_count）の維持
+参加中（active）のメンバーシップ数を非正規化して保持し、一覧・絞り込み・並べ替えでは集計せずにこの値を参照する
+
+- メンバーシップの作成・状態の変更・削除のたびに、シグナルからF式の加減算で更新する
+  読み込んだ値を書き戻さないため、同時の参加・退会でも更新が失われない
+- QuerySet.update() / bulk_update() などシグナルを経由しない変更では adjust_member_count() を直接呼ぶ
+- まとめて削除する場合などは batched_member_counts() の中で行い、サークルごとに1回の更新にまとめる
+- ずれが生じた場合は reconcile_member_counts()（manage.py reconcile_member_counts）で実数に合わせる
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Circle, CircleMembership
+
+
+_batch = threading.local()
+
+
+def member_count_delta(previous_status, status):
+    """メンバーシップの状態の変化によるメンバー数の増減"""
+    return int(status == 'active') - int(previous_status == 'active')
+
+
+def adjust_member_count(circle_id, delta):
+    """
+    サークルのメンバー数を増減する
+
+    更新日時も更新し、オートコンプリートの差分取り込みの対象にする
+    """
+    if not delta:
+        return
+    deltas = getattr(_batch, 'deltas', None)
+    if deltas is not None:
+        deltas[circle_id] += delta
+        return
+    Circle.objects.filter(pk=circle_id).update(
+        member_count=Greatest(F('member_count') + delta, Value(0)),
+        updated_at=timezone.now()
+    )
+
+
+@contextmanager
+def batched_member_counts():
+    """
+    ブロック内でのメンバー数の増減をサークルごとに合算し、ブロックの終了時に1回ずつ反映する
+
+    例外で抜けた場合は反映しない（トランザクションの中で使う）
+    """
+    outer = getattr(_batch, 'deltas', None)
+    deltas = _batch.deltas = Counter()
+    try:
+        yield
+    finally:
+        _batch.deltas = outer
+    for circle_id, delta in deltas.items():
+        adjust_member_count(circle_id, delta)
+
+
+def reconcile_member_counts():
+    """
+    保持しているメンバー数を参加中のメンバーシップ数に合わせる
+
+    集計時点の値から変わっていないサークルのみ書き込み、集計中の参加・退会による増減を上書きしない
+
+    Returns:
+        int: 修正したサークル数
+    """
+    active_members = CircleMembership.objects.filter(
+        circle=OuterRef('pk'),
+        status='active'
+    ).order_by().values('circle').annotate(count=Count('pk')).values('count')
+    drifted = Circle.objects.order_by().annotate(
+        actual=Coalesce(Subquery(active_members, output_field=IntegerField()), Value(0))
+    ).exclude(member_count=F('actual')).values_list('id', 'member_count', 'actual')
+
+    fixed = 0
+    for circle_id, member_count, actual in list(drifted):
+        fixed += Circle.objects.filter(pk=circle_id, member_count=member_count).update(
+            member_count=actual,
+            updated_at=timezone.now()
+        )
+    return fixed
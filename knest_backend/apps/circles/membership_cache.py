@@ -0,0 +1,41 @@
+"""
+サークルメンバーシップのキャッシュ
+ユーザーごとの参加中サークルID集合をキャッシュし、認可チェックでのDB問い合わせを省く
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import CircleMembership
+
+
+def _cache_key(user_id):
+    return f'circle_memberships_{user_id}'
+
+
+def get_active_circle_ids(user_id):
+    """ユーザーが参加中（active）のサークルID集合を返す"""
+    key = _cache_key(user_id)
+    circle_ids = cache.get(key)
+    if circle_ids is None:
+        circle_ids = frozenset(
+            str(circle_id) for circle_id in CircleMembership.objects.filter(
+                user_id=user_id,
+                status='active'
+            ).order_by().values_list('circle_id', flat=True)
+        )
+        cache.set(
+            key,
+            circle_ids,
+            timeout=getattr(settings, 'CIRCLE_MEMBERSHIP_CACHE_TIMEOUT', 600)
+        )
+    return circle_ids
+
+
+def is_active_member(user_id, circle_id):
+    """ユーザーがサークルに参加中かどうか"""
+    return str(circle_id) in get_active_circle_ids(user_id)
+
+
+def invalidate_memberships(*user_ids):
+    """ユーザーのメンバーシップキャッシュを破棄する"""
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
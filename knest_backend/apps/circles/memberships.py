@@ -0,0 +1,281 @@
+"""
+サークルへの参加処理
+定員（member_limit）とユーザーの参加可能サークル数の判定・登録を1つのトランザクションで行い、
+同時の参加でも上限を超えないようにする
+
+- 最初にサークルの行を条件付きUPDATE（募集中かつ定員未満）で書き込み、同じサークルへの参加を直列化する
+  PostgreSQLでは行ロック、SQLiteではDB全体の書き込みロックになる
+  （先に書き込むことで、SQLiteで読み取りロックからの昇格によるロック競合を起こさない）
+- 続いてユーザーの行をロックし、同じユーザーによる別のサークルへの同時参加を直列化する
+- メンバー数の加算はメンバーシップの保存時のシグナルで行う（member_counts.py）
+  ロックを保持したまま加算するため、待っていた参加は加算後のメンバー数で定員を判定する
+- 発行するクエリ数はメンバー数・参加中のサークル数によらず一定（参加時はロック2・判定1・登録1・加算1）
+
+管理者による一括の承認・拒否・削除（approve_requests / reject_requests / remove_members）も同じ順序でロックし、
+メンバーシップはbulk_update・一括削除で更新、メンバー数は1回の加減算で反映する。
+変更はコミット後にサークルのチャットルームへ1つのフレームでまとめて通知する
+"""
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .consumers import room_group_name
+from .member_counts import adjust_member_count, batched_member_counts
+from .membership_cache import invalidate_memberships
+from .models import Circle, CircleMembership
+from .realtime import encode_frame
+
+
+# member_limitが未設定のサークルの定員
+DEFAULT_MEMBER_LIMIT = 10
+
+
+class JoinError(Exception):
+    """サークルに参加できない理由（メッセージはそのままレスポンスに使う）"""
+
+
+def member_limit_of(circle):
+    return circle.member_limit if circle.member_limit else DEFAULT_MEMBER_LIMIT
+
+
+def max_circles_for(is_premium):
+    """ユーザーが参加できるサークル数"""
+    return 4 if is_premium else 2
+
+
+def join_circle(user, circle, application_message=''):
+    """
+    サークルに参加する（公開サークルは即時参加、承認制サークルは参加申請）
+
+    拒否された申請がある場合は、その申請を出し直す
+
+    Returns:
+        CircleMembership: 作成・更新したメンバーシップ
+
+    Raises:
+        JoinError: 募集停止・参加済み・申請中・定員・参加数の上限・招待制の場合
+    """
+    with transaction.atomic():
+        locked = Circle.objects.filter(
+            pk=circle.pk,
+            status='open',
+            member_count__lt=member_limit_of(circle)
+        ).update(updated_at=timezone.now())
+        is_premium = get_user_model().objects.select_for_update().filter(
+            pk=user.pk
+        ).values_list('is_premium', flat=True).get()
+        memberships = {
+            circle_id: (membership_id, status)
+            for membership_id, circle_id, status in CircleMembership.objects.filter(
+                Q(circle=circle) | Q(status='active'),
+                user=user
+            ).order_by().values_list('id', 'circle_id', 'status')
+        }
+        existing = memberships.get(circle.pk)
+
+        if not locked:
+            circle_status = Circle.objects.values_list('status', flat=True).get(pk=circle.pk)
+            if circle_status != 'open':
+                raise JoinError(_('現在このサークルは参加を受け付けていません。'))
+        if existing and existing[1] == 'active':
+            raise JoinError(_('既にサークルに参加しています。'))
+        if existing and existing[1] == 'pending':
+            raise JoinError(_('既に参加申請中です。'))
+        if not locked:
+            raise JoinError(_('サークルのメンバー数が上限に達しています。'))
+        active_circles = sum(1 for _membership_id, status in memberships.values() if status == 'active')
+        if active_circles >= max_circles_for(is_premium):
+            raise JoinError(_('参加可能なサークル数の上限に達しています。'))
+        if circle.circle_type not in ('public', 'approval'):
+            raise JoinError(_('このサークルは招待制です。'))
+
+        if existing:
+            # 拒否された申請の出し直し（状態の変化はシグナルでメンバー数に反映される）
+            membership = CircleMembership.objects.get(pk=existing[0])
+            membership.rejection_reason = ''
+        else:
+            membership = CircleMembership(user=user, circle=circle)
+        membership.application_message = application_message
+        if circle.circle_type == 'public':
+            membership.status = 'active'
+            membership.joined_at = timezone.now()
+        else:
+            membership.status = 'pending'
+        membership.save()
+    return membership
+
+
+def _lock_circle(circle_id):
+    """サークルの行に書き込んでロックし、現在のメンバー数を返す"""
+    Circle.objects.filter(pk=circle_id).update(updated_at=timezone.now())
+    return Circle.objects.values_list('member_count', flat=True).get(pk=circle_id)
+
+
+def _unique(membership_ids):
+    return list(dict.fromkeys(membership_ids))
+
+
+def approve_requests(circle, membership_ids):
+    """
+    参加申請をまとめて承認する（指定の順に、定員と各ユーザーの参加可能サークル数の範囲で承認する）
+
+    Returns:
+        tuple: (承認したメンバーシップのリスト, [(メンバーシップID, 承認しなかった理由), ...])
+            理由は 'not_found'（申請中でない）・'full'（定員）・'user_limit'（参加可能サークル数）
+    """
+    membership_ids = _unique(membership_ids)
+    approved, skipped = [], []
+    with transaction.atomic():
+        seats = member_limit_of(circle) - _lock_circle(circle.pk)
+        pending = {
+            membership.pk: membership
+            for membership in CircleMembership.objects.filter(
+                circle=circle,
+                id__in=membership_ids,
+                status='pending'
+            ).select_related('user').order_by()
+        }
+        user_ids = {membership.user_id for membership in pending.values()}
+        is_premium = dict(
+            get_user_model().objects.select_for_update().filter(
+                pk__in=user_ids
+            ).order_by('pk').values_list('pk', 'is_premium')
+        )
+        active_circles = Counter(dict(
+            CircleMembership.objects.filter(
+                user_id__in=user_ids,
+                status='active'
+            ).order_by().values('user_id').annotate(count=Count('pk')).values_list('user_id', 'count')
+        ))
+
+        now = timezone.now()
+        for membership_id in membership_ids:
+            membership = pending.get(membership_id)
+            if membership is None:
+                skipped.append((membership_id, 'not_found'))
+            elif seats <= 0:
+                skipped.append((membership_id, 'full'))
+            elif active_circles[membership.user_id] >= max_circles_for(is_premium[membership.user_id]):
+                skipped.append((membership_id, 'user_limit'))
+            else:
+                membership.status = 'active'
+                membership.joined_at = now
+                approved.append(membership)
+                seats -= 1
+                active_circles[membership.user_id] += 1
+
+        if approved:
+            CircleMembership.objects.bulk_update(approved, ['status', 'joined_at'])
+            adjust_member_count(circle.pk, len(approved))
+            _on_commit(circle.pk, 'approved', approved)
+    return approved, skipped
+
+
+def reject_requests(circle, membership_ids, rejection_reason=''):
+    """
+    参加申請をまとめて拒否する
+
+    Returns:
+        tuple: (拒否したメンバーシップのリスト, [(メンバーシップID, 'not_found'), ...])
+    """
+    membership_ids = _unique(membership_ids)
+    with transaction.atomic():
+        _lock_circle(circle.pk)
+        pending = {
+            membership.pk: membership
+            for membership in CircleMembership.objects.filter(
+                circle=circle,
+                id__in=membership_ids,
+                status='pending'
+            ).select_related('user').order_by()
+        }
+        rejected = [pending[membership_id] for membership_id in membership_ids if membership_id in pending]
+        for membership in rejected:
+            membership.status = 'rejected'
+            membership.rejection_reason = rejection_reason
+        if rejected:
+            CircleMembership.objects.bulk_update(rejected, ['status', 'rejection_reason'])
+            _on_commit(circle.pk, 'rejected', rejected)
+    skipped = [(membership_id, 'not_found') for membership_id in membership_ids if membership_id not in pending]
+    return rejected, skipped
+
+
+def remove_members(circle, membership_ids):
+    """
+    メンバーをまとめて削除する（オーナーは削除しない）
+
+    Returns:
+        tuple: (削除したメンバーシップのリスト, [(メンバーシップID, 削除しなかった理由), ...])
+            理由は 'not_found'（参加中でない）・'owner'（オーナー）
+    """
+    membership_ids = _unique(membership_ids)
+    with transaction.atomic():
+        _lock_circle(circle.pk)
+        members = {
+            membership.pk: membership
+            for membership in CircleMembership.objects.filter(
+                circle=circle,
+                id__in=membership_ids,
+                status='active'
+            ).select_related('user').order_by()
+        }
+        removed, skipped = [], []
+        for membership_id in membership_ids:
+            membership = members.get(membership_id)
+            if membership is None:
+                skipped.append((membership_id, 'not_found'))
+            elif membership.role == 'owner':
+                skipped.append((membership_id, 'owner'))
+            else:
+                removed.append(membership)
+        if removed:
+            # 削除時のシグナルによるメンバー数の減算を1回にまとめる
+            with batched_member_counts():
+                CircleMembership.objects.filter(pk__in=[membership.pk for membership in removed]).delete()
+            _on_commit(circle.pk, 'removed', removed)
+    return removed, skipped
+
+
+def _on_commit(circle_id, action, memberships):
+    """コミット後にメンバーシップキャッシュを破棄し、変更を通知する"""
+    user_ids = [membership.user_id for membership in memberships]
+    users = [
+        {
+            'id': str(membership.user.id),
+            'username': membership.user.username,
+            'display_name': membership.user.display_name,
+        }
+        for membership in memberships
+    ]
+
+    def committed():
+        # bulk_updateはシグナルを送らないため、参加中サークルのキャッシュもここで破棄する
+        invalidate_memberships(*user_ids)
+        notify_membership_changes(circle_id, action, users)
+
+    transaction.on_commit(committed)
+
+
+def notify_membership_changes(circle_id, action, users):
+    """
+    メンバーシップの一括変更をサークルのチャットルームに1つのフレームで通知する
+
+    Args:
+        action: 'approved' / 'rejected' / 'removed'
+        users: 対象ユーザーの通知用情報のリスト
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    room = room_group_name(circle_id)
+    async_to_sync(channel_layer.group_send)(room, {
+        'type': 'membership_update',
+        'room': room,
+        'text': encode_frame({'type': 'members', 'action': action, 'users': users}),
+    })
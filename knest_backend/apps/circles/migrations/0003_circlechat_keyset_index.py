@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0002_alter_circle_interests_alter_circleinterest_interest'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='circlechat',
+            name='circles_cir_circle__f87430_idx',
+        ),
+        migrations.AddIndex(
+            model_name='circlechat',
+            index=models.Index(fields=['circle', 'created_at', 'id'], name='circles_cir_circle__ae534b_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0003_circlechat_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CircleChatArchive',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('period', models.DateField(verbose_name='対象月')),
+                ('message_count', models.PositiveIntegerField(default=0, verbose_name='メッセージ数')),
+                ('first_created_at', models.DateTimeField(verbose_name='最古メッセージ日時')),
+                ('last_created_at', models.DateTimeField(verbose_name='最新メッセージ日時')),
+                ('payload', models.BinaryField(verbose_name='圧縮データ')),
+                ('archived_at', models.DateTimeField(auto_now=True, verbose_name='アーカイブ日時')),
+                ('circle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_archives', to='circles.circle')),
+            ],
+            options={
+                'verbose_name': 'チャットアーカイブ',
+                'verbose_name_plural': 'チャットアーカイブ',
+                'indexes': [models.Index(fields=['circle', 'last_created_at'], name='circles_cir_circle__3506be_idx')],
+                'unique_together': {('circle', 'period')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0004_circlechatarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CircleChatSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=2, verbose_name='トークン')),
+                ('circle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='circles.circle')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='circles.circlechat')),
+            ],
+            options={
+                'verbose_name': 'チャット検索トークン',
+                'verbose_name_plural': 'チャット検索トークン',
+                'indexes': [models.Index(fields=['circle', 'token'], name='circles_cir_circle__7ef65d_idx')],
+            },
+        ),
+    ]
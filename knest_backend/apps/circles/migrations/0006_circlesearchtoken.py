@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0005_circlechatsearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CircleSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=2, verbose_name='トークン')),
+                ('weight', models.PositiveSmallIntegerField(default=1, verbose_name='重み')),
+                ('circle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='circles.circle')),
+            ],
+            options={
+                'verbose_name': 'サークル検索トークン',
+                'verbose_name_plural': 'サークル検索トークン',
+                'indexes': [models.Index(fields=['token', 'circle'], name='circles_cir_token_c50b93_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0006_circlesearchtoken'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='circle',
+            index=models.Index(fields=['last_activity'], name='circles_cir_last_ac_cf72fd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='circle',
+            index=models.Index(fields=['member_count'], name='circles_cir_member__39ac37_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='circlemembership',
+            index=models.Index(fields=['user', 'status', 'joined_at'], name='circles_cir_user_id_33db88_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='circlemembership',
+            index=models.Index(fields=['circle', 'status', 'joined_at', 'id'], name='circles_cir_circle__99c9d4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='circlesearchhistory',
+            index=models.Index(fields=['searched_at'], name='circles_cir_searche_1e3df5_idx'),
+        ),
+    ]
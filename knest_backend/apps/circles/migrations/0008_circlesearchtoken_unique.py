@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_duplicate_tokens(apps, schema_editor):
+    """同じサークル・トークンの重複を最初の1件を残して削除する"""
+    CircleSearchToken = apps.get_model('circles', 'CircleSearchToken')
+    duplicates = CircleSearchToken.objects.order_by().values('circle_id', 'token').annotate(
+        count=Count('id'), first=Min('id')
+    ).filter(count__gt=1)
+    for duplicate in duplicates:
+        CircleSearchToken.objects.filter(
+            circle_id=duplicate['circle_id'], token=duplicate['token']
+        ).exclude(id=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0007_membership_activity_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_tokens, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='circlesearchtoken',
+            unique_together={('circle', 'token')},
+        ),
+    ]
@@ -92,13 +92,20 @@ class Circle(models.Model):
         verbose_name = _('サークル')
         verbose_name_plural = _('サークル')
         ordering = ['-last_activity']
+        indexes = [
+            # 一覧の既定の並び順・メンバー数順
+            models.Index(fields=['last_activity']),
+            models.Index(fields=['member_count']),
+            # オートコンプリートの差分取り込み
+            models.Index(fields=['updated_at']),
+        ]
 
     def __str__(self):
         return self.name
 
     def clean(self):
         # メンバー数が上限に達している場合、ステータスを自動的に'full'に設定
-        if self.members.count() >= 10 and self.status != 'full':
+        if self.member_count >= 10 and self.status != 'full':
             self.status = 'full'
 
         # メンバー数の上限チェック
@@ -209,6 +216,12 @@ class CircleMembership(models.Model):
         verbose_name_plural = _('サークルメンバーシップ')
         unique_together = ['user', 'circle']
         ordering = ['-joined_at']
+        indexes = [
+            # ユーザーの参加中・申請中のサークル (user, status)
+            models.Index(fields=['user', 'status', 'joined_at']),
+            # サークルの参加中・申請中のメンバー (circle, status) とメンバー一覧のカーソル順
+            models.Index(fields=['circle', 'status', 'joined_at', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.circle.name}"
@@ -269,10 +282,31 @@ class CircleSearchHistory(models.Model):
         verbose_name = _('サークル検索履歴')
         verbose_name_plural = _('サークル検索履歴')
         ordering = ['-searched_at']
+        indexes = [
+            # 人気の検索クエリの集計（期間で絞り込む）
+            models.Index(fields=['searched_at']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.search_query} ({self.searched_at.strftime('%Y-%m-%d %H:%M')})"
 
+class CircleSearchToken(models.Model):
+    """サークル検索用のn-gramトークン（サークル保存時に更新、weightは出現した項目の重みの合計）"""
+    circle = models.ForeignKey(Circle, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(_('トークン'), max_length=2)
+    weight = models.PositiveSmallIntegerField(_('重み'), default=1)
+
+    class Meta:
+        verbose_name = _('サークル検索トークン')
+        verbose_name_plural = _('サークル検索トークン')
+        unique_together = ['circle', 'token']
+        indexes = [
+            models.Index(fields=['token', 'circle']),
+        ]
+
+    def __str__(self):
+        return f"{self.token} - {self.circle_id}"
+
 class CirclePost(models.Model):
     """サークル投稿モデル"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -331,7 +365,8 @@ class CircleChat(models.Model):
         verbose_name_plural = _('サークルチャット')
         ordering = ['created_at']
         indexes = [
-            models.Index(fields=['circle', '-created_at']),
+            # 履歴のキーセットページネーション (circle, created_at, id) 用
+            models.Index(fields=['circle', 'created_at', 'id']),
             models.Index(fields=['sender', 'circle']),
             models.Index(fields=['circle', 'is_system_message']),
         ]
@@ -339,6 +374,44 @@ class CircleChat(models.Model):
     def __str__(self):
         return f"{self.sender.username} - {self.content[:50]}"
 
+class CircleChatArchive(models.Model):
+    """アーカイブ済みチャット（サークル・月ごとに圧縮して保存）"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    circle = models.ForeignKey(Circle, on_delete=models.CASCADE, related_name='chat_archives')
+    period = models.DateField(_('対象月'))
+    message_count = models.PositiveIntegerField(_('メッセージ数'), default=0)
+    first_created_at = models.DateTimeField(_('最古メッセージ日時'))
+    last_created_at = models.DateTimeField(_('最新メッセージ日時'))
+    payload = models.BinaryField(_('圧縮データ'))
+    archived_at = models.DateTimeField(_('アーカイブ日時'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('チャットアーカイブ')
+        verbose_name_plural = _('チャットアーカイブ')
+        unique_together = ['circle', 'period']
+        indexes = [
+            models.Index(fields=['circle', 'last_created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.circle.name} - {self.period.strftime('%Y-%m')} ({self.message_count}件)"
+
+class CircleChatSearchToken(models.Model):
+    """チャット全文検索用のn-gramトークン（メッセージ保存時に更新）"""
+    circle = models.ForeignKey(Circle, on_delete=models.CASCADE, related_name='+')
+    message = models.ForeignKey(CircleChat, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(_('トークン'), max_length=2)
+
+    class Meta:
+        verbose_name = _('チャット検索トークン')
+        verbose_name_plural = _('チャット検索トークン')
+        indexes = [
+            models.Index(fields=['circle', 'token']),
+        ]
+
+    def __str__(self):
+        return f"{self.token} - {self.message_id}"
+
 class CircleChatRead(models.Model):
     """チャットの既読管理モデル"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -0,0 +1,70 @@
+"""
+サークル一覧用のクエリ
+CircleSerializerが参照するリクエストユーザーの参加状態を注釈し、
+関連オブジェクトをプリフェッチしてサークルごとのクエリ発行を防ぐ
+"""
+from django.db.models import CharField, OuterRef, Prefetch, Subquery, Value
+from django.db.models import prefetch_related_objects
+
+from knest_backend.apps.interests.models import InterestTag
+from .models import CircleMembership
+
+
+def _prefetches():
+    return [
+        Prefetch(
+            'interests',
+            queryset=InterestTag.objects.select_related('subcategory__category')
+        ),
+        'categories',
+    ]
+
+
+def with_list_data(queryset, user):
+    """
+    一覧表示用の注釈とプリフェッチを付与する
+
+    - user_membership_status: リクエストユーザーのメンバーシップの状態（未参加はNone）
+
+    他の集計注釈と結合が干渉しないよう、サブクエリで求める
+    メンバー数は保持しているCircle.member_countを参照する（member_counts.py）
+    """
+    queryset = queryset.select_related('owner').prefetch_related(*_prefetches())
+    if user is not None and user.is_authenticated:
+        queryset = queryset.annotate(
+            user_membership_status=Subquery(
+                CircleMembership.objects.filter(
+                    circle=OuterRef('pk'),
+                    user=user
+                ).values('status')[:1]
+            )
+        )
+    else:
+        queryset = queryset.annotate(user_membership_status=Value(None, output_field=CharField()))
+    return queryset
+
+
+def attach_list_data(circles, user):
+    """
+    取得済みのサークル（推薦結果のリストなど）に一覧表示用のデータをまとめて付与する
+
+    with_list_data()と同じ属性を設定する
+    """
+    circles = list(circles)
+    circle_ids = [circle.pk for circle in circles]
+    if not circle_ids:
+        return circles
+
+    statuses = {}
+    if user is not None and user.is_authenticated:
+        statuses = dict(
+            CircleMembership.objects.filter(
+                circle_id__in=circle_ids,
+                user=user
+            ).values_list('circle_id', 'status')
+        )
+    prefetch_related_objects(circles, 'owner', *_prefetches())
+
+    for circle in circles:
+        circle.user_membership_status = statuses.get(circle.pk)
+    return circles
@@ -0,0 +1,149 @@
+"""
+チャット送信のレート制限とバックプレッシャー
+
+- 接続単位・ルーム単位のトークンバケットで受信フレーム数を制限する
+- ルーム単位の制限は既定ではワーカー内のメモリで判定し、
+  CHAT_RATE_LIMIT_SHARED=True の場合はキャッシュ上の秒単位カウンターでワーカー間で共有する
+- DB書き込み中のメッセージ数をワーカー全体・ルームごとに数え、上限に達した場合は受け付けない
+  （1つのルームの大量送信でDBスレッドプールが埋まるのを防ぐ）
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+
+class TokenBucket:
+    """トークンバケット"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, now=None):
+        """
+        トークンを1つ消費する
+
+        Returns:
+            float: 受け付けた場合は0、拒否した場合は次のトークンまでの秒数
+        """
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now=None):
+        self._refill(time.monotonic() if now is None else now)
+        return self.tokens >= self.capacity
+
+
+class ChatRateLimiter:
+    """ルーム単位のレート制限とDB書き込みの同時実行数の管理（ワーカー内で共有）"""
+
+    # 保持するルームのバケット数がこれを超えたら満タンのバケットを破棄する
+    max_idle_rooms = 10000
+
+    def __init__(self):
+        self._rooms = {}
+        self._pending = 0
+        self._pending_rooms = {}
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'CHAT_RATE_LIMIT_ENABLED', True)
+
+    def connection_bucket(self):
+        """接続ごとのバケットを作成する（制限が無効な場合はNone）"""
+        if not self.enabled:
+            return None
+        return TokenBucket(
+            getattr(settings, 'CHAT_RATE_LIMIT_CONNECTION_RATE', 5.0),
+            getattr(settings, 'CHAT_RATE_LIMIT_CONNECTION_BURST', 10)
+        )
+
+    def check_room(self, room):
+        """
+        ルームへの送信を1件受け付けられるか判定する
+
+        Returns:
+            float: 受け付けた場合は0、拒否した場合は再送までの秒数
+        """
+        if not self.enabled:
+            return 0.0
+        rate = getattr(settings, 'CHAT_RATE_LIMIT_ROOM_RATE', 30.0)
+        if getattr(settings, 'CHAT_RATE_LIMIT_SHARED', False):
+            return self._check_shared(room, rate)
+
+        bucket = self._rooms.get(room)
+        if bucket is None:
+            if len(self._rooms) >= self.max_idle_rooms:
+                self._prune()
+            bucket = self._rooms[room] = TokenBucket(
+                rate,
+                getattr(settings, 'CHAT_RATE_LIMIT_ROOM_BURST', 60)
+            )
+        return bucket.consume()
+
+    async def acheck_room(self, room):
+        """check_room()の非同期版（共有カウンターの場合はスレッドで問い合わせる）"""
+        if self.enabled and getattr(settings, 'CHAT_RATE_LIMIT_SHARED', False):
+            return await sync_to_async(self.check_room, thread_sensitive=False)(room)
+        return self.check_room(room)
+
+    def _check_shared(self, room, rate):
+        now = time.time()
+        window = int(now)
+        key = f'chat_rate_{room}_{window}'
+        cache.add(key, 0, timeout=2)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            return 0.0
+        if count > rate:
+            return window + 1 - now
+        return 0.0
+
+    def _prune(self):
+        now = time.monotonic()
+        for room in [room for room, bucket in self._rooms.items() if bucket.is_full(now)]:
+            del self._rooms[room]
+
+    def acquire_write(self, room):
+        """
+        DB書き込みの枠を確保する
+
+        Returns:
+            bool: 確保できた場合True（書き込み後にrelease_write()を呼ぶこと）
+        """
+        if not self.enabled:
+            return True
+        if self._pending >= getattr(settings, 'CHAT_MAX_PENDING_WRITES', 64):
+            return False
+        pending_room = self._pending_rooms.get(room, 0)
+        if pending_room >= getattr(settings, 'CHAT_MAX_PENDING_WRITES_PER_ROOM', 8):
+            return False
+        self._pending += 1
+        self._pending_rooms[room] = pending_room + 1
+        return True
+
+    def release_write(self, room):
+        if room not in self._pending_rooms:
+            return
+        self._pending -= 1
+        remaining = self._pending_rooms[room] - 1
+        if remaining > 0:
+            self._pending_rooms[room] = remaining
+        else:
+            del self._pending_rooms[room]
+
+
+chat_limits = ChatRateLimiter()
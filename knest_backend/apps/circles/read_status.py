@@ -0,0 +1,225 @@
+"""
+チャット既読ウォーターマークの集約
+(ユーザー, サークル)ごとの最新既読時刻をメモリ上で保持し、DBへはまとめて書き込む
+
+- 既読は一定間隔・一定件数ごと、WebSocketの切断時、ASGI・WSGIプロセスのバックグラウンドスレッド
+  （start_background_flush()）による定期実行、プロセス終了時にDBへ反映する
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Q
+
+from .models import CircleChatRead
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReadWatermarkAggregator:
+    """
+    既読ウォーターマークの集約器
+
+    - 既読はメモリ上で (user_id, circle_id) ごとに最新値のみ保持し、DBへ反映したものは破棄する
+    - 新着メッセージがない状態での既読も記録するが、「前進していない」として通知の対象にしない
+    - DBへの書き込みは一定間隔または一定件数ごとにまとめて行う
+    """
+
+    def __init__(self, flush_interval=None, batch_size=None):
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else getattr(settings, 'CHAT_READ_FLUSH_INTERVAL', 5.0)
+        )
+        self.batch_size = (
+            batch_size if batch_size is not None
+            else getattr(settings, 'CHAT_READ_FLUSH_BATCH_SIZE', 500)
+        )
+        self._lock = threading.Lock()
+        # (user_id, circle_id) -> 最新既読時刻
+        self._watermarks = {}
+        # DB未反映の (user_id, circle_id)
+        self._dirty = set()
+        # circle_id -> 最新メッセージ作成時刻
+        self._latest_message_at = {}
+        self._last_flush = time.monotonic()
+        self._flusher = None
+
+    @staticmethod
+    def _key(user_id, circle_id):
+        return str(user_id), str(circle_id)
+
+    @staticmethod
+    def _latest_cache_key(circle_id):
+        return f'circle_chat_{circle_id}_latest_at'
+
+    def note_message(self, circle_id, created_at):
+        """サークルの最新メッセージ時刻を記録する（ワーカー間はキャッシュで共有）"""
+        circle_id = str(circle_id)
+        with self._lock:
+            latest = self._latest_message_at.get(circle_id)
+            if latest is None or created_at > latest:
+                self._latest_message_at[circle_id] = created_at
+        cache.set(self._latest_cache_key(circle_id), created_at, timeout=None)
+
+    def _latest_message(self, circle_id):
+        shared = cache.get(self._latest_cache_key(circle_id))
+        with self._lock:
+            local = self._latest_message_at.get(circle_id)
+        candidates = [value for value in (shared, local) if value is not None]
+        return max(candidates) if candidates else None
+
+    def mark_read(self, user_id, circle_id, read_at):
+        """
+        既読を登録する
+
+        最新メッセージ時刻はキャッシュの破棄などで古い場合があるため、既読は常に記録し、
+        前進したかどうかの判定（通知するかどうか）にのみ使う
+
+        Returns:
+            bool: ウォーターマークが前進した場合True
+        """
+        key = self._key(user_id, circle_id)
+        latest = self._latest_message(key[1])
+        with self._lock:
+            previous = self._watermarks.get(key)
+            if previous is not None and read_at <= previous:
+                return False
+            self._watermarks[key] = read_at
+            self._dirty.add(key)
+
+        cache.delete_many([
+            f'circle_chat_{key[1]}_unread_{key[0]}',
+            f'circle_chat_all_unread_{key[0]}',
+        ])
+        # 前回既読以降に新着がなければ前進とみなさない
+        return previous is None or latest is None or latest > previous
+
+    def last_read(self, user_id, circle_id, stored=None):
+        """DB値とメモリ上の値のうち新しい方の既読時刻を返す"""
+        with self._lock:
+            pending = self._watermarks.get(self._key(user_id, circle_id))
+        if pending is None:
+            return stored
+        if stored is None:
+            return pending
+        return max(pending, stored)
+
+    def is_flush_due(self):
+        with self._lock:
+            return bool(self._dirty) and (
+                len(self._dirty) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+
+    def flush_if_due(self):
+        """書き込み時期に達していればDBへ反映する"""
+        if self.is_flush_due():
+            return self.flush()
+        return 0
+
+    def flush(self):
+        """
+        未反映の既読をDBへまとめて書き込む
+
+        Returns:
+            int: 書き込んだ件数
+        """
+        with self._lock:
+            pending = {key: self._watermarks[key] for key in self._dirty}
+            self._dirty.clear()
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        keys = list(pending)
+        written = 0
+        try:
+            for start in range(0, len(keys), self.batch_size):
+                written += self._write_batch(
+                    {key: pending[key] for key in keys[start:start + self.batch_size]}
+                )
+        except Exception:
+            # 書き込みに失敗した分は次回に再送する
+            with self._lock:
+                self._dirty.update(keys)
+            logger.exception('既読状態の書き込みに失敗しました')
+            raise
+
+        # 反映済みでその後更新されていない既読はメモリから破棄する（以降はDB値を参照する）
+        with self._lock:
+            for key, read_at in pending.items():
+                if key not in self._dirty and self._watermarks.get(key) == read_at:
+                    del self._watermarks[key]
+        return written
+
+    def start_background_flush(self):
+        """
+        一定間隔でDBへ反映するスレッドを開始し、プロセス終了時にも反映する（ASGI・WSGIアプリケーションの初期化後に呼ぶ）
+
+        新しい既読がない接続しか残っていない場合も、保留中の既読を CHAT_READ_FLUSH_INTERVAL 以内に反映する
+        """
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_periodically,
+                name='chat-read-flusher',
+                daemon=True
+            )
+        self._flusher.start()
+        atexit.register(self._flush_at_exit)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_if_due()
+            except Exception:
+                # 失敗した分は再送対象に戻っている（flush()でログ出力済み）
+                pass
+            finally:
+                close_old_connections()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+    def _write_batch(self, batch):
+        condition = Q()
+        for user_id, circle_id in batch:
+            condition |= Q(user_id=user_id, circle_id=circle_id)
+
+        existing = {
+            self._key(read.user_id, read.circle_id): read
+            for read in CircleChatRead.objects.filter(condition)
+        }
+
+        to_update = []
+        to_create = []
+        for key, read_at in batch.items():
+            read = existing.get(key)
+            if read is None:
+                to_create.append(CircleChatRead(
+                    user_id=key[0],
+                    circle_id=key[1],
+                    last_read=read_at
+                ))
+            elif read.last_read < read_at:
+                read.last_read = read_at
+                to_update.append(read)
+
+        if to_update:
+            CircleChatRead.objects.bulk_update(to_update, ['last_read'])
+        if to_create:
+            CircleChatRead.objects.bulk_create(to_create, ignore_conflicts=True)
+        return len(to_update) + len(to_create)
+
+
+read_watermarks = ReadWatermarkAggregator()
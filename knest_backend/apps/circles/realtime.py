@@ -0,0 +1,258 @@
+"""
+チャットのリアルタイムイベント集約
+タイピング通知とオンライン状態をルーム単位でまとめ、一定間隔で配信する
+
+接続の集計はワーカー（プロセス）ごとに行い、各ワーカーは自分に接続中のユーザーを
+ワーカーごとのキーとしてキャッシュに書き、オンライン状態の配信のたびに有効期間を延ばす。
+オンライン・オフラインは他のワーカーにキーがない場合のみ配信するため、複数ワーカーに接続している
+ユーザーの状態がワーカー間で食い違わない。異常終了したワーカーのキーは CHAT_PRESENCE_TIMEOUT で消える
+（キャッシュを共有しない設定では、ワーカーごとの接続のみで判定する）
+"""
+import asyncio
+import json
+import logging
+import uuid
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+
+try:
+    import orjson
+except ImportError:  # orjsonが未インストールの場合は標準のjsonを使用
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def _presence_key(room, user_id, slot):
+    return f'chat_presence_{room}_{user_id}_{slot}'
+
+
+def _slot_key(slot):
+    return f'chat_presence_worker_{slot}'
+
+
+def encode_frame(frame):
+    """
+    クライアント送信用フレームをシリアライズする
+
+    送信側で一度だけ呼び出し、結果の文字列をグループイベントに載せることで
+    受信側のコンシューマーごとのシリアライズを不要にする
+    """
+    if orjson is not None:
+        return orjson.dumps(frame).decode()
+    return json.dumps(frame)
+
+
+class _RoomState:
+    """ルームごとの集約状態"""
+
+    def __init__(self):
+        # user_id -> 接続数（同一ユーザーの複数接続を考慮）
+        self.connections = {}
+        # user_id -> ユーザー情報
+        self.profiles = {}
+        # 前回配信したオンラインユーザー
+        self.broadcast_online = set()
+        # 次回配信するタイピング中ユーザー（user_id -> ユーザー情報）
+        self.pending_typing = {}
+        self.last_presence_flush = 0.0
+        self.task = None
+
+    @property
+    def online(self):
+        return set(self.connections)
+
+    def is_idle(self):
+        return (
+            not self.connections
+            and not self.pending_typing
+            and not self.broadcast_online
+        )
+
+
+class RoomEventCoalescer:
+    """
+    タイピング通知・オンライン状態の集約器
+
+    - タイピング通知はユーザーごとに間隔内1回へ間引き、ルーム単位でまとめて送信
+    - オンライン状態はルーム単位の集合として保持し、前回配信分との差分のみ送信
+    - 差分はワーカーごとのキーでワーカー間に共有し、他のワーカーにも接続中のユーザーは配信しない
+    """
+
+    def __init__(self, typing_interval=None, presence_interval=None, channel_layer=None):
+        self.typing_interval = (
+            typing_interval if typing_interval is not None
+            else getattr(settings, 'CHAT_TYPING_COALESCE_INTERVAL', 1.0)
+        )
+        self.presence_interval = (
+            presence_interval if presence_interval is not None
+            else getattr(settings, 'CHAT_PRESENCE_BROADCAST_INTERVAL', 3.0)
+        )
+        self.presence_timeout = getattr(settings, 'CHAT_PRESENCE_TIMEOUT', 30)
+        self.max_workers = getattr(settings, 'CHAT_PRESENCE_MAX_WORKERS', 32)
+        self._channel_layer = channel_layer
+        self._rooms = {}
+        # キャッシュ上のワーカー番号（ワーカーごとのキーに使う）
+        self._slot = None
+        self._slot_token = uuid.uuid4().hex
+
+    @property
+    def channel_layer(self):
+        if self._channel_layer is None:
+            self._channel_layer = get_channel_layer()
+        return self._channel_layer
+
+    def _room(self, room):
+        state = self._rooms.get(room)
+        if state is None:
+            state = self._rooms[room] = _RoomState()
+        return state
+
+    def online_users(self, room):
+        """ルームの現在のオンラインユーザーID集合"""
+        state = self._rooms.get(room)
+        return state.online if state else set()
+
+    def user_connected(self, room, user):
+        """接続を登録する（配信は次回フラッシュ時）"""
+        state = self._room(room)
+        state.connections[user['id']] = state.connections.get(user['id'], 0) + 1
+        state.profiles[user['id']] = user
+        self._ensure_flusher(room, state)
+
+    def user_disconnected(self, room, user):
+        """切断を登録する（配信は次回フラッシュ時）"""
+        state = self._rooms.get(room)
+        if state is None:
+            return
+        remaining = state.connections.get(user['id'], 0) - 1
+        if remaining > 0:
+            state.connections[user['id']] = remaining
+        else:
+            state.connections.pop(user['id'], None)
+            state.pending_typing.pop(user['id'], None)
+        self._ensure_flusher(room, state)
+
+    def user_typing(self, room, user):
+        """タイピングを登録する（間隔内の重複は破棄）"""
+        state = self._room(room)
+        state.pending_typing.setdefault(user['id'], user)
+        self._ensure_flusher(room, state)
+
+    async def flush(self, room, force_presence=False):
+        """保留中のイベントを配信する"""
+        state = self._rooms.get(room)
+        if state is None:
+            return
+
+        if state.pending_typing:
+            users = list(state.pending_typing.values())
+            state.pending_typing.clear()
+            await self.channel_layer.group_send(room, {
+                'type': 'typing_batch',
+                'room': room,
+                'frames': [encode_frame({'type': 'typing', 'user': user}) for user in users],
+            })
+
+        loop = asyncio.get_running_loop()
+        if force_presence or loop.time() - state.last_presence_flush >= self.presence_interval:
+            state.last_presence_flush = loop.time()
+            current = state.online
+            joined = current - state.broadcast_online
+            left = state.broadcast_online - current
+            state.broadcast_online = current
+            # 変化がなくても、このワーカーのキーの有効期間を延ばす
+            joined, left = await sync_to_async(self._share_presence)(room, current, joined, left)
+            frames = [
+                {'type': 'online', 'user': state.profiles.get(user_id)}
+                for user_id in joined
+            ] + [
+                {'type': 'offline', 'user': state.profiles.get(user_id)}
+                for user_id in left
+            ]
+            frames = [frame for frame in frames if frame['user'] is not None]
+            if frames:
+                await self.channel_layer.group_send(room, {
+                    'type': 'presence_update',
+                    'room': room,
+                    'frames': [encode_frame(frame) for frame in frames],
+                })
+            # 待機中に接続したユーザーの情報を消さないよう、現在の接続から判定する
+            for user_id in state.profiles.keys() - state.connections.keys():
+                state.profiles.pop(user_id)
+
+    def _claim_slot(self):
+        """キャッシュ上のワーカー番号を確保・延長する（確保できない場合はNone）"""
+        if self._slot is not None and cache.get(_slot_key(self._slot)) == self._slot_token:
+            cache.touch(_slot_key(self._slot), timeout=self.presence_timeout)
+            return self._slot
+        self._slot = None
+        for slot in range(self.max_workers):
+            if cache.add(_slot_key(slot), self._slot_token, timeout=self.presence_timeout):
+                self._slot = slot
+                break
+        return self._slot
+
+    def _share_presence(self, room, current, joined, left):
+        """
+        このワーカーに接続中のユーザーのキーを更新し、他のワーカーの接続を確認する
+
+        他のワーカーの確認は自分のキーを削除した後に行うため、同時に切断しても
+        少なくとも1つのワーカーがオフラインを配信する
+
+        Returns:
+            tuple: (オンラインを配信するユーザー, オフラインを配信するユーザー)
+        """
+        slot = self._claim_slot()
+        if slot is None:
+            return joined, left
+        if left:
+            cache.delete_many([_presence_key(room, user_id, slot) for user_id in left])
+        if current:
+            cache.set_many(
+                {_presence_key(room, user_id, slot): 1 for user_id in current},
+                timeout=self.presence_timeout
+            )
+        changed = joined | left
+        if not changed:
+            return joined, left
+        keys = {
+            _presence_key(room, user_id, other): user_id
+            for user_id in changed
+            for other in range(self.max_workers) if other != slot
+        }
+        elsewhere = {keys[key] for key in cache.get_many(list(keys))}
+        return joined - elsewhere, left - elsewhere
+
+    def _ensure_flusher(self, room, state):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = state.task
+        if task is not None and not task.done() and task.get_loop() is loop:
+            return
+        state.task = loop.create_task(self._run(room, state))
+
+    async def _run(self, room, state):
+        try:
+            while True:
+                await asyncio.sleep(self.typing_interval)
+                await self.flush(room)
+                if state.is_idle():
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('チャットイベントの集約配信に失敗しました: room=%s', room)
+        finally:
+            if self._rooms.get(room) is state and state.is_idle():
+                del self._rooms[room]
+
+
+room_events = RoomEventCoalescer()
@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/circle/(?P<circle_id>[^/]+)/chat/$', consumers.CircleChatConsumer.as_asgi()),
-] 
\ No newline at end of file
+    re_path(r'ws/chat/$', consumers.UserChatConsumer.as_asgi()),
+]
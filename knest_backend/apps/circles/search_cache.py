@@ -0,0 +1,295 @@
+"""
+人気の検索クエリのキャッシュ
+CircleSearchHistoryから検索回数の多いクエリを集計し、その検索結果の1ページ目（サークルIDと件数）をキャッシュする
+
+- クエリは検索と同じ正規化（NFKC・小文字化・空白の統一）をした形で集計・照合する
+- キャッシュするのは並び順と件数のみで、メンバー数・参加状態などは表示のたびに取得する
+- 検索対象の項目が変わったサークルがクエリに一致しうる場合、そのクエリのキャッシュを破棄する
+  それ以外の保存（最終アクティビティなど）は、1ページ目に含まれるサークルの場合のみ破棄する
+- 破棄は世代番号で行い、破棄と同時に計算していた古い結果が保存されても使われないようにする
+- 人気のクエリの集計は warm_popular_searches（定期実行）でのみ行い、検索時はプロセス内に一定時間保持した
+  集計結果を参照する。検索履歴はプロセス内にためてまとめて書き込む
+"""
+import atexit
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .chat_search import NGRAM_SIZE, split_words, tokenize
+from .circle_search import rank_circles, ranked_matches
+from .models import Circle, CircleSearchHistory
+
+
+POPULAR_QUERIES_KEY = 'circle_search_popular_queries'
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    return ' '.join(split_words(query))
+
+
+def _query_hash(query):
+    return hashlib.md5(query.encode()).hexdigest()
+
+
+def _page_key(query):
+    return f'circle_search_page_{_query_hash(query)}'
+
+
+def _generation_key(query):
+    return f'circle_search_page_{_query_hash(query)}_gen'
+
+
+def _could_match(query, tokens):
+    """検索語がトークン集合を持つサークルに一致しうるか"""
+    for word in query.split(' '):
+        if len(word) < NGRAM_SIZE:
+            if not any(word in token for token in tokens):
+                return False
+        elif not tokenize(word) <= tokens:
+            return False
+    return True
+
+
+def _uses_any(query, tokens):
+    """検索語の照合にトークン集合のいずれかを使うか"""
+    for word in query.split(' '):
+        if len(word) < NGRAM_SIZE:
+            if any(word in token for token in tokens):
+                return True
+        elif tokenize(word) & tokens:
+            return True
+    return False
+
+
+class PopularSearchCache:
+    """人気の検索クエリの1ページ目のキャッシュ"""
+
+    def __init__(self):
+        # プロセス内に保持する人気のクエリ（有効期限, クエリのリスト）
+        self._local = None
+
+    def popular_queries(self):
+        """
+        直近の検索回数の多いクエリ（正規化済み）
+
+        検索のたびに共有キャッシュを参照しないよう、CIRCLE_SEARCH_POPULAR_LOCAL_TIMEOUT 秒だけプロセス内に保持する。
+        集計はしない（集計結果がない場合は空）
+
+        Returns:
+            list: 検索回数の多い順
+        """
+        now = time.monotonic()
+        local = self._local
+        if local is not None and local[0] > now:
+            return local[1]
+        queries = cache.get(POPULAR_QUERIES_KEY) or []
+        self._local = (now + getattr(settings, 'CIRCLE_SEARCH_POPULAR_LOCAL_TIMEOUT', 60), queries)
+        return queries
+
+    def clear_local(self):
+        """プロセス内に保持した人気のクエリを破棄する（次回は共有キャッシュから読み込む）"""
+        self._local = None
+
+    def refresh_popular_queries(self):
+        """検索履歴から人気のクエリを集計し直す"""
+        limit = getattr(settings, 'CIRCLE_SEARCH_POPULAR_QUERIES', 50)
+        since = timezone.now() - timedelta(days=getattr(settings, 'CIRCLE_SEARCH_POPULAR_DAYS', 7))
+        counts = {}
+        # 表記ゆれをまとめるため、多めに取得してから正規化して合算する
+        for search_query, count in CircleSearchHistory.objects.filter(
+            searched_at__gte=since
+        ).order_by().values('search_query').annotate(
+            count=Count('id')
+        ).order_by('-count').values_list('search_query', 'count')[:limit * 5]:
+            query = normalize_query(search_query)
+            if query:
+                counts[query] = counts.get(query, 0) + count
+        queries = sorted(counts, key=lambda query: (-counts[query], query))[:limit]
+        cache.set(
+            POPULAR_QUERIES_KEY,
+            queries,
+            timeout=getattr(settings, 'CIRCLE_SEARCH_POPULAR_REFRESH_INTERVAL', 60 * 60)
+        )
+        self._local = (time.monotonic() + getattr(settings, 'CIRCLE_SEARCH_POPULAR_LOCAL_TIMEOUT', 60), queries)
+        return queries
+
+    def first_page(self, query, page_size):
+        """
+        人気のクエリの検索結果の1ページ目を返す（キャッシュがなければ計算して保存する）
+
+        Returns:
+            tuple: (サークルIDのリスト, 全件数, 候補の上限で打ち切ったかどうか)。人気のクエリでない場合はNone
+        """
+        query = normalize_query(query)
+        if not query or query not in self.popular_queries():
+            return None
+        page_key, generation_key = _page_key(query), _generation_key(query)
+        cached = cache.get_many([page_key, generation_key])
+        generation = cached.get(generation_key, 0)
+        entry = cached.get(page_key)
+        if entry is not None and entry['generation'] == generation and entry['page_size'] == page_size:
+            return entry['ids'], entry['count'], entry.get('truncated', False)
+        return self._store(query, page_size, generation)
+
+    def _store(self, query, page_size, generation):
+        ranks = ranked_matches(query)
+        queryset = rank_circles(Circle.objects.all(), ranks).order_by(
+            '-search_rank', *Circle._meta.ordering
+        )
+        ids = [str(pk) for pk in queryset.values_list('id', flat=True)[:page_size]]
+        count = len(ids) if len(ids) < page_size else queryset.count()
+        cache.set(
+            _page_key(query),
+            {
+                'ids': ids, 'count': count, 'truncated': ranks.truncated,
+                'page_size': page_size, 'generation': generation,
+            },
+            timeout=getattr(settings, 'CIRCLE_SEARCH_POPULAR_PAGE_TIMEOUT', 60 * 5)
+        )
+        return ids, count, ranks.truncated
+
+    def warm(self, page_size):
+        """
+        人気のクエリを集計し直し、すべての1ページ目を計算して保存する
+
+        Returns:
+            int: 保存したクエリ数
+        """
+        queries = self.refresh_popular_queries()
+        generations = cache.get_many([_generation_key(query) for query in queries])
+        for query in queries:
+            self._store(query, page_size, generations.get(_generation_key(query), 0))
+        return len(queries)
+
+    @staticmethod
+    def _cached_popular_queries():
+        # 破棄の判定では集計し直さない（人気のクエリ自体がキャッシュにない場合は破棄するものもない）
+        return cache.get(POPULAR_QUERIES_KEY) or []
+
+    def _invalidate(self, queries):
+        for query in queries:
+            key = _generation_key(query)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, timeout=None)
+
+    def invalidate_tokens(self, previous, current):
+        """
+        サークルの検索トークンの変化に応じて、一致しうるクエリのキャッシュを破棄する
+
+        Args:
+            previous, current: 変更前・後の {トークン: 重み}
+        """
+        changed = {
+            token for token in previous.keys() | current.keys()
+            if previous.get(token) != current.get(token)
+        }
+        if not changed:
+            return
+        before, after = set(previous), set(current)
+        self._invalidate([
+            query for query in self._cached_popular_queries()
+            if _uses_any(query, changed)
+            and (_could_match(query, before) or _could_match(query, after))
+        ])
+
+    def invalidate_deleted(self, circle):
+        """削除するサークルに一致していたクエリのキャッシュを破棄する（削除前に呼ぶ）"""
+        if not self._cached_popular_queries():
+            return
+        self.invalidate_tokens(dict(circle.search_tokens.values_list('token', 'weight')), {})
+
+    def invalidate_circle(self, circle_id):
+        """サークルを1ページ目に含むクエリのキャッシュを破棄する"""
+        queries = self._cached_popular_queries()
+        if not queries:
+            return
+        circle_id = str(circle_id)
+        entries = cache.get_many([_page_key(query) for query in queries])
+        self._invalidate([
+            query for query in queries
+            if circle_id in entries.get(_page_key(query), {}).get('ids', ())
+        ])
+
+
+class SearchHistoryBuffer:
+    """
+    検索履歴の書き込みをまとめる
+
+    検索のたびにINSERTしないよう、一定件数・一定間隔ごとにまとめて書き込む（プロセス終了時にも書き込む）
+    """
+
+    def __init__(self, flush_interval=None, batch_size=None):
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else getattr(settings, 'CIRCLE_SEARCH_HISTORY_FLUSH_INTERVAL', 10.0)
+        )
+        self.batch_size = (
+            batch_size if batch_size is not None
+            else getattr(settings, 'CIRCLE_SEARCH_HISTORY_BATCH_SIZE', 100)
+        )
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._registered = False
+
+    def record(self, **fields):
+        """検索履歴を追加する（書き込みは件数・間隔に達した場合のみ）"""
+        with self._lock:
+            self._pending.append(CircleSearchHistory(**fields))
+            due = (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+            if not self._registered:
+                self._registered = True
+                atexit.register(self._flush_at_exit)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        保留中の検索履歴を書き込む
+
+        Returns:
+            int: 書き込んだ件数
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            # 書き込むまでの間に退会したユーザーの履歴は除く
+            users = set(get_user_model().objects.filter(
+                id__in={history.user_id for history in pending}
+            ).values_list('id', flat=True))
+            pending = [history for history in pending if history.user_id in users]
+            CircleSearchHistory.objects.bulk_create(pending, batch_size=self.batch_size)
+        except Exception:
+            # 人気のクエリの集計にのみ使うため、失敗した分は再送しない
+            logger.exception('検索履歴の書き込みに失敗しました: %d件', len(pending))
+            return 0
+        return len(pending)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            pass
+
+
+popular_searches = PopularSearchCache()
+search_history = SearchHistoryBuffer()
@@ -41,7 +41,6 @@ class CircleSerializer(serializers.ModelSerializer):
     """
     owner = UserSerializer(read_only=True)
     interests = InterestTagSerializer(many=True, read_only=True)
-    member_count = serializers.SerializerMethodField()
     is_member = serializers.SerializerMethodField()
     membership_status = serializers.SerializerMethodField()
     categories = CategorySerializer(many=True, read_only=True)
@@ -61,12 +60,14 @@ class CircleSerializer(serializers.ModelSerializer):
             'member_count', 'is_member', 'membership_status', 'post_count'
         ]
 
-    def get_member_count(self, obj):
-        return obj.memberships.filter(status='active').count()
+    # 一覧ではqueries.with_list_data() / attach_list_data() で付与した注釈を参照する
+    # member_countはメンバーシップの変更時に更新される値をそのまま返す
 
     def get_is_member(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if hasattr(obj, 'user_membership_status'):
+                return obj.user_membership_status == 'active'
             return obj.memberships.filter(
                 user=request.user,
                 status='active'
@@ -76,6 +77,8 @@ class CircleSerializer(serializers.ModelSerializer):
     def get_membership_status(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
+            if hasattr(obj, 'user_membership_status'):
+                return obj.user_membership_status
             try:
                 membership = obj.memberships.get(user=request.user)
                 return membership.status
@@ -87,10 +90,7 @@ class CircleSerializer(serializers.ModelSerializer):
         if self.instance:
             # 既存のサークルを更新する場合
             if 'status' in data:
-                member_count = self.instance.memberships.filter(
-                    status='active'
-                ).count()
-                if data['status'] == 'open' and member_count >= 10:
+                if data['status'] == 'open' and self.instance.member_count >= 10:
                     raise serializers.ValidationError(
                         _('メンバーが10人以上いるため、募集を再開できません。')
                     )
@@ -168,6 +168,17 @@ class CircleJoinResponseSerializer(serializers.Serializer):
             )
         return data
 
+class CircleBulkMembershipSerializer(serializers.Serializer):
+    """メンバーシップの一括操作のシリアライザー"""
+    membership_ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        allow_empty=False,
+        max_length=500
+    )
+
+class CircleBulkJoinResponseSerializer(CircleBulkMembershipSerializer, CircleJoinResponseSerializer):
+    """参加申請への一括応答シリアライザー"""
+
 class CirclePostSerializer(serializers.ModelSerializer):
     author = serializers.SerializerMethodField()
 
@@ -196,6 +207,24 @@ class CircleEventSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(_('開始日時は終了日時より前である必要があります。'))
         return data
 
+def chat_reads_for(circle_id):
+    """サークルの既読情報を1クエリで取得する"""
+    return list(CircleChatRead.objects.filter(circle_id=circle_id).values(
+        'user__id', 'user__username', 'user__display_name', 'last_read'
+    ))
+
+def read_by_for(created_at, reads):
+    """メッセージを既読にしたユーザーの一覧"""
+    return [
+        {
+            'id': read['user__id'],
+            'username': read['user__username'],
+            'display_name': read['user__display_name']
+        }
+        for read in reads
+        if read['last_read'] >= created_at
+    ]
+
 class CircleChatSerializer(serializers.ModelSerializer):
     """サークルチャットのシリアライザー"""
     sender = serializers.SerializerMethodField()
@@ -236,17 +265,23 @@ class CircleChatSerializer(serializers.ModelSerializer):
         return None
 
     def get_read_by(self, obj):
+        # ページ単位で取得済みの既読情報があればそれを使う
+        reads = self.context.get('chat_reads')
+        if reads is not None:
+            return read_by_for(obj.created_at, reads)
         reads = obj.circle.chat_reads.filter(
             last_read__gte=obj.created_at
-        ).values('user__id', 'user__username', 'user__display_name')
-        return [
-            {
-                'id': read['user__id'],
-                'username': read['user__username'],
-                'display_name': read['user__display_name']
-            }
-            for read in reads
-        ]
+        ).values('user__id', 'user__username', 'user__display_name', 'last_read')
+        return read_by_for(obj.created_at, reads)
+
+class ChatSyncRequestSerializer(serializers.Serializer):
+    """チャット差分同期リクエストのシリアライザー"""
+    circles = serializers.DictField(
+        child=serializers.UUIDField(allow_null=True),
+        required=False,
+        default=dict
+    )
+    since = serializers.DateTimeField(required=False, allow_null=True, default=None)
 
 class CircleChatReadSerializer(serializers.ModelSerializer):
     """チャット既読のシリアライザー"""
@@ -0,0 +1,127 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Circle, CircleInterest, CircleMembership, CircleChat
+from .membership_cache import invalidate_memberships
+from .member_counts import adjust_member_count, member_count_delta
+from .chat_search import index_message
+from .circle_search import index_circle
+from .search_cache import popular_searches
+from .autocomplete import circle_autocomplete
+from knest_backend.apps.interests.models import InterestTag
+
+# サークル検索インデックスの対象項目
+CIRCLE_SEARCH_FIELDS = {'name', 'description', 'tags'}
+
+
+def reindex_circle(circle):
+    """検索インデックスを更新し、影響する人気クエリのキャッシュを破棄する"""
+    previous, current = index_circle(circle)
+    popular_searches.invalidate_tokens(previous, current)
+
+@receiver([post_save, post_delete], sender=CircleMembership)
+def invalidate_membership_cache(sender, instance, **kwargs):
+    """
+    メンバーシップの変更時にキャッシュを破棄する
+
+    コミット前に破棄すると、他のリクエストが変更前の状態を読んでキャッシュし直すため、コミット後に破棄する
+    """
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_memberships(user_id))
+
+@receiver(post_init, sender=CircleMembership)
+def remember_membership_status(sender, instance, **kwargs):
+    """
+    保存済みの状態を記録する（メンバー数の増減の判定用。遅延読み込みの項目は参照しない）
+    """
+    instance._saved_status = instance.__dict__.get('status')
+
+@receiver(post_save, sender=CircleMembership)
+def update_member_count(sender, instance, created, raw=False, **kwargs):
+    """
+    メンバーシップの作成・状態の変更時にサークルのメンバー数を増減する
+    """
+    if raw:
+        return
+    previous = None if created else instance._saved_status
+    if created or previous is not None:
+        adjust_member_count(instance.circle_id, member_count_delta(previous, instance.status))
+    instance._saved_status = instance.status
+
+@receiver(post_delete, sender=CircleMembership)
+def decrement_member_count(sender, instance, **kwargs):
+    """
+    メンバーシップの削除時にサークルのメンバー数を減らす
+    """
+    adjust_member_count(instance.circle_id, member_count_delta(instance._saved_status, None))
+
+@receiver(post_save, sender=CircleChat)
+def update_chat_search_index(sender, instance, created, update_fields=None, **kwargs):
+    """
+    メッセージの保存時に検索インデックスを更新する
+    """
+    if created or update_fields is None or 'content' in update_fields:
+        index_message(instance, created=created)
+
+@receiver(post_save, sender=Circle)
+def update_circle_search_index(sender, instance, update_fields=None, raw=False, **kwargs):
+    """
+    サークルの保存時に検索インデックスを更新する（メンバー数などのみの更新は対象外）
+    """
+    if raw:
+        return
+    if update_fields is None or CIRCLE_SEARCH_FIELDS & set(update_fields):
+        reindex_circle(instance)
+    # 並び順（最終アクティビティ）が変わるため、1ページ目に含むクエリのキャッシュも破棄する
+    popular_searches.invalidate_circle(instance.pk)
+
+@receiver(pre_delete, sender=Circle)
+def invalidate_circle_search_cache(sender, instance, **kwargs):
+    """
+    サークルの削除時に、一致していた人気クエリのキャッシュを破棄する
+    """
+    popular_searches.invalidate_deleted(instance)
+
+@receiver(post_save, sender=CircleInterest)
+def update_circle_search_index_for_interest(sender, instance, raw=False, **kwargs):
+    """
+    サークルの興味関心の追加時に検索インデックスを更新する
+    """
+    if raw:
+        return
+    reindex_circle(instance.circle)
+
+@receiver(m2m_changed, sender=Circle.interests.through)
+def update_circle_search_index_for_interests(sender, instance, action, reverse, pk_set=None, **kwargs):
+    """
+    Circle.interests の add/remove/clear 時に検索インデックスを更新する
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    circles = Circle.objects.filter(pk__in=pk_set or []) if reverse else [instance]
+    for circle in circles:
+        reindex_circle(circle)
+
+@receiver(post_save, sender=Circle)
+def update_circle_autocomplete(sender, instance, raw=False, **kwargs):
+    """
+    サークルの保存をこのワーカーのオートコンプリートに反映する
+    """
+    if not raw:
+        circle_autocomplete.note_circle(instance)
+
+@receiver(post_delete, sender=Circle)
+def remove_circle_autocomplete(sender, instance, **kwargs):
+    circle_autocomplete.forget_circle(instance.pk)
+
+@receiver(post_save, sender=InterestTag)
+def update_tag_autocomplete(sender, instance, raw=False, **kwargs):
+    """
+    興味関心タグの保存をこのワーカーのオートコンプリートに反映する
+    """
+    if not raw:
+        circle_autocomplete.note_tag(instance)
+
+@receiver(post_delete, sender=InterestTag)
+def remove_tag_autocomplete(sender, instance, **kwargs):
+    circle_autocomplete.forget_tag(instance.pk)
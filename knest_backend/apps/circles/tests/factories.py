@@ -0,0 +1,50 @@
+import factory
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from ..models import Category, Circle, CircleMembership, CircleChat
+
+User = get_user_model()
+
+class UserFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = User
+
+    username = factory.Sequence(lambda n: f'testuser{n}')
+    email = factory.LazyAttribute(lambda obj: f'{obj.username}@example.com')
+    display_name = factory.LazyAttribute(lambda obj: obj.username)
+    password = factory.PostGenerationMethodCall('set_password', 'testpass123')
+
+class CategoryFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Category
+
+    name = factory.Sequence(lambda n: f'カテゴリー {n}')
+
+class CircleFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = Circle
+
+    name = factory.Sequence(lambda n: f'テストサークル {n}')
+    description = 'テストサークルの説明'
+    creator = factory.SubFactory(UserFactory)
+    owner = factory.SelfAttribute('creator')
+    circle_type = 'public'
+    status = 'open'
+
+class CircleMembershipFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = CircleMembership
+
+    user = factory.SubFactory(UserFactory)
+    circle = factory.SubFactory(CircleFactory)
+    status = 'active'
+    role = 'member'
+    joined_at = factory.LazyFunction(timezone.now)
+
+class CircleChatFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = CircleChat
+
+    circle = factory.SubFactory(CircleFactory)
+    sender = factory.SubFactory(UserFactory)
+    content = factory.Sequence(lambda n: f'テストメッセージ {n}')
@@ -0,0 +1,136 @@
+import threading
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from knest_backend.apps.interests.models import InterestCategory, InterestSubcategory, InterestTag
+from ..autocomplete import PrefixIndex, circle_autocomplete
+from ..models import Circle
+from .factories import UserFactory, CircleFactory
+
+
+class PrefixIndexTests(TestCase):
+    def test_lookup_orders_by_weight(self):
+        """前方一致した項目を重みの大きい順に返すことをテスト"""
+        index = PrefixIndex()
+        index.load([
+            ('1', '写真部', 3),
+            ('2', '写真愛好会', 10),
+            ('3', '料理部', 50),
+        ])
+        self.assertEqual([item[0] for item in index.lookup('写真', 10)], ['2', '1'])
+        self.assertEqual([item[0] for item in index.lookup('写真', 1)], ['2'])
+        self.assertEqual(index.lookup('ギター', 10), [])
+
+    def test_lookup_matches_later_words_and_normalizes(self):
+        """2語目以降の先頭からの一致と全角・大文字の正規化をテスト"""
+        index = PrefixIndex()
+        index.load([('1', '東京 Ｒｕｎｎｉｎｇ Club', 1)])
+        self.assertEqual(len(index.lookup('run', 10)), 1)
+        self.assertEqual(len(index.lookup('running c', 10)), 1)
+        self.assertEqual(index.lookup('unning', 10), [])
+
+    def test_upsert_and_remove(self):
+        """項目の追加・名前の変更・削除が反映されることをテスト"""
+        index = PrefixIndex()
+        index.upsert('1', 'テニス部', 1)
+        index.upsert('1', 'バドミントン部', 1)
+        self.assertEqual(index.lookup('テニス', 10), [])
+        self.assertEqual(index.lookup('バド', 10), [('1', 'バドミントン部', 1)])
+
+        index.remove('1')
+        self.assertEqual(index.lookup('バド', 10), [])
+        self.assertEqual(len(index), 0)
+
+
+class CircleAutocompleteViewTests(APITestCase):
+    def setUp(self):
+        circle_autocomplete.clear()
+        self.addCleanup(circle_autocomplete.clear)
+        self.user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+        category = InterestCategory.objects.create(name='趣味', type='hobby')
+        self.subcategory = InterestSubcategory.objects.create(category=category, name='アウトドア')
+        self.url = reverse('circle-autocomplete')
+
+    def test_autocomplete_circles_and_interests(self):
+        """サークル名・タグ名の候補をひらがなの入力でも返し、非公開サークルを除くことをテスト"""
+        popular = CircleFactory(name='キャンプ同好会', member_count=8)
+        small = CircleFactory(name='キャンプ初心者の会', member_count=2)
+        CircleFactory(name='キャンプ秘密基地', is_private=True)
+        tag = InterestTag.objects.create(subcategory=self.subcategory, name='キャンプ', usage_count=5)
+
+        response = self.client.get(self.url, {'q': 'きゃん'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in response.data['circles']],
+            [str(popular.id), str(small.id)]
+        )
+        self.assertEqual(response.data['interests'], [
+            {'id': str(tag.id), 'name': 'キャンプ', 'usage_count': 5}
+        ])
+
+    def test_saves_are_reflected_immediately(self):
+        """構築後のサークル・タグの保存と削除が即時に反映されることをテスト"""
+        circle = CircleFactory(name='登山部')
+        self.client.get(self.url, {'q': '登山'})
+        self.assertTrue(circle_autocomplete.loaded)
+
+        created = CircleFactory(name='登山サークル', member_count=5)
+        InterestTag.objects.create(subcategory=self.subcategory, name='登山', usage_count=1)
+        circle.delete()
+
+        response = self.client.get(self.url, {'q': '登山'})
+        self.assertEqual([item['id'] for item in response.data['circles']], [str(created.id)])
+        self.assertEqual([item['name'] for item in response.data['interests']], ['登山'])
+
+    def test_refresh_picks_up_other_workers_updates(self):
+        """他のワーカーで更新されたサークルを差分取り込みで反映することをテスト"""
+        circle = CircleFactory(name='釣り部')
+        circle_autocomplete.rebuild()
+
+        # シグナルを経由しない更新（他のワーカーでの保存に相当）
+        Circle.objects.filter(pk=circle.pk).update(name='渓流釣り部', updated_at=timezone.now())
+        circle_autocomplete.refresh()
+
+        response = self.client.get(self.url, {'q': '渓流'})
+        self.assertEqual([item['id'] for item in response.data['circles']], [str(circle.id)])
+
+    def test_periodic_rebuild_runs_in_background(self):
+        """定期的な再構築が問い合わせをブロックせず、構築中も現在のインデックスで応答することをテスト"""
+        circle = CircleFactory(name='写真部')
+        circle_autocomplete.rebuild()
+
+        release = threading.Event()
+        with mock.patch.object(
+            circle_autocomplete, 'rebuild', side_effect=lambda: release.wait(5)
+        ) as rebuild, override_settings(CIRCLE_AUTOCOMPLETE_REBUILD_INTERVAL=0):
+            response = self.client.get(self.url, {'q': '写真'})
+            rebuilder = circle_autocomplete._rebuilder
+            self.assertIsNotNone(rebuilder)
+            release.set()
+            rebuilder.join(5)
+
+        self.assertEqual([item['id'] for item in response.data['circles']], [str(circle.id)])
+        rebuild.assert_called_once_with()
+        self.assertIsNone(circle_autocomplete._rebuilder)
+
+    def test_changes_during_rebuild_survive_the_swap(self):
+        """再構築中のシグナルによる変更が差し替え後のインデックスに残ることをテスト"""
+        deleted = CircleFactory(name='将棋部')
+        kept = CircleFactory(name='将棋研究会')
+        load = PrefixIndex.load
+
+        def load_then_delete(index, rows):
+            load(index, rows)
+            if Circle.objects.filter(pk=deleted.pk).exists():
+                deleted.delete()
+
+        with mock.patch.object(PrefixIndex, 'load', autospec=True, side_effect=load_then_delete):
+            circle_autocomplete.rebuild()
+
+        response = self.client.get(self.url, {'q': '将棋'})
+        self.assertEqual([item['id'] for item in response.data['circles']], [str(kept.id)])
@@ -0,0 +1,130 @@
+from datetime import timedelta
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from ..chat_archive import archive_messages, decode_payload
+from ..chat_history import chat_tail
+from ..models import CircleChat, CircleChatArchive
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+
+
+class ChatArchiveTests(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+        CircleMembershipFactory(user=self.user, circle=self.circle)
+        self.client.force_authenticate(user=self.user)
+        chat_tail.invalidate(self.circle.id)
+
+        now = timezone.now()
+        for i in range(60):
+            message = CircleChat.objects.create(
+                circle=self.circle,
+                sender=self.user,
+                content=f'メッセージ {i}'
+            )
+            # 前半30件は100日前、後半30件は直近
+            created_at = now - timedelta(days=100, minutes=60 - i) if i < 30 else now - timedelta(minutes=60 - i)
+            CircleChat.objects.filter(pk=message.pk).update(created_at=created_at)
+
+        self.referenced = CircleChat.objects.get(content='メッセージ 5')
+        CircleChat.objects.filter(content='メッセージ 40').update(reply_to=self.referenced)
+        self.expected = [f'メッセージ {i}' for i in range(60)]
+
+    def test_archive_moves_old_messages(self):
+        """古いメッセージが圧縮アーカイブへ移ることをテスト"""
+        self.assertEqual(archive_messages(older_than_days=90), 29)
+
+        # 直近のメッセージから返信されているものは残る
+        self.assertEqual(CircleChat.objects.filter(circle=self.circle).count(), 31)
+        self.assertTrue(CircleChat.objects.filter(pk=self.referenced.pk).exists())
+        self.assertEqual(
+            sum(CircleChatArchive.objects.values_list('message_count', flat=True)),
+            29
+        )
+
+        # 再実行しても重複しない
+        self.assertEqual(archive_messages(older_than_days=90), 0)
+
+    def test_history_spans_hot_and_archived_messages(self):
+        """履歴取得が直近テーブルとアーカイブを横断することをテスト"""
+        archive_messages(older_than_days=90)
+
+        url = reverse('circle-chat-list')
+        response = self.client.get(url, {'circle': self.circle.id})
+        latest = [message['content'] for message in response.data['results']]
+        response = self.client.get(response.data['previous'])
+        older = [message['content'] for message in response.data['results']]
+
+        self.assertEqual(older + latest, self.expected)
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [message['content'] for message in response.data['results']],
+            self.expected[10:]
+        )
+
+    def test_reply_keeps_parent_across_batches(self):
+        """返信先と返信が別のバッチになっても、アーカイブした返信に返信先が残ることをテスト"""
+        circle = CircleFactory()
+        old = timezone.now() - timedelta(days=100)
+        parent, filler, reply = [
+            CircleChat.objects.create(circle=circle, sender=self.user, content=content)
+            for content in ('返信先', 'その他', '返信')
+        ]
+        CircleChat.objects.filter(pk=reply.pk).update(reply_to=parent)
+        for minutes, message in enumerate((parent, filler, reply)):
+            CircleChat.objects.filter(pk=message.pk).update(created_at=old + timedelta(minutes=minutes))
+
+        archive_messages(older_than_days=90, batch_size=2)
+
+        self.assertFalse(CircleChat.objects.filter(circle=circle).exists())
+        archived = {
+            data['content']: data
+            for data in decode_payload(CircleChatArchive.objects.get(circle=circle).payload)
+        }
+        self.assertEqual(len(archived), 3)
+        self.assertEqual(archived['返信']['reply_to']['id'], str(parent.id))
+
+    def test_reply_chain_to_recent_message_is_not_duplicated(self):
+        """直近の返信が残る返信の返信先はアーカイブせず、履歴で重複しないことをテスト"""
+        circle = CircleFactory()
+        CircleMembershipFactory(user=self.user, circle=circle)
+        old = timezone.now() - timedelta(days=100)
+        first, second, recent = [
+            CircleChat.objects.create(circle=circle, sender=self.user, content=content)
+            for content in ('A', 'B', 'C')
+        ]
+        CircleChat.objects.filter(pk=first.pk).update(created_at=old)
+        CircleChat.objects.filter(pk=second.pk).update(created_at=old + timedelta(minutes=1), reply_to=first)
+        CircleChat.objects.filter(pk=recent.pk).update(reply_to=second)
+        chat_tail.invalidate(circle.id)
+
+        archive_messages(older_than_days=90)
+
+        self.assertEqual(CircleChat.objects.filter(circle=circle).count(), 3)
+        self.assertFalse(CircleChatArchive.objects.filter(circle=circle).exists())
+        response = self.client.get(reverse('circle-chat-list'), {'circle': circle.id})
+        self.assertEqual([message['content'] for message in response.data['results']], ['A', 'B', 'C'])
+
+    def test_history_skips_archived_copy_of_hot_message(self):
+        """直近テーブルとアーカイブの両方にあるメッセージを履歴で1件にまとめることをテスト"""
+        archive_messages(older_than_days=90)
+        data = [
+            data for data in decode_payload(CircleChatArchive.objects.get(circle=self.circle).payload)
+            if data['content'] == 'メッセージ 4'
+        ][0]
+        copy = CircleChat.objects.create(
+            id=data['id'], circle=self.circle, sender=self.user, content=data['content']
+        )
+        CircleChat.objects.filter(pk=copy.pk).update(created_at=data['created_at'])
+        chat_tail.invalidate(self.circle.id)
+
+        url = reverse('circle-chat-list')
+        response = self.client.get(url, {'circle': self.circle.id})
+        contents = [message['content'] for message in response.data['results']]
+        response = self.client.get(response.data['previous'])
+        contents = [message['content'] for message in response.data['results']] + contents
+
+        self.assertEqual(contents, self.expected)
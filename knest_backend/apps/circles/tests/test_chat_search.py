@@ -0,0 +1,89 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from ..chat_search import rebuild_index, search_messages, tokenize
+from ..models import CircleChat, CircleChatSearchToken
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory, CircleChatFactory
+
+
+class ChatSearchIndexTests(TestCase):
+    def setUp(self):
+        self.circle = CircleFactory()
+        self.sender = UserFactory()
+
+    def _message(self, content, circle=None):
+        return CircleChat.objects.create(circle=circle or self.circle, sender=self.sender, content=content)
+
+    def test_tokenize_normalizes_and_splits_bigrams(self):
+        """全角・大文字を正規化してbi-gramに分割することをテスト"""
+        self.assertEqual(tokenize('ＡＢc 犬'), {'ab', 'bc', '犬'})
+
+    def test_search_matches_japanese_substrings(self):
+        """日本語の部分一致と語順の異なる誤検出の除外をテスト"""
+        match = self._message('明日の勉強会は図書館で開催します')
+        self._message('館書図で会強勉')
+        self._message('勉強会', circle=CircleFactory())
+
+        results, has_more = search_messages(self.circle.id, '勉強会 図書館')
+        self.assertEqual(results, [match])
+        self.assertFalse(has_more)
+
+    def test_index_follows_edits_and_deletes(self):
+        """編集・削除時にインデックスが更新されることをテスト"""
+        message = self._message('ランチに行こう')
+        message.content = 'ディナーに行こう'
+        message.save()
+        self.assertEqual(search_messages(self.circle.id, 'ランチ')[0], [])
+        self.assertEqual(search_messages(self.circle.id, 'ディナー')[0], [message])
+
+        message.delete()
+        self.assertFalse(CircleChatSearchToken.objects.exists())
+
+    def test_rebuild_index(self):
+        """既存メッセージのインデックス再構築をテスト"""
+        message = self._message('再構築テスト')
+        CircleChatSearchToken.objects.all().delete()
+
+        self.assertEqual(rebuild_index(), 1)
+        self.assertEqual(search_messages(self.circle.id, '構築')[0], [message])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class ChatSearchViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+        CircleMembershipFactory(user=self.user, circle=self.circle)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('circle-chat-search')
+
+    @override_settings(CHAT_SEARCH_PAGE_SIZE=2)
+    def test_search_pages_through_matches(self):
+        """検索結果を新しい順にページングできることをテスト"""
+        for i in range(3):
+            CircleChatFactory(circle=self.circle, sender=self.user, content=f'検索対象 {i}')
+        CircleChatFactory(circle=self.circle, sender=self.user, content='関係ない')
+
+        response = self.client.get(self.url, {'circle': self.circle.id, 'q': '検索'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['has_more'])
+        self.assertEqual(len(response.data['results']), 2)
+
+        response = self.client.get(self.url, {
+            'circle': self.circle.id,
+            'q': '検索',
+            'before': response.data['results'][-1]['id'],
+        })
+        self.assertFalse(response.data['has_more'])
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_non_member_cannot_search(self):
+        """メンバー以外は検索できないことをテスト"""
+        other = CircleFactory()
+        response = self.client.get(self.url, {'circle': other.id, 'q': '検索'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,229 @@
+from datetime import timedelta
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework import status
+from ..chat_history import chat_tail
+from ..chat_archive import archive_boundary, archive_messages
+from ..membership_cache import get_active_circle_ids
+from ..models import CircleChat, CircleChatRead
+from ..read_status import ReadWatermarkAggregator
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class CircleChatHistoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+        CircleMembershipFactory(user=self.user, circle=self.circle)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('circle-chat-list')
+        chat_tail.invalidate(self.circle.id)
+
+        # 同一時刻のメッセージを含めて60件作成
+        base = timezone.now() - timedelta(hours=1)
+        self.messages = []
+        for i in range(60):
+            message = CircleChat.objects.create(
+                circle=self.circle,
+                sender=self.user,
+                content=f'メッセージ {i}'
+            )
+            CircleChat.objects.filter(pk=message.pk).update(
+                created_at=base + timedelta(seconds=i // 2)
+            )
+            self.messages.append(message)
+
+    def _ids(self, response):
+        return [str(message['id']) for message in response.data['results']]
+
+    def _expected_ids(self):
+        return [
+            str(pk) for pk in CircleChat.objects.filter(
+                circle=self.circle
+            ).order_by('created_at', 'id').values_list('id', flat=True)
+        ]
+
+    def test_latest_page_and_previous_pages(self):
+        """最新ページから古いページへ重複なく辿れることをテスト"""
+        expected = self._expected_ids()
+
+        response = self.client.get(self.url, {'circle': self.circle.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._ids(response), expected[-50:])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self._ids(response), expected[:10])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self._ids(response), expected[10:60])
+
+    def test_latest_page_is_served_from_tail_cache(self):
+        """最新ページは末尾キャッシュから返され、新規メッセージが反映されることをテスト"""
+        self.client.get(self.url, {'circle': self.circle.id})
+        self.assertIsNotNone(chat_tail.get(self.circle.id))
+
+        response = self.client.post(self.url, {
+            'circle': self.circle.id,
+            'content': '新しいメッセージ',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # 既読情報の取得のみでメッセージ本体は問い合わせない
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'circle': self.circle.id})
+        results = response.data['results']
+        self.assertEqual(len(results), 50)
+        self.assertEqual(results[-1]['content'], '新しいメッセージ')
+
+    def test_history_fetch_defers_read_status(self):
+        """履歴の取得による既読はリクエスト中に書き込まず、定期反映でDBへ書き込むことをテスト"""
+        read_watermarks = ReadWatermarkAggregator()
+        with patch('knest_backend.apps.circles.views.read_watermarks', read_watermarks):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.get(self.url, {'circle': self.circle.id})
+        self.assertFalse(CircleChatRead.objects.filter(user=self.user, circle=self.circle).exists())
+
+        read_watermarks.flush()
+        self.assertTrue(CircleChatRead.objects.filter(user=self.user, circle=self.circle).exists())
+
+    def test_invalid_cursor(self):
+        """不正なカーソルは404になることをテスト"""
+        response = self.client.get(self.url, {'circle': self.circle.id, 'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class ChatSyncTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.other = UserFactory()
+        self.circle = CircleFactory()
+        self.other_circle = CircleFactory()
+        for circle in (self.circle, self.other_circle):
+            CircleMembershipFactory(user=self.user, circle=circle)
+            CircleMembershipFactory(user=self.other, circle=circle)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('circle-chat-sync')
+
+    def test_sync_returns_only_changes_since_last_seen(self):
+        """最終受信メッセージ以降の差分のみ返されることをテスト"""
+        edited = CircleChat.objects.create(circle=self.circle, sender=self.other, content='編集前')
+        seen = CircleChat.objects.create(circle=self.circle, sender=self.other, content='受信済み')
+        seen_other = CircleChat.objects.create(circle=self.other_circle, sender=self.other, content='別サークル')
+        since = timezone.now()
+
+        CircleChat.objects.filter(pk=edited.pk).update(
+            content='編集後', is_edited=True, updated_at=timezone.now()
+        )
+        new = CircleChat.objects.create(circle=self.circle, sender=self.other, content='新着')
+        CircleChat.objects.filter(pk=new.pk).update(created_at=timezone.now() + timedelta(seconds=1))
+
+        response = self.client.post(self.url, {
+            'circles': {
+                str(self.circle.id): str(seen.id),
+                str(self.other_circle.id): str(seen_other.id),
+            },
+            'since': since.isoformat(),
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        circles = response.data['circles']
+        self.assertEqual(list(circles), [str(self.circle.id)])
+        delta = circles[str(self.circle.id)]
+        self.assertEqual([m['content'] for m in delta['messages']], ['新着'])
+        self.assertEqual([m['content'] for m in delta['edited']], ['編集後'])
+        self.assertFalse(delta['has_more'])
+
+    def test_sync_limits_messages_per_circle(self):
+        """新着が上限を超える場合はhas_moreが立つことをテスト"""
+        for i in range(5):
+            CircleChat.objects.create(circle=self.circle, sender=self.other, content=f'メッセージ {i}')
+
+        with self.settings(CHAT_SYNC_MAX_MESSAGES_PER_CIRCLE=3):
+            response = self.client.post(self.url, {}, format='json')
+
+        delta = response.data['circles'][str(self.circle.id)]
+        self.assertTrue(delta['has_more'])
+        self.assertEqual(len(delta['messages']), 3)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class ChatSummaryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory(date_joined=timezone.now() - timedelta(days=1))
+        self.other = UserFactory()
+        self.circles = [CircleFactory() for _ in range(3)]
+        for circle in self.circles:
+            CircleMembershipFactory(user=self.user, circle=circle)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('circle-chat-summary')
+
+    def test_summary_for_all_circles_in_constant_queries(self):
+        """全サークルのサマリーをサークル数によらない件数のクエリで返すことをテスト"""
+        base = timezone.now() - timedelta(minutes=10)
+        quiet, busy, empty = self.circles
+        for i, circle in enumerate((quiet, busy, busy, busy)):
+            message = CircleChat.objects.create(circle=circle, sender=self.other, content=f'メッセージ {i}')
+            CircleChat.objects.filter(pk=message.pk).update(created_at=base + timedelta(minutes=i))
+        CircleChat.objects.create(circle=busy, sender=self.user, content='自分の発言')
+        CircleChatRead.objects.create(user=self.user, circle=busy)
+        CircleChatRead.objects.filter(user=self.user, circle=busy).update(
+            last_read=base + timedelta(minutes=1, seconds=30)
+        )
+
+        # メンバーシップとアーカイブ境界はキャッシュ済みの状態で計測する
+        get_active_circle_ids(self.user.id)
+        archive_boundary(empty.id)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['circle'] for r in results], [str(busy.id), str(quiet.id), str(empty.id)])
+        self.assertEqual(results[0]['last_message']['content'], '自分の発言')
+        self.assertEqual(results[0]['unread_count'], 2)
+        self.assertEqual(results[1]['unread_count'], 1)
+        self.assertIsNone(results[2]['last_message'])
+        self.assertEqual(results[2]['unread_count'], 0)
+
+    def test_archived_only_circles_in_constant_queries(self):
+        """直近のメッセージがすべてアーカイブ済みのサークルの最新メッセージをまとめて取得することをテスト"""
+        now = timezone.now()
+        hot, *archived_only = self.circles
+        CircleChat.objects.create(circle=hot, sender=self.other, content='直近')
+        for i, circle in enumerate(archived_only):
+            for days in (130, 100 + i):
+                message = CircleChat.objects.create(circle=circle, sender=self.other, content=f'{days}日前')
+                CircleChat.objects.filter(pk=message.pk).update(created_at=now - timedelta(days=days))
+        self.assertEqual(archive_messages(older_than_days=90), 4)
+
+        get_active_circle_ids(self.user.id)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+
+        results = response.data['results']
+        self.assertEqual(
+            [(r['circle'], r['last_message']['content']) for r in results],
+            [
+                (str(hot.id), '直近'),
+                (str(archived_only[0].id), '100日前'),
+                (str(archived_only[1].id), '101日前'),
+            ]
+        )
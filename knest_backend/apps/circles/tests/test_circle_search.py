@@ -0,0 +1,167 @@
+from unittest.mock import patch
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from knest_backend.apps.interests.models import InterestCategory, InterestSubcategory, InterestTag
+from ..circle_search import ranked_matches, rebuild_index, search_circles
+from ..models import Circle, CircleInterest, CircleSearchToken
+from .factories import UserFactory, CircleFactory
+
+
+def _interest(name):
+    category = InterestCategory.objects.create(name=f'{name}カテゴリ', type='hobby')
+    subcategory = InterestSubcategory.objects.create(category=category, name=f'{name}サブカテゴリ')
+    return InterestTag.objects.create(subcategory=subcategory, name=name)
+
+
+class CircleSearchIndexTests(TestCase):
+    def _search(self, query):
+        return list(search_circles(Circle.objects.all(), query).order_by('-search_rank', 'name'))
+
+    def test_search_matches_all_fields(self):
+        """サークル名・説明・タグ・興味関心のいずれでも検索できることをテスト"""
+        by_name = CircleFactory(name='写真部', description='')
+        by_description = CircleFactory(name='A', description='週末に写真を撮りに行きます')
+        by_tag = CircleFactory(name='B', description='', tags=['写真', 'カメラ'])
+        by_interest = CircleFactory(name='C', description='')
+        CircleInterest.objects.create(circle=by_interest, interest=_interest('写真撮影'))
+        CircleFactory(name='料理部', description='')
+
+        self.assertEqual(
+            set(self._search('写真')),
+            {by_name, by_description, by_tag, by_interest}
+        )
+
+    def test_search_ranks_name_matches_first(self):
+        """サークル名での一致が説明での一致より上位になることをテスト"""
+        by_description = CircleFactory(name='A', description='ボードゲームで遊ぶ会')
+        by_name = CircleFactory(name='ボードゲーム部', description='')
+
+        self.assertEqual(self._search('ボードゲーム'), [by_name, by_description])
+
+    def test_search_requires_all_words(self):
+        """複数の検索語はすべてに一致するサークルのみ返すことをテスト"""
+        match = CircleFactory(name='東京 ランニング', description='')
+        CircleFactory(name='大阪 ランニング', description='')
+
+        self.assertEqual(self._search('ランニング 東京'), [match])
+
+    def test_search_excludes_scattered_bigrams(self):
+        """検索語のbi-gramをすべて含んでいても、検索語そのものを含まないサークルは返さないことをテスト"""
+        match = CircleFactory(name='テスト勉強会', description='')
+        CircleFactory(name='ストーリー研究会', description='テスラ好き')
+        CircleFactory(name='A', description='', tags=['テス', 'スト'])
+
+        self.assertEqual(self._search('テスト'), [match])
+
+    @override_settings(CIRCLE_SEARCH_MAX_CANDIDATES=2)
+    def test_search_ranks_limited_candidates(self):
+        """照合する候補を関連度の高い順に上限まで絞ることをテスト"""
+        by_name = CircleFactory(name='ヨガ', description='')
+        by_tag = CircleFactory(name='A', description='', tags=['ヨガ'])
+        CircleFactory(name='B', description='朝のヨガ')
+
+        self.assertEqual(self._search('ヨガ'), [by_name, by_tag])
+
+    @override_settings(CIRCLE_SEARCH_MAX_CANDIDATES=1)
+    def test_limited_candidates_are_ranked_by_all_tokens(self):
+        """候補の上限は出現数の少ないトークンの重みではなく、一致した全トークンの関連度で選ぶことをテスト"""
+        # 「ガ部」の重みはbの方が大きいが、全トークンの関連度はaの方が高い
+        a = CircleFactory(name='ヨガ部', description='ヨガ')
+        b = CircleFactory(name='ガ部', description='', tags=['ヨガ部'])
+        CircleFactory(name='ヨガ', description='')
+
+        self.assertEqual(self._search('ヨガ部'), [a])
+        self.assertTrue(ranked_matches('ヨガ部').truncated)
+        with override_settings(CIRCLE_SEARCH_MAX_CANDIDATES=2):
+            self.assertEqual(self._search('ヨガ部'), [a, b])
+            self.assertFalse(ranked_matches('ヨガ部').truncated)
+
+    @patch('knest_backend.apps.circles.circle_search.SEEK_COST', 0)
+    def test_search_narrowed_by_rarest_token(self):
+        """出現数の少ないトークンで候補を絞り込んでも結果が変わらないことをテスト"""
+        match = CircleFactory(name='東京 ランニング', description='')
+        CircleFactory(name='大阪 ランニング', description='')
+        CircleFactory(name='東京 ウォーキング', description='')
+
+        self.assertEqual(self._search('ランニング 東京'), [match])
+
+    def test_index_follows_updates(self):
+        """サークルの更新時にインデックスが更新されることをテスト"""
+        circle = CircleFactory(name='テニス', description='')
+        circle.name = 'バドミントン'
+        circle.save()
+        self.assertEqual(self._search('テニス'), [])
+        self.assertEqual(self._search('バドミントン'), [circle])
+
+        interest = _interest('卓球')
+        circle.interests.add(interest)
+        self.assertEqual(self._search('卓球'), [circle])
+        circle.interests.remove(interest)
+        self.assertEqual(self._search('卓球'), [])
+
+    def test_unrelated_update_does_not_touch_index(self):
+        """メンバー数のみの更新ではインデックスを書き込まないことをテスト"""
+        circle = CircleFactory(name='読書会', description='')
+        tokens = list(CircleSearchToken.objects.filter(circle=circle).values_list('id', flat=True))
+
+        circle.member_count = 3
+        circle.save(update_fields=['member_count'])
+        circle.save()
+        self.assertEqual(
+            list(CircleSearchToken.objects.filter(circle=circle).values_list('id', flat=True)),
+            tokens
+        )
+
+    def test_rebuild_index(self):
+        """既存サークルのインデックス再構築をテスト"""
+        circle = CircleFactory(name='再構築サークル', description='')
+        CircleSearchToken.objects.all().delete()
+
+        self.assertEqual(rebuild_index(), 1)
+        self.assertEqual(self._search('構築'), [circle])
+
+
+class CircleSearchViewTests(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+
+    def test_list_search_orders_by_relevance(self):
+        """一覧の検索が関連度順になり、orderingの指定を優先することをテスト"""
+        by_description = CircleFactory(name='A', description='ギターを弾く')
+        by_name = CircleFactory(name='ギター同好会', description='')
+        CircleFactory(name='ピアノ同好会', description='')
+        url = reverse('circle-list')
+
+        response = self.client.get(url, {'search': 'ギター'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [str(by_name.id), str(by_description.id)]
+        )
+
+        response = self.client.get(url, {'search': 'ギター', 'ordering': 'created_at'})
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [str(by_description.id), str(by_name.id)]
+        )
+
+    @override_settings(CIRCLE_SEARCH_MAX_CANDIDATES=2)
+    def test_list_search_reports_truncation(self):
+        """照合する候補を上限で打ち切った場合に search_truncated で示すことをテスト"""
+        for name in ('ダンス部', 'ダンス同好会', 'ダンス愛好会'):
+            CircleFactory(name=name, description='')
+        url = reverse('circle-list')
+
+        response = self.client.get(url, {'search': 'ダンス'})
+        self.assertEqual(response.data['count'], 2)
+        self.assertTrue(response.data['search_truncated'])
+
+        response = self.client.get(url, {'search': 'ダンス部'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertFalse(response.data['search_truncated'])
+
+        response = self.client.get(url)
+        self.assertNotIn('search_truncated', response.data)
@@ -0,0 +1,169 @@
+import json
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from knest_backend.apps.interests.models import (
+    InterestCategory, InterestSubcategory, InterestTag, UserInterestProfile
+)
+from ..models import Circle
+from ..queries import with_list_data
+from .factories import UserFactory, CategoryFactory, CircleFactory, CircleMembershipFactory
+
+
+class CircleListQueryTests(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+        self.category = CategoryFactory()
+
+    def _create_circles(self, count):
+        circles = []
+        for _ in range(count):
+            circle = CircleFactory()
+            circle.categories.add(self.category)
+            CircleMembershipFactory(circle=circle)
+            CircleMembershipFactory(circle=circle, status='pending')
+            circles.append(circle)
+        return circles
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response
+
+    def test_list_query_count_does_not_grow_with_circles(self):
+        """サークル一覧のクエリ数がサークル数に比例しないことをテスト"""
+        url = reverse('circle-list')
+        circles = self._create_circles(2)
+        CircleMembershipFactory(user=self.user, circle=circles[0])
+        few, _ = self._count_queries(url)
+
+        self._create_circles(5)
+        many, response = self._count_queries(url)
+
+        self.assertEqual(few, many)
+        results = {item['id']: item for item in response.data['results']}
+        joined = results[str(circles[0].id)]
+        self.assertEqual(joined['member_count'], 2)
+        self.assertTrue(joined['is_member'])
+        self.assertEqual(joined['membership_status'], 'active')
+        other = results[str(circles[1].id)]
+        self.assertEqual(other['member_count'], 1)
+        self.assertFalse(other['is_member'])
+        self.assertIsNone(other['membership_status'])
+
+    def test_my_circles_query_count_does_not_grow_with_circles(self):
+        """参加中サークル一覧のクエリ数がサークル数に比例しないことをテスト"""
+        url = reverse('circle-my')
+        for circle in self._create_circles(1):
+            CircleMembershipFactory(user=self.user, circle=circle)
+        few, _ = self._count_queries(url)
+
+        for circle in self._create_circles(3):
+            CircleMembershipFactory(user=self.user, circle=circle)
+        many, response = self._count_queries(url)
+
+        self.assertEqual(few, many)
+        self.assertEqual(response.data['count'], 4)
+        self.assertTrue(all(item['is_member'] for item in response.data['results']))
+
+    def test_list_data_for_anonymous_user(self):
+        """未ログインの場合は参加状態をNoneとして注釈することをテスト"""
+        circle = self._create_circles(1)[0]
+        annotated = with_list_data(Circle.objects.filter(pk=circle.pk), AnonymousUser()).get()
+        self.assertEqual(annotated.member_count, 1)
+        self.assertIsNone(annotated.user_membership_status)
+
+
+class CircleMembersTests(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+        self.circle = CircleFactory(member_limit=100)
+        CircleMembershipFactory(circle=self.circle, user=self.user)
+        self.url = reverse('circle-members', args=[self.circle.id])
+        category = InterestCategory.objects.create(name='スポーツ', type='hobby')
+        subcategory = InterestSubcategory.objects.create(category=category, name='球技')
+        self.tag = InterestTag.objects.create(subcategory=subcategory, name='テニス')
+
+    def _add_members(self, count):
+        members = []
+        for membership in CircleMembershipFactory.create_batch(count, circle=self.circle):
+            UserInterestProfile.objects.create(
+                user=membership.user,
+                category=self.tag.subcategory.category,
+                subcategory=self.tag.subcategory,
+                tag=self.tag
+            )
+            members.append(membership)
+        return members
+
+    def test_members_are_paginated_by_cursor(self):
+        """参加日時の新しい順にカーソルでページ送りできることをテスト"""
+        self._add_members(4)
+        expected = list(
+            self.circle.memberships.filter(status='active').order_by('-joined_at', '-id').values_list('id', flat=True)
+        )
+
+        response = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        ids = [item['id'] for item in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, [str(pk) for pk in expected])
+
+    def test_members_include_interests_without_per_member_queries(self):
+        """興味関心をまとめて取得し、メンバー数によってクエリ数が増えないことをテスト"""
+        self._add_members(2)
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.get(self.url)
+        self._add_members(6)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        member = next(item for item in response.data['results'] if item['interests'])
+        self.assertEqual(member['interests'], [
+            {'id': str(self.tag.id), 'name': 'テニス', 'category': 'スポーツ'}
+        ])
+
+    def test_slim_members(self):
+        """fields=slimでは自己紹介・興味関心を返さないことをテスト"""
+        self._add_members(1)
+        response = self.client.get(self.url, {'fields': 'slim'})
+        item = response.data['results'][0]
+        self.assertNotIn('interests', item)
+        self.assertEqual(set(item['user']), {'id', 'username', 'displayName', 'profilePictureUrl'})
+
+
+class CircleDebugLogTests(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+        self.circle = CircleFactory(circle_type='public')
+
+    def test_no_debug_log_by_default(self):
+        """既定ではデバッグログを出力しないことをテスト"""
+        with self.assertNoLogs('knest_backend.apps.circles.debug_log'):
+            response = self.client.get(reverse('circle-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(CIRCLE_DEBUG_LOG_SAMPLE_RATES={'circles.join': 1.0})
+    def test_sampled_join_is_logged(self):
+        """サンプリングされたエンドポイントのみログを出力することをテスト"""
+        with self.assertLogs('knest_backend.apps.circles.debug_log', level='DEBUG') as logs:
+            self.client.get(reverse('circle-list'))
+            response = self.client.post(reverse('circle-join', args=[self.circle.id]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual([entry['endpoint'] for entry in entries], ['circles.join'])
+        self.assertEqual(entries[0]['event'], 'request')
+        self.assertEqual(entries[0]['circle'], str(self.circle.id))
@@ -0,0 +1,234 @@
+import json
+import msgpack
+from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase, override_settings
+from ..chat_protocol import COMPACT_SUBPROTOCOL, decode_broadcast_frame, decode_frame
+from ..routing import websocket_urlpatterns
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+
+
+class CircleChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+        CircleMembershipFactory(user=self.user, circle=self.circle)
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            f'/ws/circle/{self.circle.id}/chat/'
+        )
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    def test_non_member_is_rejected(self):
+        """メンバー以外は接続できないことをテスト"""
+        async def scenario():
+            communicator, connected = await self._connect(UserFactory.build())
+            await communicator.disconnect()
+            return connected
+
+        self.assertFalse(async_to_sync(scenario)())
+
+    def test_message_is_delivered_to_room(self):
+        """送信したメッセージがルームに配信されることをテスト"""
+        async def scenario():
+            communicator, connected = await self._connect(self.user)
+            self.assertTrue(connected)
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'message',
+                'content': 'こんにちは',
+            }))
+            while True:
+                frame = json.loads(await communicator.receive_from(timeout=5))
+                if frame['type'] == 'message':
+                    break
+            await communicator.disconnect()
+            return frame
+
+        frame = async_to_sync(scenario)()
+        self.assertEqual(frame['message']['content'], 'こんにちは')
+        self.assertEqual(frame['message']['sender']['id'], str(self.user.id))
+        self.assertEqual(self.circle.chats.count(), 1)
+
+
+class UserChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.circles = [CircleFactory(), CircleFactory()]
+        for circle in self.circles:
+            CircleMembershipFactory(user=self.user, circle=circle)
+        self.other_circle = CircleFactory()
+
+    async def _connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def _receive(self, communicator, frame_type):
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=5))
+            if frame['type'] == frame_type:
+                return frame
+
+    def test_messages_for_all_circles_share_one_connection(self):
+        """1本の接続で参加中の全サークルのメッセージを送受信できることをテスト"""
+        async def scenario():
+            communicator, connected = await self._connect(self.user)
+            self.assertTrue(connected)
+            frames = []
+            for circle in self.circles:
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'message',
+                    'circle': str(circle.id),
+                    'content': f'{circle.name}へ',
+                }))
+                frames.append(await self._receive(communicator, 'message'))
+            await communicator.disconnect()
+            return frames
+
+        frames = async_to_sync(scenario)()
+        self.assertEqual(
+            [frame['circle'] for frame in frames],
+            [str(circle.id) for circle in self.circles]
+        )
+        for circle in self.circles:
+            self.assertEqual(circle.chats.count(), 1)
+
+    def test_subscribe_and_unsubscribe(self):
+        """購読の変更とメンバー以外のサークルの購読拒否をテスト"""
+        circle_id = str(self.circles[0].id)
+
+        async def scenario():
+            communicator, _ = await self._connect(self.user)
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'subscribe',
+                'circle': str(self.other_circle.id),
+            }))
+            rejected = await self._receive(communicator, 'error')
+
+            await communicator.send_to(text_data=json.dumps({'type': 'unsubscribe', 'circle': circle_id}))
+            await self._receive(communicator, 'unsubscribed')
+            await communicator.send_to(text_data=json.dumps({
+                'type': 'message',
+                'circle': circle_id,
+                'content': '購読解除後',
+            }))
+            not_subscribed = await self._receive(communicator, 'error')
+            await communicator.disconnect()
+            return rejected, not_subscribed
+
+        rejected, not_subscribed = async_to_sync(scenario)()
+        self.assertEqual(rejected['error'], 'not_member')
+        self.assertEqual(not_subscribed['error'], 'not_subscribed')
+        self.assertEqual(self.circles[0].chats.count(), 0)
+
+
+    @override_settings(CHAT_RATE_LIMIT_CONNECTION_RATE=0.01, CHAT_RATE_LIMIT_CONNECTION_BURST=3)
+    def test_subscribe_flood_is_rate_limited(self):
+        """購読・購読解除の連打が接続単位のレート制限を受けることをテスト"""
+        circle_id = str(self.circles[0].id)
+
+        async def scenario():
+            communicator, _ = await self._connect(self.user)
+            for i in range(10):
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'unsubscribe' if i % 2 else 'subscribe',
+                    'circle': circle_id,
+                }))
+            frames = [json.loads(await communicator.receive_from(timeout=5)) for _ in range(10)]
+            await communicator.disconnect()
+            return frames
+
+        frames = async_to_sync(scenario)()
+        self.assertEqual(
+            [frame['type'] for frame in frames],
+            ['subscribed', 'unsubscribed', 'subscribed'] + ['error'] * 7
+        )
+        self.assertTrue(all(frame['error'] == 'rate_limited' for frame in frames[3:]))
+        self.assertEqual({frame['circle'] for frame in frames}, {circle_id})
+
+
+class CompactProtocolTests(TransactionTestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+        CircleMembershipFactory(user=self.user, circle=self.circle)
+
+    def test_sender_profile_is_sent_once_per_session(self):
+        """コンパクト形式では送信者情報が1回だけ送られ、以降は参照番号になることをテスト"""
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns),
+                f'/ws/circle/{self.circle.id}/chat/',
+                subprotocols=[COMPACT_SUBPROTOCOL]
+            )
+            communicator.scope['user'] = self.user
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, COMPACT_SUBPROTOCOL)
+
+            frames = []
+            for content in ('1件目', '2件目'):
+                await communicator.send_to(bytes_data=msgpack.packb({
+                    'type': 'message',
+                    'content': content,
+                }))
+                while True:
+                    frame = msgpack.unpackb(await communicator.receive_from(timeout=5))
+                    frames.append(frame)
+                    if frame['type'] == 'message':
+                        break
+            await communicator.disconnect()
+            return frames
+
+        frames = async_to_sync(scenario)()
+        profiles = [frame for frame in frames if frame['type'] == 'profile']
+        messages = [frame for frame in frames if frame['type'] == 'message']
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]['user']['id'], str(self.user.id))
+        self.assertEqual(
+            [message['message']['sender'] for message in messages],
+            [profiles[0]['ref']] * 2
+        )
+        self.assertEqual([message['message']['content'] for message in messages], ['1件目', '2件目'])
+
+    def test_broadcast_is_decoded_once_per_worker(self):
+        """同じワーカーのコンパクト形式の受信者でフレームの復元を共有することをテスト"""
+        other = UserFactory()
+        CircleMembershipFactory(user=other, circle=self.circle)
+
+        async def scenario():
+            communicators = []
+            for user in (self.user, other):
+                communicator = WebsocketCommunicator(
+                    URLRouter(websocket_urlpatterns),
+                    f'/ws/circle/{self.circle.id}/chat/',
+                    subprotocols=[COMPACT_SUBPROTOCOL]
+                )
+                communicator.scope['user'] = user
+                await communicator.connect()
+                communicators.append(communicator)
+
+            await communicators[0].send_to(bytes_data=msgpack.packb({'type': 'message', 'content': '共有'}))
+            received = []
+            for communicator in communicators:
+                while True:
+                    frame = msgpack.unpackb(await communicator.receive_from(timeout=5))
+                    if frame['type'] == 'message':
+                        received.append(frame['message']['content'])
+                        break
+            for communicator in communicators:
+                await communicator.disconnect()
+            return received
+
+        decode_broadcast_frame.cache_clear()
+        with patch('knest_backend.apps.circles.chat_protocol.decode_frame', wraps=decode_frame) as decode:
+            received = async_to_sync(scenario)()
+        self.assertEqual(received, ['共有', '共有'])
+        self.assertEqual(decode.call_count, 1)
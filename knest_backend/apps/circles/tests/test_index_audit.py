@@ -0,0 +1,86 @@
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from ..index_audit import PLAN_PREFIXES, audit_queries, candidate_columns, split_scopes
+from ..models import CircleMembership
+from .factories import CircleFactory, CircleMembershipFactory
+
+
+class CandidateColumnsTests(TestCase):
+    def test_aliases_and_conditions_are_scoped_per_select(self):
+        """サブクエリごとに使い直される別名を区別し、OR・NOTの条件は候補に含めないことをテスト"""
+        sql = (
+            'SELECT "circles_circle"."id", (SELECT U0."status" FROM "circles_circlemembership" U0 '
+            'WHERE (U0."circle_id" = ("circles_circle"."id") AND U0."user_id" = %s) LIMIT 1) AS "s" '
+            'FROM "circles_circle" WHERE "circles_circle"."id" IN (SELECT U0."circle_id" FROM '
+            '"circles_circlesearchtoken" U0 WHERE U0."token" IN (%s)) '
+            'ORDER BY "circles_circle"."last_activity" DESC LIMIT 20'
+        )
+        outer, membership, token = split_scopes(sql)
+        self.assertEqual(membership['aliases'], {'U0': 'circles_circlemembership'})
+        self.assertEqual(token['aliases'], {'U0': 'circles_circlesearchtoken'})
+        self.assertEqual(
+            candidate_columns(membership['sql'], 'U0', 'circles_circlemembership'),
+            (('circle_id', 'user_id'), ('circle_id', 'user_id'))
+        )
+        self.assertEqual(
+            candidate_columns(outer['sql'], 'circles_circle', 'circles_circle', sort=True),
+            (('id', 'last_activity'), ('id',))
+        )
+
+        sql = (
+            'SELECT "circles_circlechat"."id" FROM "circles_circlechat" WHERE '
+            '((("circles_circlechat"."circle_id" = %s AND "circles_circlechat"."created_at" > %s) OR '
+            '("circles_circlechat"."circle_id" = %s)) AND NOT ("circles_circlechat"."sender_id" = %s) '
+            'AND "circles_circlechat"."is_system_message" = %s)'
+        )
+        self.assertEqual(
+            candidate_columns(sql, 'circles_circlechat', 'circles_circlechat'),
+            (('is_system_message',), ('is_system_message',))
+        )
+
+
+class IndexAuditTests(TestCase):
+    def setUp(self):
+        if connection.vendor not in PLAN_PREFIXES:
+            self.skipTest('実行計画の取得に対応していないDB')
+        self.circle = CircleFactory()
+        self.members = CircleMembershipFactory.create_batch(3, circle=self.circle)
+
+    def test_membership_access_patterns_are_covered(self):
+        """(user, status)・(circle, status) の絞り込みとメンバー一覧の並び順が既存のインデックスで賄えることをテスト"""
+        user = self.members[0].user
+        with audit_queries() as audit, CaptureQueriesContext(connection) as context:
+            list(CircleMembership.objects.filter(user=user, status='active').values_list('circle_id', flat=True))
+            list(CircleMembership.objects.filter(circle=self.circle, status='active').order_by('-joined_at', '-id')[:2])
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertEqual(len(audit.queries), 2)
+        self.assertTrue(all(entry['plan'] for entry in audit.queries.values()))
+        self.assertEqual(audit.missing_indexes(), [])
+
+    def test_reports_unindexed_filter(self):
+        """インデックスのない列での絞り込みを既定の並び順の列と合わせて不足として報告し、同じSQLは1つにまとめることをテスト"""
+        with audit_queries() as audit:
+            for _ in range(2):
+                list(CircleMembership.objects.filter(application_message='よろしくお願いします'))
+
+        missing = audit.missing_indexes()
+        self.assertEqual(len(missing), 1)
+        self.assertEqual(
+            (missing[0]['table'], missing[0]['columns'], missing[0]['queries'], missing[0]['executions']),
+            ('circles_circlemembership', ['application_message', 'joined_at'], 1, 2)
+        )
+
+    def test_command_audits_management_command(self):
+        """--run で指定した管理コマンドのクエリを監査し、取り付けたラッパーを外すことをテスト"""
+        out = StringIO()
+        call_command('audit_indexes', run=['reconcile_member_counts'], stdout=out)
+        self.assertIn('修正したサークル: 0件', out.getvalue())
+        self.assertIn('不足しているインデックスはありません', out.getvalue())
+        self.assertEqual(connection.execute_wrappers, [])
+
+        with self.assertRaises(CommandError):
+            call_command('audit_indexes')
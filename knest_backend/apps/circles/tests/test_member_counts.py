@@ -0,0 +1,83 @@
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from ..member_counts import reconcile_member_counts
+from ..models import Circle, CircleMembership
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+
+
+class MemberCountTests(APITestCase):
+    def setUp(self):
+        self.owner = UserFactory()
+        self.user = UserFactory()
+
+    def _member_count(self, circle):
+        return Circle.objects.values_list('member_count', flat=True).get(pk=circle.pk)
+
+    def test_join_and_leave_update_member_count(self):
+        """公開サークルへの参加・退会でメンバー数が増減することをテスト"""
+        circle = CircleFactory(creator=self.owner)
+        CircleMembershipFactory(circle=circle, user=self.owner, role='owner')
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post(reverse('circle-join', args=[circle.pk]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._member_count(circle), 2)
+
+        response = self.client.post(reverse('circle-leave', args=[circle.pk]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self._member_count(circle), 1)
+
+    def test_only_approval_counts_for_requests(self):
+        """承認制サークルでは承認時のみ増え、申請・拒否・申請の取り下げでは変わらないことをテスト"""
+        circle = CircleFactory(creator=self.owner, circle_type='approval')
+        CircleMembershipFactory(circle=circle, user=self.owner, role='owner')
+        applicants = [UserFactory() for _ in range(3)]
+        for applicant in applicants:
+            self.client.force_authenticate(user=applicant)
+            self.client.post(reverse('circle-join', args=[circle.pk]))
+        self.assertEqual(self._member_count(circle), 1)
+
+        self.client.force_authenticate(user=self.owner)
+        url = reverse('circle-respond-to-request', args=[circle.pk])
+        approved, rejected, _ = [
+            CircleMembership.objects.get(circle=circle, user=applicant) for applicant in applicants
+        ]
+        for data in [
+            {'membership_id': approved.pk, 'action': 'approve'},
+            {'membership_id': rejected.pk, 'action': 'reject', 'rejection_reason': '定員のため'},
+        ]:
+            self.assertEqual(self.client.post(url, data).status_code, status.HTTP_200_OK)
+        self.assertEqual(self._member_count(circle), 2)
+
+        self.client.force_authenticate(user=applicants[2])
+        self.client.post(reverse('circle-leave', args=[circle.pk]))
+        self.assertEqual(self._member_count(circle), 2)
+
+    def test_list_and_filter_use_stored_member_count(self):
+        """一覧・並べ替えが保持しているメンバー数を参照することをテスト"""
+        small = CircleFactory()
+        large = CircleFactory()
+        CircleMembershipFactory.create_batch(3, circle=large)
+        CircleMembershipFactory(circle=small)
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('circle-list'), {'ordering': '-member_count'})
+        self.assertEqual(
+            [(item['id'], item['member_count']) for item in response.data['results']],
+            [(str(large.id), 3), (str(small.id), 1)]
+        )
+        response = self.client.get(reverse('circle-list'), {'min_members': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [str(large.id)])
+
+    def test_reconcile_member_counts(self):
+        """シグナルを経由しない変更によるずれを実数に合わせることをテスト"""
+        circle = CircleFactory()
+        CircleMembershipFactory.create_batch(2, circle=circle)
+        untouched = CircleFactory()
+        CircleMembership.objects.filter(circle=circle).update(status='pending')
+        Circle.objects.filter(pk=untouched.pk).update(member_count=0)
+
+        self.assertEqual(reconcile_member_counts(), 1)
+        self.assertEqual(self._member_count(circle), 0)
+        self.assertEqual(reconcile_member_counts(), 0)
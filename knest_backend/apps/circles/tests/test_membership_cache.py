@@ -0,0 +1,49 @@
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+from ..membership_cache import _cache_key, is_active_member
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+class MembershipCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+
+    def test_cached_membership_check_skips_db(self):
+        """2回目以降の認可チェックはDBに問い合わせないことをテスト"""
+        CircleMembershipFactory(user=self.user, circle=self.circle)
+        with self.assertNumQueries(1):
+            self.assertTrue(is_active_member(self.user.id, self.circle.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_active_member(self.user.id, str(self.circle.id)))
+
+    def test_membership_changes_invalidate_cache(self):
+        """メンバーシップの変更でキャッシュが破棄されることをテスト"""
+        self.assertFalse(is_active_member(self.user.id, self.circle.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            membership = CircleMembershipFactory(user=self.user, circle=self.circle, status='pending')
+        self.assertFalse(is_active_member(self.user.id, self.circle.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.status = 'active'
+            membership.save()
+        self.assertTrue(is_active_member(self.user.id, self.circle.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.delete()
+        self.assertFalse(is_active_member(self.user.id, self.circle.id))
+
+    def test_cache_is_invalidated_after_commit(self):
+        """コミット前に他のリクエストが変更前の状態をキャッシュしても、コミット後に破棄されることをテスト"""
+        membership = CircleMembershipFactory(user=self.user, circle=self.circle, status='pending')
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.status = 'active'
+            membership.save()
+            # コミット前に変更前の状態を読んだ他のリクエストによるキャッシュ
+            cache.set(_cache_key(self.user.id), frozenset())
+        self.assertTrue(is_active_member(self.user.id, self.circle.id))
@@ -0,0 +1,209 @@
+import json
+import threading
+from unittest.mock import patch
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from ..models import Circle, CircleMembership
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+from .test_realtime import RecordingChannelLayer
+
+
+class JoinCircleTests(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+
+    def _join(self, circle, user=None):
+        if user is not None:
+            self.client.force_authenticate(user=user)
+        return self.client.post(reverse('circle-join', args=[circle.pk]))
+
+    def test_join_rejects_full_circle_and_user_limit(self):
+        """定員・参加可能サークル数の上限に達している場合は参加できないことをテスト"""
+        full = CircleFactory(member_limit=2)
+        CircleMembershipFactory.create_batch(2, circle=full)
+        response = self._join(full)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['detail'], 'サークルのメンバー数が上限に達しています。')
+
+        for circle in CircleFactory.create_batch(2):
+            self.assertEqual(self._join(circle).status_code, status.HTTP_201_CREATED)
+        response = self._join(CircleFactory())
+        self.assertEqual(response.data['detail'], '参加可能なサークル数の上限に達しています。')
+        self.assertEqual(Circle.objects.get(pk=full.pk).member_count, 2)
+
+    def test_join_messages_keep_precedence(self):
+        """参加済みの場合は定員より先に参加済みであることを返すことをテスト"""
+        circle = CircleFactory(member_limit=1)
+        CircleMembershipFactory(circle=circle, user=self.user)
+
+        response = self._join(circle)
+        self.assertEqual(response.data['detail'], '既にサークルに参加しています。')
+
+    def test_reapply_after_rejection(self):
+        """拒否された申請を出し直せることをテスト"""
+        circle = CircleFactory(circle_type='approval')
+        membership = CircleMembershipFactory(circle=circle, user=self.user, status='rejected')
+
+        response = self._join(circle)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        membership.refresh_from_db()
+        self.assertEqual(membership.status, 'pending')
+        self.assertEqual(CircleMembership.objects.filter(circle=circle).count(), 1)
+
+    def test_join_query_count_is_constant(self):
+        """参加のクエリ数がメンバー数・参加中のサークル数によらないことをテスト"""
+        counts = []
+        for members in (0, 5):
+            circle = CircleFactory(member_limit=20)
+            CircleMembershipFactory.create_batch(members, circle=circle)
+            user = UserFactory()
+            CircleMembershipFactory(user=user)
+            self.client.force_authenticate(user=user)
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self._join(circle).status_code, status.HTTP_201_CREATED)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class BulkMembershipTests(APITestCase):
+    def setUp(self):
+        self.owner = UserFactory()
+        self.circle = CircleFactory(creator=self.owner, circle_type='approval', member_limit=4)
+        self.owner_membership = CircleMembershipFactory(circle=self.circle, user=self.owner, role='owner')
+        self.client.force_authenticate(user=self.owner)
+        self.layer = RecordingChannelLayer()
+        patcher = patch('knest_backend.apps.circles.memberships.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _pending(self, count):
+        return CircleMembershipFactory.create_batch(count, circle=self.circle, status='pending', joined_at=None)
+
+    def _post(self, name, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse(name, args=[self.circle.pk]), data, format='json')
+
+    def _member_count(self):
+        return Circle.objects.get(pk=self.circle.pk).member_count
+
+    def test_bulk_approve_within_limits(self):
+        """定員と参加可能サークル数の範囲で承認し、通知を1回にまとめることをテスト"""
+        requests = self._pending(4)
+        busy = requests[0].user
+        CircleMembershipFactory.create_batch(2, user=busy)
+
+        response = self._post('circle-bulk-respond', {
+            'action': 'approve',
+            'membership_ids': [str(membership.pk) for membership in requests]
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['id'] for item in response.data['approved']],
+            [str(requests[1].pk), str(requests[2].pk), str(requests[3].pk)]
+        )
+        self.assertEqual(response.data['skipped'], [
+            {'membership_id': str(requests[0].pk), 'reason': 'user_limit'}
+        ])
+        self.assertEqual(self._member_count(), 4)
+
+        more = self._pending(1)[0]
+        response = self._post('circle-bulk-respond', {
+            'action': 'approve',
+            'membership_ids': [str(more.pk)]
+        })
+        self.assertEqual(response.data['skipped'], [{'membership_id': str(more.pk), 'reason': 'full'}])
+
+        self.assertEqual(len(self.layer.sent), 1)
+        _, event = self.layer.sent[0]
+        frame = json.loads(event['text'])
+        self.assertEqual((frame['type'], frame['action'], len(frame['users'])), ('members', 'approved', 3))
+
+    def test_bulk_reject_and_remove(self):
+        """一括拒否・一括削除でメンバー数が正しく反映され、オーナーは削除されないことをテスト"""
+        requests = self._pending(2)
+        members = CircleMembershipFactory.create_batch(2, circle=self.circle)
+        self.assertEqual(self._member_count(), 3)
+
+        response = self._post('circle-bulk-respond', {
+            'action': 'reject',
+            'rejection_reason': '募集を締め切りました',
+            'membership_ids': [str(membership.pk) for membership in requests]
+        })
+        self.assertEqual(len(response.data['rejected']), 2)
+        self.assertEqual(
+            CircleMembership.objects.filter(circle=self.circle, status='rejected').count(), 2
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            response = self._post('circle-bulk-remove', {
+                'membership_ids': [str(membership.pk) for membership in members + [self.owner_membership]]
+            })
+        self.assertEqual(len(response.data['removed']), 2)
+        self.assertEqual(response.data['skipped'], [
+            {'membership_id': str(self.owner_membership.pk), 'reason': 'owner'}
+        ])
+        self.assertEqual(self._member_count(), 1)
+        member_count_updates = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE') and 'member_count' in query['sql']
+        ]
+        self.assertEqual(len(member_count_updates), 1)
+        self.assertEqual([json.loads(event['text'])['action'] for _, event in self.layer.sent], ['rejected', 'removed'])
+
+    def test_bulk_operations_require_admin(self):
+        """オーナー・管理者以外は一括操作できないことをテスト"""
+        member = CircleMembershipFactory(circle=self.circle)
+        self.client.force_authenticate(user=member.user)
+
+        response = self._post('circle-bulk-remove', {'membership_ids': [str(self.owner_membership.pk)]})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ConcurrentJoinTests(TransactionTestCase):
+    """同じサークル・同じユーザーへの同時の参加で上限を超えないことをテスト"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('インメモリのSQLiteは複数スレッドからの同時書き込みに対応していない')
+
+    def _join_concurrently(self, pairs):
+        barrier = threading.Barrier(len(pairs))
+        results = []
+
+        def join(user, circle):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            try:
+                barrier.wait()
+                response = client.post(reverse('circle-join', args=[circle.pk]))
+                results.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=join, args=pair) for pair in pairs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_joins_respect_member_limit(self):
+        circle = CircleFactory(member_limit=5)
+        results = self._join_concurrently([(UserFactory(), circle) for _ in range(20)])
+
+        self.assertEqual(results.count(status.HTTP_201_CREATED), 5)
+        self.assertEqual(results.count(status.HTTP_400_BAD_REQUEST), 15)
+        self.assertEqual(CircleMembership.objects.filter(circle=circle, status='active').count(), 5)
+        self.assertEqual(Circle.objects.get(pk=circle.pk).member_count, 5)
+
+    def test_concurrent_joins_respect_user_limit(self):
+        user = UserFactory()
+        results = self._join_concurrently([(user, CircleFactory()) for _ in range(8)])
+
+        self.assertEqual(results.count(status.HTTP_201_CREATED), 2)
+        self.assertEqual(CircleMembership.objects.filter(user=user, status='active').count(), 2)
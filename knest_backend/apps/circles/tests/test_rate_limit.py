@@ -0,0 +1,68 @@
+import json
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from ..rate_limit import ChatRateLimiter, TokenBucket
+from ..routing import websocket_urlpatterns
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_refill(self):
+        """バースト分を使い切った後は補充された分だけ受け付けることをテスト"""
+        bucket = TokenBucket(rate=2.0, capacity=3)
+        now = bucket.updated
+        self.assertEqual([bucket.consume(now) for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(bucket.consume(now), 0.5)
+        self.assertEqual(bucket.consume(now + 0.5), 0.0)
+
+
+@override_settings(CHAT_MAX_PENDING_WRITES=3, CHAT_MAX_PENDING_WRITES_PER_ROOM=2)
+class PendingWriteTests(SimpleTestCase):
+    def test_noisy_room_cannot_take_all_slots(self):
+        """1つのルームが書き込み枠を使い切れないことをテスト"""
+        limiter = ChatRateLimiter()
+        self.assertTrue(limiter.acquire_write('chat_a'))
+        self.assertTrue(limiter.acquire_write('chat_a'))
+        self.assertFalse(limiter.acquire_write('chat_a'))
+        self.assertTrue(limiter.acquire_write('chat_b'))
+        # ワーカー全体の上限
+        self.assertFalse(limiter.acquire_write('chat_c'))
+
+        limiter.release_write('chat_a')
+        self.assertTrue(limiter.acquire_write('chat_c'))
+
+
+@override_settings(CHAT_RATE_LIMIT_CONNECTION_RATE=0.01, CHAT_RATE_LIMIT_CONNECTION_BURST=2)
+class ConsumerRateLimitTests(TransactionTestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+        CircleMembershipFactory(user=self.user, circle=self.circle)
+
+    def test_client_exceeding_limit_gets_backpressure(self):
+        """上限を超えた送信が保存されず、再送までの秒数が通知されることをテスト"""
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns),
+                f'/ws/circle/{self.circle.id}/chat/'
+            )
+            communicator.scope['user'] = self.user
+            await communicator.connect()
+            for i in range(3):
+                await communicator.send_to(text_data=json.dumps({
+                    'type': 'message',
+                    'content': f'メッセージ {i}',
+                }))
+            while True:
+                frame = json.loads(await communicator.receive_from(timeout=5))
+                if frame['type'] == 'error':
+                    break
+            await communicator.disconnect()
+            return frame
+
+        frame = async_to_sync(scenario)()
+        self.assertEqual(frame['error'], 'rate_limited')
+        self.assertGreater(frame['retry_after'], 0)
+        self.assertEqual(self.circle.chats.count(), 2)
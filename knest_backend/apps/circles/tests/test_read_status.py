@@ -0,0 +1,89 @@
+from datetime import timedelta
+from django.test import TestCase
+from django.utils import timezone
+from ..models import CircleChatRead
+from ..read_status import ReadWatermarkAggregator
+from .factories import UserFactory, CircleFactory
+
+
+class ReadWatermarkAggregatorTests(TestCase):
+    def setUp(self):
+        self.aggregator = ReadWatermarkAggregator(flush_interval=60, batch_size=2)
+        self.user = UserFactory()
+        self.circle = CircleFactory()
+
+    def test_read_without_new_messages_does_not_advance(self):
+        """新着がない状態の既読は前進しないことをテスト"""
+        now = timezone.now()
+        self.aggregator.note_message(self.circle.id, now - timedelta(minutes=1))
+
+        self.assertTrue(self.aggregator.mark_read(self.user.id, self.circle.id, now))
+        self.assertFalse(
+            self.aggregator.mark_read(self.user.id, self.circle.id, now + timedelta(seconds=1))
+        )
+
+        self.aggregator.note_message(self.circle.id, now + timedelta(seconds=2))
+        self.assertTrue(
+            self.aggregator.mark_read(self.user.id, self.circle.id, now + timedelta(seconds=3))
+        )
+
+    def test_read_is_recorded_even_if_latest_message_is_stale(self):
+        """最新メッセージ時刻が古い場合も既読は記録され、通知の対象にならないだけであることをテスト"""
+        now = timezone.now()
+        CircleChatRead.objects.create(user=self.user, circle=self.circle)
+        self.aggregator.note_message(self.circle.id, now)
+        self.aggregator.mark_read(self.user.id, self.circle.id, now + timedelta(minutes=1))
+
+        # note_message() を経由しない新着の後の既読
+        later = now + timedelta(minutes=5)
+        self.assertFalse(self.aggregator.mark_read(self.user.id, self.circle.id, later))
+        self.aggregator.flush()
+        self.assertEqual(CircleChatRead.objects.get(user=self.user, circle=self.circle).last_read, later)
+
+    def test_flush_drops_written_watermarks(self):
+        """DBへ反映した既読はメモリから破棄され、反映中に更新された既読は残ることをテスト"""
+        now = timezone.now()
+        other_circle = CircleFactory()
+        self.aggregator.mark_read(self.user.id, self.circle.id, now)
+        self.aggregator.flush()
+        self.assertEqual(self.aggregator._watermarks, {})
+        self.assertEqual(self.aggregator.last_read(self.user.id, self.circle.id, now), now)
+
+        write_batch = self.aggregator._write_batch
+
+        def write_and_read_again(batch):
+            self.aggregator.mark_read(self.user.id, other_circle.id, now + timedelta(minutes=1))
+            return write_batch(batch)
+
+        self.aggregator.mark_read(self.user.id, other_circle.id, now)
+        self.aggregator._write_batch = write_and_read_again
+        self.aggregator.flush()
+        self.assertEqual(list(self.aggregator._watermarks.values()), [now + timedelta(minutes=1)])
+
+    def test_flush_writes_latest_watermark_in_batches(self):
+        """既読がまとめてDBへ反映されることをテスト"""
+        other_user = UserFactory()
+        other_circle = CircleFactory()
+        now = timezone.now()
+        CircleChatRead.objects.create(user=self.user, circle=self.circle)
+
+        self.aggregator.mark_read(self.user.id, self.circle.id, now + timedelta(minutes=5))
+        self.aggregator.mark_read(other_user.id, self.circle.id, now)
+        self.aggregator.mark_read(other_user.id, other_circle.id, now)
+
+        self.assertEqual(self.aggregator.flush(), 3)
+        self.assertEqual(self.aggregator.flush(), 0)
+        self.assertEqual(CircleChatRead.objects.count(), 3)
+        self.assertEqual(
+            CircleChatRead.objects.get(user=self.user, circle=self.circle).last_read,
+            now + timedelta(minutes=5)
+        )
+
+    def test_last_read_prefers_pending_value(self):
+        """未反映の既読がDB値より優先されることをテスト"""
+        now = timezone.now()
+        stored = now - timedelta(hours=1)
+        self.assertEqual(self.aggregator.last_read(self.user.id, self.circle.id, stored), stored)
+
+        self.aggregator.mark_read(self.user.id, self.circle.id, now)
+        self.assertEqual(self.aggregator.last_read(self.user.id, self.circle.id, stored), now)
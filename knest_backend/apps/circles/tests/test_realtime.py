@@ -0,0 +1,142 @@
+import asyncio
+import json
+from unittest.mock import patch
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from ..realtime import RoomEventCoalescer, _presence_key, _slot_key
+
+
+class RecordingChannelLayer:
+    """group_sendの呼び出しを記録するチャンネルレイヤー"""
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message))
+
+
+def user(user_id):
+    return {'id': user_id, 'username': user_id, 'display_name': user_id}
+
+
+def presence(layer):
+    """記録したオンライン状態の配信を (種類, ユーザーID) のリストで取り出す"""
+    frames = [
+        json.loads(frame)
+        for _, m in layer.sent if m['type'] == 'presence_update'
+        for frame in m['frames']
+    ]
+    layer.sent.clear()
+    return [(f['type'], f['user']['id']) for f in frames]
+
+
+class RoomEventCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.layer = RecordingChannelLayer()
+        self.coalescer = RoomEventCoalescer(
+            typing_interval=60,
+            presence_interval=60,
+            channel_layer=self.layer
+        )
+
+    def test_typing_is_throttled_per_user(self):
+        """間隔内の連続したタイピングは1回にまとめられることをテスト"""
+        for _ in range(10):
+            self.coalescer.user_typing('chat_1', user('a'))
+        self.coalescer.user_typing('chat_1', user('b'))
+
+        asyncio.run(self.coalescer.flush('chat_1'))
+
+        typing = [m for _, m in self.layer.sent if m['type'] == 'typing_batch']
+        self.assertEqual(len(typing), 1)
+        frames = [json.loads(frame) for frame in typing[0]['frames']]
+        self.assertEqual([f['type'] for f in frames], ['typing', 'typing'])
+        self.assertEqual([f['user']['id'] for f in frames], ['a', 'b'])
+
+    def test_presence_is_broadcast_as_diff(self):
+        """オンライン状態は差分のみ配信されることをテスト"""
+        self.coalescer.user_connected('chat_1', user('a'))
+        self.coalescer.user_connected('chat_1', user('b'))
+        asyncio.run(self.coalescer.flush('chat_1', force_presence=True))
+
+        # 接続と切断が間隔内に相殺された場合は何も送信しない
+        self.coalescer.user_connected('chat_1', user('c'))
+        self.coalescer.user_disconnected('chat_1', user('c'))
+        self.coalescer.user_disconnected('chat_1', user('a'))
+        asyncio.run(self.coalescer.flush('chat_1', force_presence=True))
+
+        updates = [
+            [json.loads(frame) for frame in m['frames']]
+            for _, m in self.layer.sent if m['type'] == 'presence_update'
+        ]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual({f['user']['id'] for f in updates[0] if f['type'] == 'online'}, {'a', 'b'})
+        self.assertEqual([(f['type'], f['user']['id']) for f in updates[1]], [('offline', 'a')])
+
+    def test_multiple_connections_of_same_user(self):
+        """同一ユーザーの複数接続は最後の切断でオフラインになることをテスト"""
+        self.coalescer.user_connected('chat_1', user('a'))
+        self.coalescer.user_connected('chat_1', user('a'))
+        self.coalescer.user_disconnected('chat_1', user('a'))
+
+        self.assertEqual(self.coalescer.online_users('chat_1'), {'a'})
+
+    def test_connect_during_presence_sharing_is_not_lost(self):
+        """オンライン状態の共有中に接続したユーザーが次回の配信に含まれることをテスト"""
+        share = self.coalescer._share_presence
+
+        def share_while_connecting(*args):
+            self.coalescer.user_connected('chat_1', user('b'))
+            return share(*args)
+
+        self.coalescer.user_connected('chat_1', user('a'))
+        with patch.object(self.coalescer, '_share_presence', share_while_connecting):
+            asyncio.run(self.coalescer.flush('chat_1', force_presence=True))
+        asyncio.run(self.coalescer.flush('chat_1', force_presence=True))
+
+        self.assertEqual(presence(self.layer), [('online', 'a'), ('online', 'b')])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SharedPresenceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.layer = RecordingChannelLayer()
+        self.coalescer = RoomEventCoalescer(typing_interval=60, presence_interval=60, channel_layer=self.layer)
+
+    def test_presence_is_shared_across_workers(self):
+        """複数ワーカーに接続しているユーザーは最後のワーカーの切断までオフラインを配信しないことをテスト"""
+        other_layer = RecordingChannelLayer()
+        other = RoomEventCoalescer(typing_interval=60, presence_interval=60, channel_layer=other_layer)
+
+        self.coalescer.user_connected('chat_1', user('a'))
+        asyncio.run(self.coalescer.flush('chat_1', force_presence=True))
+        other.user_connected('chat_1', user('a'))
+        asyncio.run(other.flush('chat_1', force_presence=True))
+        self.assertEqual(presence(self.layer), [('online', 'a')])
+        self.assertEqual(presence(other_layer), [])
+
+        self.coalescer.user_disconnected('chat_1', user('a'))
+        asyncio.run(self.coalescer.flush('chat_1', force_presence=True))
+        self.assertEqual(presence(self.layer), [])
+
+        other.user_disconnected('chat_1', user('a'))
+        asyncio.run(other.flush('chat_1', force_presence=True))
+        self.assertEqual(presence(other_layer), [('offline', 'a')])
+
+    def test_crashed_worker_expires(self):
+        """異常終了したワーカーの接続が期限切れになると、他のワーカーがオフラインを配信することをテスト"""
+        other_layer = RecordingChannelLayer()
+        other = RoomEventCoalescer(typing_interval=60, presence_interval=60, channel_layer=other_layer)
+        self.coalescer.user_connected('chat_1', user('a'))
+        asyncio.run(self.coalescer.flush('chat_1', force_presence=True))
+        other.user_connected('chat_1', user('a'))
+        asyncio.run(other.flush('chat_1', force_presence=True))
+
+        # 延長されなくなったキーの期限切れ
+        slot = self.coalescer._slot
+        cache.delete_many([_slot_key(slot), _presence_key('chat_1', 'a', slot)])
+
+        other.user_disconnected('chat_1', user('a'))
+        asyncio.run(other.flush('chat_1', force_presence=True))
+        self.assertEqual(presence(other_layer), [('offline', 'a')])
@@ -0,0 +1,111 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from ..models import CircleSearchHistory
+from ..search_cache import popular_searches, search_history
+from .factories import UserFactory, CircleFactory, CircleMembershipFactory
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CIRCLE_SEARCH_POPULAR_QUERIES=2
+)
+class PopularSearchCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        popular_searches.clear_local()
+        self.user = UserFactory()
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('circle-list')
+
+    def _history(self, query, count):
+        CircleSearchHistory.objects.bulk_create([
+            CircleSearchHistory(user=self.user, search_query=query, results_count=0)
+            for _ in range(count)
+        ])
+
+    def _search(self, query):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, {'search': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(context.captured_queries)
+
+    def test_popular_queries_are_normalized(self):
+        """表記ゆれをまとめて検索回数の多いクエリを集計することをテスト"""
+        self._history('ＴＥＮＮＩＳ', 2)
+        self._history('tennis ', 2)
+        self._history('ゴルフ', 3)
+        self._history('将棋', 1)
+
+        self.assertEqual(popular_searches.refresh_popular_queries(), ['tennis', 'ゴルフ'])
+
+    def test_search_records_history_for_first_page(self):
+        """検索の1ページ目のみ検索履歴に記録することをテスト"""
+        CircleFactory(name='写真部')
+        self.client.get(self.url, {'search': '写真'})
+        self.client.get(self.url, {'search': '写真', 'page': 2})
+        self.client.get(self.url)
+        # 書き込みはまとめて行う
+        self.assertFalse(CircleSearchHistory.objects.exists())
+        self.assertEqual(search_history.flush(), 1)
+
+        history = CircleSearchHistory.objects.get()
+        self.assertEqual((history.search_query, history.results_count), ('写真', 1))
+
+    def test_search_does_not_aggregate_popular_queries(self):
+        """検索時は人気のクエリを集計せず、集計結果をプロセス内に保持して参照することをテスト"""
+        self._history('ギター', 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(popular_searches.popular_queries(), [])
+
+        popular_searches.refresh_popular_queries()
+        cache.delete('circle_search_popular_queries')
+        with self.assertNumQueries(0):
+            self.assertEqual(popular_searches.popular_queries(), ['ギター'])
+
+    def test_popular_query_first_page_is_served_from_cache(self):
+        """人気のクエリの1ページ目をキャッシュから返し、参加状態はユーザーごとに求めることをテスト"""
+        joined = CircleFactory(name='ギター同好会')
+        CircleFactory(name='A', description='ギターを弾く')
+        CircleMembershipFactory(user=self.user, circle=joined)
+        self._history('ギター', 3)
+        popular_searches.refresh_popular_queries()
+
+        first, uncached_queries = self._search('ギター')
+        second, cached_queries = self._search('ギター')
+        self.assertLess(cached_queries, uncached_queries)
+        self.assertEqual(second.data['count'], 2)
+        self.assertEqual(
+            [item['id'] for item in second.data['results']],
+            [item['id'] for item in first.data['results']]
+        )
+        self.assertTrue(second.data['results'][0]['is_member'])
+        self.assertEqual(second.data['results'][0]['member_count'], 1)
+
+    def test_cache_is_invalidated_when_matching_circles_change(self):
+        """一致しうるサークルの変更時のみキャッシュを破棄することをテスト"""
+        CircleFactory(name='ギター同好会')
+        other = CircleFactory(name='料理部')
+        self._history('ギター', 3)
+        popular_searches.refresh_popular_queries()
+        self._search('ギター')
+        _, cached_queries = self._search('ギター')
+
+        # 一致しないサークルの変更ではキャッシュを使い続ける
+        other.description = '和食を作る'
+        other.save()
+        self.assertEqual(self._search('ギター')[1], cached_queries)
+
+        other.name = 'ギター初心者の会'
+        other.save()
+        response, queries = self._search('ギター')
+        self.assertGreater(queries, cached_queries)
+        self.assertEqual(response.data['count'], 2)
+
+        other.delete()
+        response, _ = self._search('ギター')
+        self.assertEqual(response.data['count'], 1)
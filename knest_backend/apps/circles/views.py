@@ -3,28 +3,54 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Prefetch
 from django_filters import rest_framework as django_filters
 from django.utils.translation import gettext_lazy as _
 from .models import Category, Circle, CircleMembership, CirclePost, CircleEvent, CircleChat, CircleChatRead
+from knest_backend.apps.interests.models import UserInterestProfile
 from .serializers import (
     CategorySerializer,
     CircleSerializer,
     CircleMembershipSerializer,
     CircleJoinRequestSerializer,
     CircleJoinResponseSerializer,
+    CircleBulkMembershipSerializer,
+    CircleBulkJoinResponseSerializer,
     CirclePostSerializer,
     CircleEventSerializer,
-    CircleChatSerializer
+    CircleChatSerializer,
+    ChatSyncRequestSerializer
 )
 from .permissions import IsCircleOwnerOrAdmin, CanJoinCircle
-from .filters import CircleFilter
+from .filters import CircleFilter, CircleSearchFilter
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from django.core.cache import cache
 from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
-from rest_framework.pagination import CursorPagination
+from django.core.paginator import Page, Paginator
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+from django.utils.dateparse import parse_datetime
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+import json
+import uuid
 from .recommendation import get_personalized_recommendations, get_trending_circles
+from .read_status import read_watermarks
+from .membership_cache import is_active_member
+from .chat_history import chat_tail, serialize_message
+from .chat_archive import archive_boundary, archived_messages
+from .debug_log import debug_trace
+from .chat_sync import build_chat_delta
+from .chat_search import search_messages
+from .chat_summary import build_chat_summaries
+from .queries import with_list_data, attach_list_data
+from .autocomplete import circle_autocomplete
+from .memberships import JoinError, join_circle, approve_requests, reject_requests, remove_members
+from .search_cache import popular_searches, search_history
+from .serializers import chat_reads_for, read_by_for
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     """カテゴリーのビューセット"""
@@ -36,10 +62,11 @@ class CircleViewSet(viewsets.ModelViewSet):
     """サークルのビューセット"""
     serializer_class = CircleSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['name', 'description', 'tags']
+    filter_backends = [filters.OrderingFilter, CircleSearchFilter]
     ordering_fields = ['created_at', 'member_count', 'post_count', 'last_activity']
     ordering = ['-last_activity']
+    # 検索の照合候補を上限で打ち切ったかどうか（CircleSearchFilter・人気のクエリのキャッシュで設定）
+    search_truncated = False
 
     def get_queryset(self):
         queryset = Circle.objects.all()
@@ -57,7 +84,10 @@ class CircleViewSet(viewsets.ModelViewSet):
         if max_members:
             queryset = queryset.filter(member_count__lte=max_members)
 
-        return queryset.distinct()
+        queryset = queryset.distinct()
+        if self.action in ('list', 'retrieve'):
+            queryset = with_list_data(queryset, self.request.user)
+        return queryset
 
     def perform_create(self, serializer):
         # ユーザーの作成可能サークル数をチェック
@@ -82,143 +112,49 @@ class CircleViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         """サークルに参加または参加申請"""
-        print(f"\n🔍 =============== サークル参加リクエスト開始 ===============")
-        print(f"📱 フロントエンドから送信されたサークルID: '{pk}'")
-        print(f"👤 リクエストユーザー: {request.user}")
-        print(f"📊 リクエストデータ: {request.data}")
-        
-        # 現在データベースに存在する有効なサークルIDを取得
-        valid_circles = Circle.objects.all()[:10]  # 最初の10個を表示
-        print(f"\n💾 バックエンド（DB）に存在する有効なサークルID:")
-        for i, circle in enumerate(valid_circles, 1):
-            status_icon = "✅" if str(circle.id) == str(pk) else "❌"
-            print(f"   {i}. {status_icon} ID: {circle.id}")
-            print(f"      Name: {circle.name}")
-            print(f"      Status: {circle.status}, Type: {circle.circle_type}")
-        
-        print(f"\n🔍 ID一致チェック:")
-        print(f"   フロントエンド送信ID: '{pk}'")
-        
+        trace = debug_trace('circles.join')
+        if trace:
+            trace.log('request', circle=pk, user=request.user.pk, data=request.data)
+
         try:
             circle = self.get_object()
-            print(f"   ✅ サークルが見つかりました!")
-            print(f"   📋 取得したサークル詳細:")
-            print(f"      ID: {circle.id}")
-            print(f"      Name: {circle.name}")
-            print(f"      Status: {circle.status}")
-            print(f"      Type: {circle.circle_type}")
-            print(f"      Member Count: {circle.member_count}")
         except Exception as e:
-            print(f"   ❌ サークルが見つかりません!")
-            print(f"   ❌ エラー: {e}")
-            print(f"   ❌ このIDはデータベースに存在しません: '{pk}'")
-            print(f"\n💡 解決方法:")
-            print(f"   1. 上記の有効なIDのいずれかを使用してください")
-            print(f"   2. アプリのキャッシュをクリアしてください") 
-            print(f"   3. 新しいユーザーでログインしてください")
-            print(f"===============================================================\n")
+            if trace:
+                trace.log('not_found', circle=pk, error=str(e))
             raise
         
         # サークルステータスチェック
         if circle.status != 'open':
-            print(f"❌ サークルが参加受付中ではありません: status={circle.status}")
+            if trace:
+                trace.log('not_open', circle=circle.id, status=circle.status)
             return Response(
                 {'detail': _('現在このサークルは参加を受け付けていません。')},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # 既に参加しているかチェック
-        existing_membership = CircleMembership.objects.filter(
-            user=request.user,
-            circle=circle
-        ).first()
-        
-        if existing_membership:
-            if existing_membership.status == 'active':
-                return Response(
-                    {'detail': _('既にサークルに参加しています。')},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            elif existing_membership.status == 'pending':
-                return Response(
-                    {'detail': _('既に参加申請中です。')},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # メンバー数上限チェック（実際のメンバー数を確認）
-        active_member_count = CircleMembership.objects.filter(
-            circle=circle,
-            status='active'
-        ).count()
-        
-        # member_limitが設定されている場合はそれを使用、なければデフォルト10
-        max_members = circle.member_limit if circle.member_limit else 10
-        
-        if active_member_count >= max_members:
-            return Response(
-                {'detail': _('サークルのメンバー数が上限に達しています。')},
-                status=status.HTTP_400_BAD_REQUEST
+        # 参加状態・定員・参加可能サークル数の判定と登録（同時の参加でも上限を超えない）
+        try:
+            membership = join_circle(
+                request.user,
+                circle,
+                application_message=request.data.get('application_message', '')
             )
-        
-        # ユーザーの参加可能サークル数チェック
-        user_active_circles = CircleMembership.objects.filter(
-            user=request.user,
-            status='active'
-        ).count()
-        max_circles = 4 if request.user.is_premium else 2
-        
-        if user_active_circles >= max_circles:
+        except JoinError as e:
+            if trace:
+                trace.log('rejected', circle=circle.id, reason=str(e))
             return Response(
-                {'detail': _('参加可能なサークル数の上限に達しています。')},
+                {'detail': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # 申請メッセージを取得
-        application_message = request.data.get('application_message', '')
-        
-        # サークルタイプに応じて処理を分岐
-        if circle.circle_type == 'public':
-            # 公開サークル：即座に参加
-            membership = CircleMembership.objects.create(
-                user=request.user,
-                circle=circle,
-                status='active',
-                joined_at=timezone.now(),
-                application_message=application_message
-            )
-            
-            # メンバー数を更新
-            circle.member_count = CircleMembership.objects.filter(
-                circle=circle,
-                status='active'
-            ).count()
-            circle.save()
-            
-            return Response({
-                'detail': _('サークルに参加しました。'),
-                'membership': CircleMembershipSerializer(membership).data
-            }, status=status.HTTP_201_CREATED)
-            
-        elif circle.circle_type == 'approval':
-            # 承認制サークル：申請として作成
-            membership = CircleMembership.objects.create(
-                user=request.user,
-                circle=circle,
-                status='pending',
-                application_message=application_message
-            )
-            
-            return Response({
-                'detail': _('参加申請を送信しました。承認をお待ちください。'),
-                'membership': CircleMembershipSerializer(membership).data
-            }, status=status.HTTP_201_CREATED)
-            
+        if membership.status == 'active':
+            detail = _('サークルに参加しました。')
         else:
-            # プライベートサークル：招待制のため申請不可
-            return Response(
-                {'detail': _('このサークルは招待制です。')},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            detail = _('参加申請を送信しました。承認をお待ちください。')
+        return Response({
+            'detail': detail,
+            'membership': CircleMembershipSerializer(membership).data
+        }, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post'])
     def leave(self, request, pk=None):
@@ -232,9 +168,6 @@ class CircleViewSet(viewsets.ModelViewSet):
             )
             membership.delete()
             
-            circle.member_count -= 1
-            circle.save()
-            
             return Response(status=status.HTTP_204_NO_CONTENT)
         except CircleMembership.DoesNotExist:
             return Response(
@@ -278,16 +211,65 @@ class CircleViewSet(viewsets.ModelViewSet):
         membership.save()
         return Response(CircleMembershipSerializer(membership).data)
 
+    @action(detail=True, methods=['post'])
+    def bulk_respond(self, request, pk=None):
+        """参加申請への一括応答（承認/拒否）"""
+        circle = self.get_object()
+        if not IsCircleOwnerOrAdmin().has_object_permission(request, self, circle):
+            return Response(
+                {'detail': '権限がありません。'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = CircleBulkJoinResponseSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        membership_ids = serializer.validated_data['membership_ids']
+
+        if serializer.validated_data['action'] == 'approve':
+            approved, skipped = approve_requests(circle, membership_ids)
+            return Response(self._bulk_result('approved', approved, skipped))
+        rejected, skipped = reject_requests(
+            circle,
+            membership_ids,
+            rejection_reason=serializer.validated_data.get('rejection_reason', '')
+        )
+        return Response(self._bulk_result('rejected', rejected, skipped))
+
+    @action(detail=True, methods=['post'])
+    def bulk_remove(self, request, pk=None):
+        """メンバーの一括削除（オーナーは削除できない）"""
+        circle = self.get_object()
+        if not IsCircleOwnerOrAdmin().has_object_permission(request, self, circle):
+            return Response(
+                {'detail': '権限がありません。'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = CircleBulkMembershipSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        removed, skipped = remove_members(circle, serializer.validated_data['membership_ids'])
+        return Response(self._bulk_result('removed', removed, skipped))
+
+    @staticmethod
+    def _bulk_result(key, memberships, skipped):
+        return {
+            key: CircleMembershipSerializer(memberships, many=True).data,
+            'skipped': [
+                {'membership_id': str(membership_id), 'reason': reason}
+                for membership_id, reason in skipped
+            ],
+        }
+
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def my(self, request):
         """
         ユーザーが参加中のサークル一覧を取得
         """
         # ユーザーが参加中のサークルを取得
-        my_circles = Circle.objects.filter(
+        my_circles = with_list_data(Circle.objects.filter(
             memberships__user=request.user,
             memberships__status='active'
-        ).distinct().order_by('-memberships__joined_at')
+        ).distinct().order_by('-memberships__joined_at'), request.user)
         
         serializer = self.get_serializer(my_circles, many=True)
         return Response({
@@ -307,11 +289,11 @@ class CircleViewSet(viewsets.ModelViewSet):
         algorithm = request.query_params.get('algorithm', 'hybrid')
         limit = int(request.query_params.get('limit', 10))
         
-        recommended_circles = get_personalized_recommendations(
+        recommended_circles = attach_list_data(get_personalized_recommendations(
             user=request.user,
             algorithm=algorithm,
             limit=limit
-        )
+        ), request.user)
         
         serializer = self.get_serializer(recommended_circles, many=True)
         return Response({
@@ -390,13 +372,30 @@ class CircleViewSet(viewsets.ModelViewSet):
             'results': serializer.data
         })
 
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        入力中の文字列に前方一致するサークル名・興味関心タグを返す（検索窓の候補表示用）
+
+        Query Parameters:
+            q: 入力中の文字列
+            limit: 種類ごとの最大件数（最大20）
+        """
+        default_limit = getattr(settings, 'CIRCLE_AUTOCOMPLETE_LIMIT', 10)
+        try:
+            limit = int(request.query_params.get('limit', default_limit))
+        except ValueError:
+            limit = default_limit
+        limit = max(1, min(limit, 20))
+        return Response(circle_autocomplete.suggest(request.query_params.get('q', ''), limit))
+
     @action(detail=False, methods=['get'])
     def trending(self, request):
         """
         トレンドサークルを取得
         """
         limit = int(request.query_params.get('limit', 10))
-        trending_circles = get_trending_circles(limit=limit)
+        trending_circles = attach_list_data(get_trending_circles(limit=limit), request.user)
         
         serializer = self.get_serializer(trending_circles, many=True)
         return Response({
@@ -424,113 +423,157 @@ class CircleViewSet(viewsets.ModelViewSet):
 
     def list(self, request):
         """サークル一覧を取得（一時的に認証不要）"""
-        print(f"\n📋 =============== サークル一覧取得リクエスト ===============")
-        print(f"👤 リクエストユーザー: {request.user}")
-        
-        queryset = self.get_queryset()
-        
-        print(f"💾 データベースから取得したサークル一覧:")
-        for i, circle in enumerate(queryset[:10], 1):
-            print(f"   {i}. ID: {circle.id}")
-            print(f"      Name: {circle.name}")
-            print(f"      Status: {circle.status}, Type: {circle.circle_type}")
-            print(f"      Members: {circle.member_count}")
-        
-        page = self.paginate_queryset(queryset)
+        trace = debug_trace('circles.list')
+        page = self._popular_search_page(request)
+        if page is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            print(f"\n📡 フロントエンドに送信するサークルデータ (ページ分割):")
-            for i, circle_data in enumerate(serializer.data, 1):
-                print(f"   {i}. 送信ID: {circle_data['id']}")
-                print(f"      Name: {circle_data['name']}")
-            print(f"===============================================================\n")
-            return self.get_paginated_response(serializer.data)
+            if trace:
+                trace.log(
+                    'response',
+                    user=request.user.pk,
+                    paginated=True,
+                    circles=[circle['id'] for circle in serializer.data]
+                )
+            self._record_search(request, self.paginator.page.paginator.count)
+            response = self.get_paginated_response(serializer.data)
+            if request.query_params.get('search', '').strip():
+                # count は照合した候補内の件数のため、打ち切った場合はそれを示す
+                response.data['search_truncated'] = self.search_truncated
+            return response
 
         serializer = self.get_serializer(queryset, many=True)
-        print(f"\n📡 フロントエンドに送信するサークルデータ (全件):")
-        for i, circle_data in enumerate(serializer.data, 1):
-            print(f"   {i}. 送信ID: {circle_data['id']}")
-            print(f"      Name: {circle_data['name']}")
-        print(f"===============================================================\n")
+        if trace:
+            trace.log(
+                'response',
+                user=request.user.pk,
+                paginated=False,
+                circles=[circle['id'] for circle in serializer.data]
+            )
+        self._record_search(request, len(serializer.data))
         return Response(serializer.data)
 
+    def _popular_search_page(self, request):
+        """
+        検索語のみを指定した1ページ目で、人気のクエリの場合はキャッシュした並び順から返す
+
+        Returns:
+            list: 1ページ分のサークル。対象外の場合はNone
+        """
+        query = request.query_params.get('search', '')
+        if (
+            not query.strip()
+            or set(request.query_params) - {'search', 'page'}
+            or request.query_params.get('page', '1') != '1'
+            or self.paginator is None
+        ):
+            return None
+        page_size = self.paginator.get_page_size(request)
+        cached = popular_searches.first_page(query, page_size)
+        if cached is None:
+            return None
+
+        circle_ids, count, self.search_truncated = cached
+        circles = {
+            str(circle.pk): circle
+            for circle in with_list_data(Circle.objects.filter(id__in=circle_ids), request.user)
+        }
+        page = [circles[circle_id] for circle_id in circle_ids if circle_id in circles]
+        self.paginator.request = request
+        self.paginator.page = Page(page, 1, Paginator(range(count), page_size))
+        return page
+
+    @staticmethod
+    def _record_search(request, results_count):
+        """検索の1ページ目の表示を検索履歴に記録する（人気のクエリの集計に使う、書き込みはまとめて行う）"""
+        query = request.query_params.get('search', '').strip()
+        if not query or not request.user.is_authenticated or request.query_params.get('page', '1') != '1':
+            return
+        search_history.record(
+            user=request.user,
+            search_query=query[:200],
+            search_filters={
+                key: value for key, value in request.query_params.items()
+                if key not in ('search', 'page')
+            },
+            results_count=results_count
+        )
+
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def members(self, request, pk=None):
         """
-        サークルメンバー一覧を取得
+        サークルメンバー一覧を取得（参加日時の新しい順）
+
+        Query Parameters:
+        - cursor: 前後のページのカーソル（レスポンスのnext / previous）
+        - page_size: 1ページの件数（既定50、最大200）
+        - fields: 'slim' の場合は自己紹介・興味関心を含めない
         """
-        try:
-            circle = self.get_object()
-            
-            # サークルメンバーのみアクセス可能
-            if not CircleMembership.objects.filter(
-                user=request.user,
-                circle=circle,
-                status='active'
-            ).exists():
-                return Response(
-                    {'error': 'サークルのメンバーのみアクセスできます'},
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-            # アクティブなメンバーを取得
-            memberships = CircleMembership.objects.filter(
-                circle=circle,
-                status='active'
-            ).select_related('user').order_by('-joined_at')
-            
-            # メンバー情報をシリアライズ
-            members_data = []
-            for membership in memberships:
-                try:
-                    # ユーザーの興味関心を取得（エラーハンドリング付き）
-                    user_interests = []
-                    try:
-                        from ..interests.models import UserInterest
-                        user_interest_objects = UserInterest.objects.filter(
-                            user=membership.user
-                        ).select_related('interest')
-                        
-                        user_interests = [
-                            {
-                                'id': str(ui.interest.id),
-                                'name': ui.interest.name,
-                                'category': ui.interest.category
-                            } for ui in user_interest_objects
-                        ]
-                    except Exception as e:
-                        print(f"興味関心取得エラー (user {membership.user.id}): {e}")
-                        user_interests = []
-                    
-                    member_data = {
-                        'id': str(membership.id),
-                        'user': {
-                            'id': str(membership.user.id),
-                            'username': membership.user.username,
-                            'displayName': getattr(membership.user, 'display_name', '') or membership.user.username,
-                            'profilePictureUrl': getattr(membership.user, 'profile_picture_url', None),
-                            'bio': getattr(membership.user, 'bio', '') or '',
-                        },
-                        'role': membership.role if hasattr(membership, 'role') else 'member',
-                        'joinedAt': membership.joined_at.isoformat() if membership.joined_at else None,
-                        'interests': user_interests
-                    }
-                    members_data.append(member_data)
-                except Exception as e:
-                    print(f"メンバーデータ構築エラー (membership {membership.id}): {e}")
-                    continue
-            
-            return Response({
-                'count': len(members_data),
-                'results': members_data
-            })
-        
-        except Exception as e:
-            print(f"メンバー取得API全体エラー: {e}")
+        circle = self.get_object()
+
+        # サークルメンバーのみアクセス可能
+        if not is_active_member(request.user.id, circle.id):
             return Response(
-                {'error': f'メンバー情報の取得に失敗しました: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'サークルのメンバーのみアクセスできます'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        slim = request.query_params.get('fields') == 'slim'
+        memberships = CircleMembership.objects.filter(
+            circle=circle,
+            status='active'
+        ).select_related('user')
+        if slim:
+            memberships = memberships.only(
+                'id', 'role', 'joined_at',
+                'user__id', 'user__username', 'user__display_name', 'user__avatar_url'
             )
+        else:
+            # ページ内のメンバーの興味関心をまとめて取得する
+            memberships = memberships.prefetch_related(
+                Prefetch(
+                    'user__hierarchical_interests',
+                    queryset=UserInterestProfile.objects.select_related('category', 'subcategory', 'tag')
+                )
+            )
+
+        # viewを渡すとサークル一覧のOrderingFilterの並び順が使われるため渡さない
+        paginator = CircleMemberPagination()
+        page = paginator.paginate_queryset(memberships, request)
+        return Response({
+            'count': circle.member_count,
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': [self._member_data(membership, slim) for membership in page],
+        })
+
+    @staticmethod
+    def _member_data(membership, slim):
+        user = membership.user
+        data = {
+            'id': str(membership.id),
+            'user': {
+                'id': str(user.id),
+                'username': user.username,
+                'displayName': user.display_name or user.username,
+                'profilePictureUrl': user.avatar_url,
+            },
+            'role': membership.role,
+            'joinedAt': membership.joined_at.isoformat() if membership.joined_at else None,
+        }
+        if not slim:
+            data['user']['bio'] = user.bio or ''
+            data['interests'] = [
+                {
+                    'id': str((interest.tag or interest.subcategory or interest.category).id),
+                    'name': (interest.tag or interest.subcategory or interest.category).name,
+                    'category': interest.category.name,
+                }
+                for interest in user.hierarchical_interests.all()
+            ]
+        return data
 
 class CircleMembershipViewSet(viewsets.ReadOnlyModelViewSet):
     """サークルメンバーシップのビューセット"""
@@ -558,11 +601,8 @@ class CirclePostViewSet(viewsets.ModelViewSet):
         circle = serializer.validated_data['circle']
         
         # メンバーかどうかチェック
-        if not CircleMembership.objects.filter(
-            user=self.request.user,
-            circle=circle
-        ).exists():
-            raise serializers.ValidationError(
+        if not is_active_member(self.request.user.id, circle.id):
+            raise ValidationError(
                 _('サークルのメンバーではありません。')
             )
         
@@ -586,19 +626,134 @@ class CircleEventViewSet(viewsets.ModelViewSet):
         circle = serializer.validated_data['circle']
         
         # メンバーかどうかチェック
-        if not CircleMembership.objects.filter(
-            user=self.request.user,
-            circle=circle
-        ).exists():
-            raise serializers.ValidationError(
+        if not is_active_member(self.request.user.id, circle.id):
+            raise ValidationError(
                 _('サークルのメンバーではありません。')
             ) 
 
-class ChatMessagePagination(CursorPagination):
-    """チャットメッセージのページネーション"""
+class CircleMemberPagination(CursorPagination):
+    """サークルメンバー一覧のカーソルページネーション（参加日時の新しい順）"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-joined_at', '-id')
+
+class ChatMessagePagination(BasePagination):
+    """
+    チャットメッセージのキーセットページネーション
+
+    (created_at, id) の組をカーソルとし、カーソルなしの場合は最新のページを返す
+    - previous: より古いメッセージ
+    - next: より新しいメッセージ
+    """
     page_size = 50
-    ordering = 'created_at'
     cursor_query_param = 'cursor'
+    invalid_cursor_message = _('無効なカーソルです。')
+
+    def has_cursor(self, request):
+        return bool(request.query_params.get(self.cursor_query_param))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            direction, created_at, pk = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            created_at = parse_datetime(created_at)
+            pk = uuid.UUID(pk)
+            if direction not in ('before', 'after') or created_at is None:
+                raise ValueError(direction)
+        except (TypeError, ValueError, binascii.Error, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return direction, created_at, pk
+
+    def encode_cursor(self, direction, created_at, pk):
+        encoded = urlsafe_b64encode(
+            json.dumps([direction, created_at.isoformat(), str(pk)]).encode()
+        ).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        circle_id = request.query_params.get('circle')
+        cursor = self.decode_cursor(request)
+
+        if cursor is not None and cursor[0] == 'after':
+            # カーソルより新しいメッセージ
+            _direction, created_at, pk = cursor
+            rows = list(queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')[:self.page_size + 1])
+            rows = self.merge_archived(rows, circle_id, after=(created_at, pk))
+            has_newer = len(rows) > self.page_size
+            rows = rows[:self.page_size]
+            self.set_links([(m.created_at, m.id) for m in rows], has_older=True, has_newer=has_newer)
+            return rows
+
+        # カーソルより古いメッセージ（カーソルなしの場合は最新）
+        queryset = queryset.order_by('-created_at', '-id')
+        before = None
+        if cursor is not None:
+            _direction, created_at, pk = cursor
+            before = (created_at, pk)
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+        rows = list(queryset[:self.page_size + 1])
+        rows = self.merge_archived(rows, circle_id, before=before)
+        has_older = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        rows.reverse()
+        self.set_links([(m.created_at, m.id) for m in rows], has_older=has_older, has_newer=cursor is not None)
+        return rows
+
+    def merge_archived(self, rows, circle_id, before=None, after=None):
+        """
+        アーカイブ済みメッセージを必要な場合のみ読み込んで結合する
+
+        直近テーブルだけでページが埋まり、かつアーカイブより新しい範囲であれば
+        アーカイブは参照しない
+        """
+        if not circle_id:
+            return rows
+        boundary = archive_boundary(circle_id)
+        if boundary is None:
+            return rows
+
+        limit = self.page_size + 1
+        if after is not None:
+            if after[0] > boundary:
+                return rows
+            archived = archived_messages(circle_id, after=after, limit=limit)
+            return self._combine(rows, archived)[:limit]
+
+        if len(rows) >= limit and rows[-1].created_at > boundary:
+            return rows
+        archived = archived_messages(circle_id, before=before, limit=limit)
+        return self._combine(rows, archived, reverse=True)[:limit]
+
+    def _combine(self, rows, archived, reverse=False):
+        """直近テーブルとアーカイブを結合する（両方にあるメッセージは直近テーブルの行を使う）"""
+        ids = {row.id for row in rows}
+        combined = rows + [message for message in archived if message.id not in ids]
+        return sorted(combined, key=lambda m: (m.created_at, m.id), reverse=reverse)
+
+    def paginate_entries(self, entries, has_older, request):
+        """末尾キャッシュのエントリからページ情報を設定する"""
+        self.base_url = request.build_absolute_uri()
+        self.set_links([(created_at, pk) for created_at, pk, _data in entries], has_older=has_older, has_newer=False)
+
+    def set_links(self, keys, has_older, has_newer):
+        self.has_older = has_older
+        self.previous_link = self.encode_cursor('before', *keys[0]) if keys and has_older else None
+        self.next_link = self.encode_cursor('after', *keys[-1]) if keys and has_newer else None
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next_link,
+            'previous': self.previous_link,
+            'results': data,
+        })
 
 class CircleChatViewSet(viewsets.ModelViewSet):
     """サークルチャットのビューセット"""
@@ -613,36 +768,15 @@ class CircleChatViewSet(viewsets.ModelViewSet):
             return CircleChat.objects.none()
 
         # サークルのメンバーかどうかチェック
-        if not CircleMembership.objects.filter(
-            user=self.request.user,
-            circle_id=circle_id,
-            status='active'
-        ).exists():
+        if not is_active_member(self.request.user.id, circle_id):
             raise PermissionDenied(_('このサークルのメンバーではありません。'))
 
-        # キャッシュキーの生成
-        cache_key = f'circle_chat_{circle_id}_messages'
-        
-        # 🔧 キャッシュを一時的に無効化
-        # cached_messages = cache.get(cache_key)
-        # if cached_messages is not None:
-        #     return cached_messages
-
         # DBからメッセージを取得
         queryset = CircleChat.objects.filter(circle_id=circle_id).select_related(
             'sender',
             'reply_to',
             'reply_to__sender'
-        ).order_by('created_at')
-
-        print(f"🔍 クエリセット取得: circle_id={circle_id}, count={queryset.count()}")
-
-        # キャッシュに保存（一時的にコメントアウト）
-        # cache.set(
-        #     cache_key,
-        #     queryset,
-        #     timeout=settings.CHAT_MESSAGE_CACHE_TIMEOUT
-        # )
+        )
 
         # 非同期で既読を更新
         transaction.on_commit(lambda: self._update_read_status(
@@ -652,24 +786,42 @@ class CircleChatViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """チャット履歴を取得（最新ページは末尾キャッシュから返す）"""
+        circle_id = request.query_params.get('circle')
+        queryset = self.get_queryset()
+        paginator = self.paginator
+        reads = chat_reads_for(circle_id) if circle_id else []
+
+        if circle_id and not paginator.has_cursor(request):
+            cached = chat_tail.get(circle_id)
+            if cached is None:
+                version = chat_tail.version(circle_id)
+                page = paginator.paginate_queryset(queryset, request, view=self)
+                entries = [serialize_message(message) for message in page]
+                chat_tail.store(circle_id, entries, paginator.has_older, version)
+            else:
+                entries, has_older = cached
+                paginator.paginate_entries(entries, has_older, request)
+        else:
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            entries = [serialize_message(message) for message in page]
+
+        return paginator.get_paginated_response([
+            dict(data, read_by=read_by_for(created_at, reads))
+            for created_at, _pk, data in entries
+        ])
+
     @staticmethod
     def _update_read_status(user_id, circle_id):
-        """既読ステータスを更新（非同期）"""
-        CircleChatRead.objects.update_or_create(
-            user_id=user_id,
-            circle_id=circle_id,
-            defaults={'last_read': timezone.now()}
-        )
+        """既読ステータスを更新（DBへはバックグラウンドの定期反映でまとめて書き込む）"""
+        read_watermarks.mark_read(user_id, circle_id, timezone.now())
 
     def perform_create(self, serializer):
         circle = serializer.validated_data['circle']
         
         # メンバーかどうかチェック
-        if not CircleMembership.objects.filter(
-            user=self.request.user,
-            circle=circle,
-            status='active'
-        ).exists():
+        if not is_active_member(self.request.user.id, circle.id):
             raise PermissionDenied(_('このサークルのメンバーではありません。'))
         
         # 返信先のメッセージが同じサークルのものかチェック
@@ -686,15 +838,93 @@ class CircleChatViewSet(viewsets.ModelViewSet):
         # メッセージを保存
         message = serializer.save(sender=self.request.user)
         
-        print(f"💾 メッセージ保存成功: content='{message.content}', circle={message.circle.name}")
-        
-        # キャッシュを削除（次のリクエストで再生成）
-        cache_key = f'circle_chat_{circle.id}_messages'
-        cache.delete(cache_key)
-        print(f"🗑️ キャッシュ削除: {cache_key}")
+        read_watermarks.note_message(circle.id, message.created_at)
+
+        trace = debug_trace('chats.create')
+        if trace:
+            trace.log('saved', circle=circle.id, message=message.id, sender=message.sender_id)
         
+        # 末尾キャッシュに追加
+        chat_tail.append(circle.id, message)
+
         return message
 
+    def perform_update(self, serializer):
+        message = serializer.save()
+        chat_tail.invalidate(message.circle_id)
+
+    def perform_destroy(self, instance):
+        circle_id = instance.circle_id
+        instance.delete()
+        chat_tail.invalidate(circle_id)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        サークル内のメッセージを検索
+
+        Query:
+            circle: サークルID
+            q: 検索語（空白区切りでAND検索）
+            before: このメッセージIDより古い一致を取得（ページング用）
+        """
+        circle_id = request.query_params.get('circle')
+        query = request.query_params.get('q', '')
+        if not circle_id:
+            raise ValidationError({'circle': _('サークルを指定してください。')})
+        if not is_active_member(request.user.id, circle_id):
+            raise PermissionDenied(_('このサークルのメンバーではありません。'))
+
+        before = None
+        before_id = request.query_params.get('before')
+        if before_id:
+            try:
+                before = CircleChat.objects.filter(
+                    id=before_id,
+                    circle_id=circle_id
+                ).values_list('created_at', 'id').get()
+            except (CircleChat.DoesNotExist, DjangoValidationError, ValueError):
+                raise ValidationError({'before': _('メッセージが見つかりません。')})
+
+        messages, has_more = search_messages(
+            circle_id,
+            query,
+            limit=getattr(settings, 'CHAT_SEARCH_PAGE_SIZE', 20),
+            before=before
+        )
+        reads = chat_reads_for(circle_id) if messages else []
+        return Response({
+            'results': [
+                dict(data, read_by=read_by_for(created_at, reads))
+                for created_at, _pk, data in map(serialize_message, messages)
+            ],
+            'has_more': has_more,
+        })
+
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """
+        参加中の全サークルの差分を取得
+
+        Body:
+        {
+            "circles": {"circle_id": "最後に受信したメッセージID", ...},
+            "since": "前回同期のsynced_at（オプション）"
+        }
+        """
+        serializer = ChatSyncRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(build_chat_delta(
+            request.user,
+            last_seen=serializer.validated_data['circles'],
+            since=serializer.validated_data['since']
+        ))
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """参加中の全サークルの最新メッセージ・未読数・最終既読時刻を取得"""
+        return Response({'results': build_chat_summaries(request.user)})
+
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
         """未読メッセージ数を取得"""
@@ -709,14 +939,17 @@ class CircleChatViewSet(viewsets.ModelViewSet):
             if unread_count is not None:
                 return Response({'unread_count': unread_count})
             
-            # DBから未読数を取得
+            # DBから未読数を取得（未反映の既読も考慮）
             try:
                 last_read = CircleChatRead.objects.get(
                     user=request.user,
                     circle_id=circle_id
                 ).last_read
             except CircleChatRead.DoesNotExist:
-                last_read = request.user.date_joined
+                last_read = None
+            last_read = read_watermarks.last_read(
+                request.user.id, circle_id, last_read
+            ) or request.user.date_joined
             
             unread_count = CircleChat.objects.filter(
                 circle_id=circle_id,
@@ -740,7 +973,7 @@ class CircleChatViewSet(viewsets.ModelViewSet):
             if unread_counts is not None:
                 return Response(unread_counts)
             
-            # DBから未読数を取得
+            # DBから未読数を取得（未反映の既読も考慮）
             unread_counts = {}
             for membership in CircleMembership.objects.filter(
                 user=request.user,
@@ -752,7 +985,10 @@ class CircleChatViewSet(viewsets.ModelViewSet):
                         circle=membership.circle
                     ).last_read
                 except CircleChatRead.DoesNotExist:
-                    last_read = request.user.date_joined
+                    last_read = None
+                last_read = read_watermarks.last_read(
+                    request.user.id, membership.circle_id, last_read
+                ) or request.user.date_joined
                 
                 unread_count = CircleChat.objects.filter(
                     circle=membership.circle,
@@ -8,6 +8,7 @@ import uuid
 
 from ..circles.models import Circle
 from ..circles.serializers import CircleSerializer
+from ..circles.queries import attach_list_data
 from .models import UserRecommendationFeedback, RecommendationMetrics
 from .engines import NextGenRecommendationEngine
 from .serializers import UserRecommendationFeedbackSerializer
@@ -63,10 +64,14 @@ class RecommendationViewSet(viewsets.ViewSet):
             # セッションID生成（フィードバック追跡用）
             session_id = str(uuid.uuid4())
             
-            # 推薦結果をシリアライズ
+            # 推薦結果をシリアライズ（メンバー数・参加状態はまとめて取得）
+            attach_list_data(
+                [item['circle'] for item in recommendation_result['recommendations']],
+                request.user
+            )
             serialized_recommendations = []
             for item in recommendation_result['recommendations']:
-                circle_data = CircleSerializer(item['circle']).data
+                circle_data = CircleSerializer(item['circle'], context={'request': request}).data
                 serialized_recommendations.append({
                     'circle': circle_data,
                     'score': round(item['score'], 3),
@@ -1,16 +1,24 @@
 import os
 from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knest_backend.settings.base')
+
+# モデルを参照するモジュールはアプリケーションの初期化後に読み込む
+django_asgi_app = get_asgi_application()
+
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+from knest_backend.apps.circles.read_status import read_watermarks
 from knest_backend.apps.circles.routing import websocket_urlpatterns
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knest_backend.settings.base')
-
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
     ),
-}) 
\ No newline at end of file
+})
+
+# 保留中の既読を定期的・終了時にDBへ反映する
+read_watermarks.start_background_flush()
@@ -84,13 +84,13 @@ WSGI_APPLICATION = "knest_backend.wsgi.application"
 ASGI_APPLICATION = "knest_backend.asgi.application"
 
 # Channels Layers
+# 開発・テスト用のプロセス内レイヤー（複数ワーカー構成はproduction.pyのRedis設定を使用）
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels.layers.InMemoryChannelLayer",
-        # "BACKEND": "channels_redis.core.RedisChannelLayer",
-        # "CONFIG": {
-        #     "hosts": [("127.0.0.1", 6379)],
-        # },
+        "CONFIG": {
+            "capacity": 1000,
+        },
     },
 }
 
@@ -196,6 +196,74 @@ CACHES = {
 CHAT_MESSAGE_CACHE_TIMEOUT = 60 * 5  # 5分
 CHAT_UNREAD_COUNT_CACHE_TIMEOUT = 60  # 1分
 
+# チャット履歴の末尾キャッシュ件数（サークルごと）
+CHAT_TAIL_CACHE_SIZE = 50
+
+# チャット差分同期でサークルごとに返す新着メッセージの上限
+CHAT_SYNC_MAX_MESSAGES_PER_CIRCLE = 100
+
+# チャット履歴のアーカイブ設定（manage.py archive_chats）
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_BATCH_SIZE = 1000
+
+# チャット検索の1ページあたりの件数
+CHAT_SEARCH_PAGE_SIZE = 20
+
+# サークル検索でトークンの出現数（絞り込み順の決定用）をキャッシュする秒数
+CIRCLE_SEARCH_FREQUENCY_CACHE_TIMEOUT = 60 * 60
+
+# サークル検索で本文と照合する候補の上限（関連度の高い順、これを超える一致は検索結果に含めない）
+CIRCLE_SEARCH_MAX_CANDIDATES = 1000
+
+# 人気の検索クエリのキャッシュ（CircleSearchHistoryから集計、manage.py warm_popular_searches）
+CIRCLE_SEARCH_POPULAR_QUERIES = 50  # キャッシュするクエリ数
+CIRCLE_SEARCH_POPULAR_DAYS = 7  # 集計対象の期間（日）
+CIRCLE_SEARCH_POPULAR_REFRESH_INTERVAL = 60 * 60  # 集計結果の有効期間（秒、warm_popular_searchesはこれより短い間隔で実行する）
+CIRCLE_SEARCH_POPULAR_LOCAL_TIMEOUT = 60  # 集計結果をプロセス内に保持する秒数
+CIRCLE_SEARCH_POPULAR_PAGE_TIMEOUT = 60 * 5  # 1ページ目のキャッシュの有効期間（秒）
+
+# 検索履歴の書き込みをまとめる間隔（秒）と件数
+CIRCLE_SEARCH_HISTORY_FLUSH_INTERVAL = 10.0
+CIRCLE_SEARCH_HISTORY_BATCH_SIZE = 100
+
+# サークル・興味関心タグのオートコンプリート
+CIRCLE_AUTOCOMPLETE_LIMIT = 10  # 種類ごとの候補数
+CIRCLE_AUTOCOMPLETE_REFRESH_INTERVAL = 30  # 他ワーカーで更新されたサークルを取り込む間隔（秒）
+CIRCLE_AUTOCOMPLETE_REBUILD_INTERVAL = 60 * 10  # 全体を作り直す間隔（秒、削除・タグの更新の反映用。バックグラウンドで構築する）
+
+# チャットのリアルタイムイベント集約間隔（秒）
+CHAT_TYPING_COALESCE_INTERVAL = 1.0  # タイピング通知
+CHAT_PRESENCE_BROADCAST_INTERVAL = 3.0  # オンライン状態
+
+# ワーカー間で共有するチャットの接続の有効期間（秒、オンライン状態の配信間隔ごとに延長し、
+# 異常終了したワーカーの接続はこの期間で消える）と、共有する最大ワーカー数
+CHAT_PRESENCE_TIMEOUT = 30
+CHAT_PRESENCE_MAX_WORKERS = 32
+
+# チャットWebSocketのDB処理用スレッド数（ワーカーあたり、DB接続数の上限以下にする）
+CHAT_DB_THREADS = 8
+
+# チャット送信のレート制限
+CHAT_RATE_LIMIT_ENABLED = True
+CHAT_RATE_LIMIT_CONNECTION_RATE = 5.0  # 接続ごとの受信フレーム数/秒
+CHAT_RATE_LIMIT_CONNECTION_BURST = 10
+CHAT_RATE_LIMIT_ROOM_RATE = 30.0  # ルームごとのメッセージ数/秒
+CHAT_RATE_LIMIT_ROOM_BURST = 60
+CHAT_RATE_LIMIT_SHARED = False  # Trueの場合はルーム単位の制限をキャッシュでワーカー間共有
+CHAT_MAX_PENDING_WRITES = 64  # ワーカーあたりのDB書き込み中メッセージ数の上限
+CHAT_MAX_PENDING_WRITES_PER_ROOM = 8
+
+# メンバーシップキャッシュのタイムアウト（秒）
+CIRCLE_MEMBERSHIP_CACHE_TIMEOUT = 60 * 10  # 10分
+
+# チャット既読のDB反映設定
+CHAT_READ_FLUSH_INTERVAL = 5.0  # 秒
+CHAT_READ_FLUSH_BATCH_SIZE = 500
+
+# エンドポイント単位のデバッグログ（エンドポイント名: サンプリング率0〜1、既定は無効）
+# 例: {'circles.list': 1.0, 'circles.join': 0.1, 'chats.create': 0.01}
+CIRCLE_DEBUG_LOG_SAMPLE_RATES = {}
+
 # Logging configuration - シンプル版
 LOGGING = {
     'version': 1,
@@ -242,6 +310,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'knest_backend.apps.circles.debug_log': {  # CIRCLE_DEBUG_LOG_SAMPLE_RATESで出力量を制御
+            'handlers': ['console'],
+            'level': 'DEBUG',
+            'propagate': False,
+        },
     },
 }
 
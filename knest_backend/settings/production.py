@@ -1,5 +1,9 @@
+import environ
+
 from .base import *
 
+env = environ.Env()
+
 DEBUG = False
 
 ALLOWED_HOSTS = ['api.knest.app']  # 本番環境のドメインに変更
@@ -17,6 +21,36 @@ DATABASES = {
     'default': env.db('DATABASE_URL')
 }
 
+# Channels Layers
+# ルームのグループ名はconsistent hashingで各Redisインスタンスへ分散される
+# 例: CHANNEL_REDIS_URLS=redis://redis-0:6379/0,redis://redis-1:6379/0
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': env.list('CHANNEL_REDIS_URLS', default=[env('REDIS_URL', default='redis://127.0.0.1:6379/0')]),
+            'prefix': 'knest',
+            'capacity': 1500,
+            'expiry': 10,
+            'group_expiry': 86400,
+        },
+    },
+}
+
+# Cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': env('CACHE_REDIS_URL', default='redis://127.0.0.1:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 5,
+            'SOCKET_TIMEOUT': 5,
+            'CONNECTION_POOL_KWARGS': {'max_connections': 100},
+        },
+    }
+}
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     'https://knest.app',
@@ -8,4 +8,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'knest_backend.settings')
 
-application = get_wsgi_application() 
\ No newline at end of file
+application = get_wsgi_application()
+
+from knest_backend.apps.circles.read_status import read_watermarks
+
+# 保留中の既読を定期的・終了時にDBへ反映する
+read_watermarks.start_background_flush()